@@ -0,0 +1,7 @@
+"""
+pdfedits的性能基准测试和完整流程的负载测试
+
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.compare baseline.json results.json
+    python -m benchmarks.load --users 1,4,16
+"""
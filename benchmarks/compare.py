@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+比较两次基准测试的结果
+
+按（文档类型, 页数, 删除比例, 输出方式）匹配用例，输出各阶段耗时中位数和峰值内存的变化。
+任一指标变慢（变大）超过阈值时以状态码1退出，可在CI中使用。
+"""
+
+import sys
+import json
+import argparse
+
+from .run import STAGES
+
+# 低于该耗时（秒）的阶段不参与回归判断，计时误差会超过阈值
+MIN_SECONDS = 0.005
+# 低于该内存增量（字节）的用例不参与回归判断
+MIN_RSS_BYTES = 1024 * 1024
+
+def _load(path):
+    with open(path, 'r', encoding='utf-8') as input_file:
+        return json.load(input_file)
+
+def _key(case):
+    return (case['kind'], case['pages'], case['delete_ratio'], case['mode'])
+
+def _change(before, after):
+    """相对变化，before为0时返回None"""
+    if not before:
+        return None
+    return (after - before) / before
+
+def compare(baseline, current, threshold):
+    """
+    比较两次运行
+
+    Args:
+        baseline (dict): 基准结果
+        current (dict): 当前结果
+        threshold (float): 判定为回归的相对变化，例如0.1表示慢10%
+
+    Returns:
+        tuple: (输出行列表, 回归列表)
+    """
+    before = {_key(case): case for case in baseline['results'] if 'error' not in case}
+    lines = []
+    regressions = []
+    for case in current['results']:
+        key = _key(case)
+        label = f"{case['kind']:<7} {case['pages']:>6}页 删除{case['delete_ratio']:>4.0%} {case['mode']:<11}"
+        if 'error' in case:
+            lines.append(f"{label} 出错: {case['error']}")
+            regressions.append((label, 'error', None))
+            continue
+        if key not in before:
+            lines.append(f"{label} 基准中没有该用例")
+            continue
+        old = before[key]
+
+        columns = []
+        for stage in STAGES:
+            old_value = old['timings'][stage]['median']
+            new_value = case['timings'][stage]['median']
+            change = _change(old_value, new_value)
+            columns.append(f"{stage}={new_value:.4f}s" + (f"({change:+.0%})" if change is not None else ""))
+            if change is not None and change > threshold and max(old_value, new_value) >= MIN_SECONDS:
+                regressions.append((label, stage, change))
+
+        old_rss = old['peak_rss_delta_bytes']
+        new_rss = case['peak_rss_delta_bytes']
+        change = _change(old_rss, new_rss)
+        columns.append(f"peak={new_rss // 1024}KB" + (f"({change:+.0%})" if change is not None else ""))
+        if change is not None and change > threshold and max(old_rss, new_rss) >= MIN_RSS_BYTES:
+            regressions.append((label, 'peak_rss', change))
+        lines.append(f"{label} {' '.join(columns)}")
+    return lines, regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='比较两次基准测试的结果')
+    parser.add_argument('baseline', help='基准结果JSON')
+    parser.add_argument('current', help='当前结果JSON')
+    parser.add_argument('--threshold', type=float, default=0.1, help='判定为回归的相对变化（默认0.1，即10%%）')
+    args = parser.parse_args()
+
+    baseline = _load(args.baseline)
+    current = _load(args.current)
+    for field in ('python', 'pypdf2', 'machine'):
+        if baseline['environment'].get(field) != current['environment'].get(field):
+            print(f"注意: 两次运行的 {field} 不同（{baseline['environment'].get(field)} -> "
+                  f"{current['environment'].get(field)}），结果可能不可比")
+
+    lines, regressions = compare(baseline, current, args.threshold)
+    for line in lines:
+        print(line)
+
+    if regressions:
+        print(f"\n发现 {len(regressions)} 项回归（阈值 {args.threshold:.0%}）:")
+        for label, metric, change in regressions:
+            print(f"  {label} {metric}" + (f" {change:+.0%}" if change is not None else ""))
+        sys.exit(1)
+    print("\n没有发现回归")
+
+if __name__ == '__main__':
+    main()
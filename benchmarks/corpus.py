@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+合成PDF测试集
+
+直接按PDF语法逐个写出对象，不依赖PyPDF2，两万页的文档也能在几秒内生成，内存占用与页数无关。
+内容由固定的随机种子生成，相同参数每次生成的文件完全相同，不同机器上的结果可以比较。
+
+文档类型：
+    text    每页一个压缩的文本内容流，所有页面共用一个标准字体
+    images  每页一张独立的图片（不可压缩的随机数据），文件大小随页数线性增长
+    shared  所有页面引用同一个资源字典（字体、图片、图形状态），考察共享对象的复制
+"""
+
+import os
+import zlib
+import random
+import argparse
+
+KINDS = ('text', 'images', 'shared')
+
+# 页面树每个节点的子节点数，与常见PDF生成器的平衡树相近
+PAGE_TREE_FANOUT = 64
+# 每页的文本行数
+TEXT_LINES = 40
+# images文档中每张图片的边长（像素），RGB每像素3字节
+IMAGE_SIDE = 48
+
+class _ObjectWriter:
+    """按对象编号顺序写出对象并记录偏移量，最后写出xref表和文件尾"""
+
+    def __init__(self, output_file):
+        self.file = output_file
+        self.offsets = {}
+        self.file.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def write(self, number, body, stream=None):
+        self.offsets[number] = self.file.tell()
+        self.file.write(b"%d 0 obj\n" % number)
+        if stream is None:
+            self.file.write(body)
+        else:
+            self.file.write(body[:-2] + b" /Length %d >>\nstream\n" % len(stream))
+            self.file.write(stream)
+            self.file.write(b"\nendstream")
+        self.file.write(b"\nendobj\n")
+
+    def finish(self, root):
+        size = max(self.offsets) + 1
+        xref = self.file.tell()
+        self.file.write(b"xref\n0 %d\n0000000000 65535 f \n" % size)
+        for number in range(1, size):
+            self.file.write(b"%010d 00000 n \n" % self.offsets[number])
+        self.file.write(b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (size, root, xref))
+
+def _text_stream(rng, page_num):
+    lines = [b"BT /F1 10 Tf 72 740 Td 12 TL"]
+    lines.append(b"(Page %d) Tj T*" % page_num)
+    # 每行8个由随机字节生成的单词，各页内容互不相同
+    text = rng.randbytes(TEXT_LINES * 20).hex().encode()
+    for offset in range(0, len(text), 40):
+        words = b" ".join(text[i:i + 5] for i in range(offset, offset + 40, 5))
+        lines.append(b"(" + words + b") Tj T*")
+    lines.append(b"ET")
+    return b"\n".join(lines)
+
+def _image_stream(rng):
+    return rng.randbytes(IMAGE_SIDE * IMAGE_SIDE * 3)
+
+def _image_header():
+    return b"<< /Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace /DeviceRGB " \
+           b"/BitsPerComponent 8 >>" % (IMAGE_SIDE, IMAGE_SIDE)
+
+def _page_tree(first_number, page_numbers):
+    """
+    为页面编号列表生成平衡的页面树
+
+    Returns:
+        tuple: (根节点编号, {节点编号: (父节点编号, 子节点编号列表, 叶子页数)}, {页面编号: 父节点编号})
+    """
+    nodes = {}
+    parents = {}
+    next_number = first_number
+    level = [(number, 1) for number in page_numbers]
+    is_leaf_level = True
+    while True:
+        groups = [level[i:i + PAGE_TREE_FANOUT] for i in range(0, len(level), PAGE_TREE_FANOUT)]
+        upper = []
+        for group in groups:
+            number = next_number
+            next_number += 1
+            nodes[number] = [None, [child for child, _ in group], sum(count for _, count in group)]
+            for child, _ in group:
+                if is_leaf_level:
+                    parents[child] = number
+                else:
+                    nodes[child][0] = number
+            upper.append((number, nodes[number][2]))
+        is_leaf_level = False
+        if len(upper) == 1:
+            return upper[0][0], nodes, parents
+        level = upper
+
+def generate(path, kind, pages, seed=0):
+    """
+    生成一个合成PDF
+
+    Args:
+        path (str): 输出文件路径
+        kind (str): 文档类型，见KINDS
+        pages (int): 页数
+        seed (int): 随机种子
+
+    Returns:
+        str: 输出文件路径
+    """
+    if kind not in KINDS:
+        raise ValueError(f"无效的文档类型: {kind}，支持: {', '.join(KINDS)}")
+    if pages < 1:
+        raise ValueError("页数必须是正整数")
+
+    rng = random.Random(f"{kind}:{pages}:{seed}")
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.part"
+
+    # 对象编号：1 文档目录，2 字体，3 共享资源字典，4 共享图片，5 图形状态；
+    # 之后每页依次为页面、内容流（images另有一张图片），最后是页面树节点
+    per_page = 3 if kind == 'images' else 2
+    page_numbers = [6 + i * per_page for i in range(pages)]
+    root, nodes, parents = _page_tree(6 + pages * per_page, page_numbers)
+
+    with open(tmp_path, 'wb') as output_file:
+        writer = _ObjectWriter(output_file)
+        writer.write(1, b"<< /Type /Catalog /Pages %d 0 R >>" % root)
+        writer.write(2, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+        writer.write(3, b"<< /Font << /F1 2 0 R >> /XObject << /Im1 4 0 R >> /ExtGState << /G1 5 0 R >> >>")
+        writer.write(4, _image_header(), _image_stream(rng))
+        writer.write(5, b"<< /Type /ExtGState /CA 0.8 /ca 0.8 >>")
+
+        for index, page in enumerate(page_numbers):
+            content = page + 1
+            stream = _text_stream(rng, index + 1)
+            if kind == 'text':
+                resources = b"<< /Font << /F1 2 0 R >> >>"
+            elif kind == 'images':
+                image = page + 2
+                resources = b"<< /Font << /F1 2 0 R >> /XObject << /Im1 %d 0 R >> >>" % image
+                stream += b"\nq 200 0 0 200 72 300 cm /Im1 Do Q"
+            else:
+                resources = b"3 0 R"
+                stream += b"\n/G1 gs q 200 0 0 200 72 300 cm /Im1 Do Q"
+            # MediaBox由页面树根节点继承
+            writer.write(page, b"<< /Type /Page /Parent %d 0 R /Resources %s /Contents %d 0 R >>"
+                         % (parents[page], resources, content))
+            writer.write(content, b"<< /Filter /FlateDecode >>", zlib.compress(stream))
+            if kind == 'images':
+                writer.write(page + 2, _image_header(), _image_stream(rng))
+
+        for number in sorted(nodes):
+            parent, kids, count = nodes[number]
+            body = b"<< /Type /Pages /Kids [" + b" ".join(b"%d 0 R" % kid for kid in kids) + b"] /Count %d" % count
+            body += b" /MediaBox [0 0 612 792] >>" if parent is None else b" /Parent %d 0 R >>" % parent
+            writer.write(number, body)
+        writer.finish(1)
+
+    os.replace(tmp_path, path)
+    return path
+
+def corpus_path(corpus_dir, kind, pages, seed=0):
+    """测试集文件的路径，文件名包含全部生成参数"""
+    return os.path.join(corpus_dir, f"{kind}_{pages}_s{seed}.pdf")
+
+def ensure(corpus_dir, kind, pages, seed=0):
+    """返回测试集文件的路径，文件不存在时生成"""
+    path = corpus_path(corpus_dir, kind, pages, seed)
+    if not os.path.exists(path):
+        generate(path, kind, pages, seed)
+    return path
+
+def main():
+    parser = argparse.ArgumentParser(description='生成合成PDF测试集')
+    parser.add_argument('output', help='输出文件路径')
+    parser.add_argument('--kind', choices=KINDS, default='text', help='文档类型')
+    parser.add_argument('--pages', type=int, default=100, help='页数')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子')
+    args = parser.parse_args()
+    generate(args.output, args.kind, args.pages, args.seed)
+    print(f"已生成 {args.output}（{os.path.getsize(args.output)} 字节）")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,477 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+上传→处理→轮询→下载的负载测试
+
+在当前进程中通过Flask测试客户端驱动 /upload、/process、/status、/download，
+每个虚拟用户反复执行完整的流程。Redis和Celery可以替换为本地的替代品：
+
+    --redis fake          进程内的fakeredis（需要安装fakeredis），不需要Redis服务
+    --redis URL           本地Redis，例如 redis://localhost:6379/15
+    --workers eager       任务在提交请求的线程中同步执行
+    --workers thread      在本进程的线程中启动真实的Celery worker，任务经过代理排队
+    --workers external    使用另外启动的worker（需要真实的Redis）
+
+并发方式：--users 为闭环并发用户数，每个用户完成一个流程后立即开始下一个；
+同时指定 --rate 时为开环，按泊松过程以每秒rate个流程到达，--users 为同时执行的上限。
+--users 或 --rate 可以是逗号分隔的多个值，依次运行，用于找出p99开始恶化的并发数。
+
+报告包括吞吐量、各接口的延迟百分位数、每个请求的Redis命令数和往返次数、
+任务排队等待时间（来自运行指标 pdf_task_queue_wait_seconds）。
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import random
+import uuid
+import shutil
+import itertools
+import tempfile
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from . import corpus
+
+ENDPOINTS = ('upload', 'process', 'status', 'download')
+PERCENTILES = (50, 90, 95, 99)
+
+# 上传内容的序号，所有轮次共用；加上本次运行的标识，连接同一个Redis的多次运行之间也不会重复
+_upload_sequence = itertools.count(1)
+_run_token = uuid.uuid4().hex.encode()
+
+# 每个线程当前请求的接口名称和Redis命令计数
+_local = threading.local()
+_counter_lock = threading.Lock()
+# {接口名称或'other': [命令数, 往返次数]}，other为请求线程之外（快速路径线程池、指标合并线程等）的命令
+_redis_ops = {}
+
+def _count_redis(commands):
+    endpoint = getattr(_local, 'endpoint', None) or 'other'
+    with _counter_lock:
+        counts = _redis_ops.setdefault(endpoint, [0, 0])
+        counts[0] += commands
+        counts[1] += 1
+
+def install_redis_counter():
+    """统计redis-py发出的命令：普通命令每条一次往返，pipeline每次execute一次往返"""
+    import redis
+    from redis.client import Pipeline
+
+    execute_command = redis.Redis.execute_command
+    pipeline_execute = Pipeline.execute
+
+    def counted_execute_command(self, *args, **options):
+        _count_redis(1)
+        return execute_command(self, *args, **options)
+
+    def counted_pipeline_execute(self, *args, **kwargs):
+        if self.command_stack:
+            _count_redis(len(self.command_stack))
+        return pipeline_execute(self, *args, **kwargs)
+
+    redis.Redis.execute_command = counted_execute_command
+    Pipeline.execute = counted_pipeline_execute
+
+def install_fake_redis():
+    """所有Redis连接指向同一个进程内的fakeredis服务器"""
+    import redis
+    try:
+        import fakeredis
+    except ImportError:
+        raise SystemExit("--redis fake 需要安装fakeredis（pip install fakeredis），或使用 --redis redis://... 连接本地Redis")
+    server = fakeredis.FakeServer()
+
+    def from_url(url, **kwargs):
+        return fakeredis.FakeRedis(server=server)
+
+    def pool_from_url(cls, url, **kwargs):
+        # pdfeditserver.connections创建的连接池保留连接数上限和健康检查，只把连接换成fakeredis
+        return cls(connection_class=fakeredis.FakeConnection, server=server, **kwargs)
+
+    redis.from_url = from_url
+    redis.Redis.from_url = classmethod(lambda cls, url, **kwargs: fakeredis.FakeRedis(server=server))
+    redis.BlockingConnectionPool.from_url = classmethod(pool_from_url)
+
+def configure_environment(args, upload_folder):
+    """在导入pdfeditserver之前设置替代的Redis、Celery代理和上传目录"""
+    os.environ['UPLOAD_FOLDER'] = upload_folder
+    os.environ.setdefault('LOG_LEVEL', args.log_level)
+    if args.redis == 'fake':
+        if args.workers == 'external':
+            raise SystemExit("--workers external 需要真实的Redis，进程内的fakeredis无法与其他进程共享")
+        install_fake_redis()
+        # 任务数据使用进程内的fakeredis（地址只用于区分客户端）；
+        # Celery代理和结果使用内存传输，与本进程中的worker线程共享
+        os.environ['REDIS_URL'] = 'redis://localhost:6379/0'
+        os.environ['CELERY_BROKER_URL'] = 'memory://'
+        os.environ['CELERY_RESULT_BACKEND'] = 'cache+memory://'
+    else:
+        os.environ['REDIS_URL'] = args.redis
+        os.environ['CELERY_BROKER_URL'] = args.redis
+        os.environ['CELERY_RESULT_BACKEND'] = args.redis
+    install_redis_counter()
+
+def percentile(sorted_values, p):
+    """最近秩法的百分位数，sorted_values已排序"""
+    if not sorted_values:
+        return None
+    rank = max(int(round(p / 100 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+def summarize(values):
+    values = sorted(values)
+    if not values:
+        return {'count': 0}
+    summary = {'count': len(values), 'mean': sum(values) / len(values), 'max': values[-1]}
+    for p in PERCENTILES:
+        summary[f"p{p}"] = percentile(values, p)
+    return summary
+
+def histogram_delta(before, after, name):
+    """
+    两次读取之间直方图的变化，合并所有标签
+
+    Returns:
+        dict: 次数、平均值和由桶估计的百分位数（线性插值，与Prometheus的histogram_quantile相同）
+    """
+    buckets = {}
+    total = count = 0.0
+    for series, value in after.items():
+        delta = value - before.get(series, 0)
+        if not delta:
+            continue
+        family = series.split('{', 1)[0]
+        if family == f"{name}_bucket":
+            bound = series.split('le="', 1)[1].split('"', 1)[0]
+            bound = float('inf') if bound == '+Inf' else float(bound)
+            buckets[bound] = buckets.get(bound, 0) + delta
+        elif family == f"{name}_sum":
+            total += delta
+        elif family == f"{name}_count":
+            count += delta
+    if not count:
+        return {'count': 0}
+
+    summary = {'count': int(count), 'mean': total / count}
+    bounds = sorted(buckets)
+    for p in PERCENTILES:
+        target = p / 100 * count
+        lower = previous = 0.0
+        for bound in bounds:
+            if buckets[bound] >= target:
+                if bound == float('inf'):
+                    summary[f"p{p}"] = lower
+                else:
+                    share = (target - previous) / (buckets[bound] - previous) if buckets[bound] > previous else 1
+                    summary[f"p{p}"] = lower + (bound - lower) * share
+                break
+            lower, previous = bound, buckets[bound]
+    return summary
+
+class LoadTest:
+    """执行一轮负载并记录结果"""
+
+    def __init__(self, app, document, args):
+        self.app = app
+        self.document = document
+        self.args = args
+        self.lock = threading.Lock()
+        self.latencies = {endpoint: [] for endpoint in ENDPOINTS}
+        self.errors = {endpoint: 0 for endpoint in ENDPOINTS}
+        self.flow_latencies = []
+        self.completion_latencies = []
+        self.flows_failed = 0
+        self.clients = threading.local()
+
+    def _client(self):
+        client = getattr(self.clients, 'client', None)
+        if client is None:
+            client = self.clients.client = self.app.test_client()
+        return client
+
+    def _request(self, endpoint, method, url, **kwargs):
+        _local.endpoint = endpoint
+        start = time.perf_counter()
+        try:
+            response = getattr(self._client(), method)(url, **kwargs)
+            # 读取完整的响应体，send_file的响应在读取时才发送文件内容
+            body = response.get_data()
+        finally:
+            _local.endpoint = None
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.latencies[endpoint].append(elapsed)
+            if response.status_code >= 400:
+                self.errors[endpoint] += 1
+        return response, body
+
+    def _next_document(self):
+        if not self.args.unique:
+            return self.document
+        # 文件末尾追加注释使每次上传的内容不同，不命中去重和结果缓存
+        return self.document + b"%load " + _run_token + b" " + str(next(_upload_sequence)).encode() + b"\n"
+
+    def flow(self, arrived=None):
+        """执行一次完整的流程，arrived为开环模式下的计划到达时间"""
+        start = arrived if arrived is not None else time.perf_counter()
+        try:
+            response, body = self._request('upload', 'post', '/upload', content_type='multipart/form-data',
+                                           data={'file': (io.BytesIO(self._next_document()), 'load.pdf')})
+            if response.status_code != 200:
+                raise RuntimeError(f"上传失败: {response.status_code}")
+            task_id = json.loads(body)['task_id']
+
+            response, body = self._request('process', 'post', '/process',
+                                           json={'task_id': task_id, 'pages_to_delete': self.args.delete})
+            if response.status_code != 200:
+                raise RuntimeError(f"处理请求失败: {response.status_code}")
+            submitted = time.perf_counter()
+            status = json.loads(body).get('status')
+
+            deadline = submitted + self.args.timeout
+            while status not in ('completed', 'failed'):
+                if time.perf_counter() > deadline:
+                    raise RuntimeError("等待任务完成超时")
+                if self.args.long_poll:
+                    url = f"/status/{task_id}?wait={self.args.long_poll}&since={status}"
+                else:
+                    time.sleep(self.args.poll_interval)
+                    url = f"/status/{task_id}"
+                response, body = self._request('status', 'get', url)
+                status = json.loads(body).get('status')
+            if status != 'completed':
+                raise RuntimeError("任务失败")
+            completed = time.perf_counter()
+
+            response, _ = self._request('download', 'get', f"/download/{task_id}")
+            if response.status_code != 200:
+                raise RuntimeError(f"下载失败: {response.status_code}")
+        except Exception:
+            with self.lock:
+                self.flows_failed += 1
+            return
+        end = time.perf_counter()
+        with self.lock:
+            self.flow_latencies.append(end - start)
+            self.completion_latencies.append(completed - submitted)
+
+    def run_closed(self, users, duration):
+        """闭环：users个用户各自循环执行流程，直到duration秒结束"""
+        deadline = time.perf_counter() + duration
+
+        def user():
+            while time.perf_counter() < deadline:
+                self.flow()
+
+        threads = [threading.Thread(target=user, name=f"load-user-{i}") for i in range(users)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def run_open(self, rate, users, duration, seed):
+        """开环：按泊松过程到达，最多users个流程同时执行，其余等待（等待时间计入流程延迟）"""
+        rng = random.Random(seed)
+        with ThreadPoolExecutor(max_workers=users, thread_name_prefix='load-user') as executor:
+            start = time.perf_counter()
+            arrival = start
+            while True:
+                arrival += rng.expovariate(rate)
+                if arrival - start >= duration:
+                    break
+                delay = arrival - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                executor.submit(self.flow, arrival)
+
+def run_stage(app, metrics, document, args, users, rate):
+    """运行一轮负载，返回报告"""
+    metrics.flush()
+    metrics_before = metrics.collect()
+    with _counter_lock:
+        redis_before = {key: list(value) for key, value in _redis_ops.items()}
+
+    test = LoadTest(app, document, args)
+    start = time.perf_counter()
+    if rate:
+        test.run_open(rate, users, args.duration, args.seed)
+    else:
+        test.run_closed(users, args.duration)
+    elapsed = time.perf_counter() - start
+
+    metrics.flush()
+    metrics_after = metrics.collect()
+    with _counter_lock:
+        redis_after = {key: list(value) for key, value in _redis_ops.items()}
+
+    flows = len(test.flow_latencies)
+    requests = sum(len(values) for values in test.latencies.values())
+    endpoints = {}
+    redis_ops = {}
+    for endpoint in ENDPOINTS + ('other',):
+        commands, round_trips = [after - before for after, before in
+                                 zip(redis_after.get(endpoint, [0, 0]), redis_before.get(endpoint, [0, 0]))]
+        calls = len(test.latencies[endpoint]) if endpoint in test.latencies else 0
+        redis_ops[endpoint] = {
+            'commands': commands,
+            'round_trips': round_trips,
+            'commands_per_request': commands / calls if calls else None,
+            'round_trips_per_request': round_trips / calls if calls else None
+        }
+        if endpoint in test.latencies:
+            endpoints[endpoint] = dict(summarize(test.latencies[endpoint]), errors=test.errors[endpoint])
+    total_commands = sum(value['commands'] for value in redis_ops.values())
+    total_round_trips = sum(value['round_trips'] for value in redis_ops.values())
+
+    dispatch = {}
+    for series, value in metrics_after.items():
+        if series.startswith('pdf_dispatch_total{'):
+            path = series.split('path="', 1)[1].split('"', 1)[0]
+            dispatch[path] = int(value - metrics_before.get(series, 0))
+
+    return {
+        'users': users,
+        'rate': rate,
+        'duration': elapsed,
+        'flows_completed': flows,
+        'flows_failed': test.flows_failed,
+        'throughput_flows_per_second': flows / elapsed,
+        'throughput_requests_per_second': requests / elapsed,
+        'flow_latency': summarize(test.flow_latencies),
+        # /process 返回到任务完成的时间（排队和执行），快速路径和eager模式下接近0
+        'completion_latency': summarize(test.completion_latencies),
+        'endpoints': endpoints,
+        'redis': dict(redis_ops, total={
+            'commands': total_commands,
+            'round_trips': total_round_trips,
+            'commands_per_flow': total_commands / flows if flows else None,
+            'round_trips_per_flow': total_round_trips / flows if flows else None,
+            'commands_per_request': total_commands / requests if requests else None
+        }),
+        'queue_wait': histogram_delta(metrics_before, metrics_after, 'pdf_task_queue_wait_seconds'),
+        'dispatch': dispatch
+    }
+
+def _format_ms(value):
+    return '-' if value is None else f"{value * 1000:.1f}"
+
+def print_stage(report):
+    """在标准错误输出中打印一轮的摘要"""
+    mode = f"rate={report['rate']}/s 上限{report['users']}" if report['rate'] else f"users={report['users']}"
+    print(f"\n== {mode}: {report['flows_completed']} 个流程完成，{report['flows_failed']} 个失败，"
+          f"{report['throughput_flows_per_second']:.2f} 流程/秒，"
+          f"{report['throughput_requests_per_second']:.1f} 请求/秒", file=sys.stderr)
+    print(f"{'':<10}{'count':>7}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}{'err':>6}{'redis/req':>11}{'rtt/req':>9}",
+          file=sys.stderr)
+    rows = [('flow', report['flow_latency'], None), ('complete', report['completion_latency'], None)]
+    rows += [(endpoint, report['endpoints'][endpoint], report['redis'][endpoint]) for endpoint in ENDPOINTS]
+    for name, summary, redis_ops in rows:
+        line = f"{name:<10}{summary['count']:>7}"
+        line += ''.join(f"{_format_ms(summary.get(key)):>9}" for key in ('p50', 'p95', 'p99', 'max'))
+        line += f"{summary.get('errors', ''):>6}"
+        if redis_ops and redis_ops['commands_per_request'] is not None:
+            line += f"{redis_ops['commands_per_request']:>11.1f}{redis_ops['round_trips_per_request']:>9.1f}"
+        print(line, file=sys.stderr)
+    queue_wait = report['queue_wait']
+    if queue_wait['count']:
+        print(f"排队等待: {queue_wait['count']} 个任务，平均 {_format_ms(queue_wait['mean'])}ms，"
+              f"p95 {_format_ms(queue_wait.get('p95'))}ms，p99 {_format_ms(queue_wait.get('p99'))}ms", file=sys.stderr)
+    total = report['redis']['total']
+    print(f"Redis: 每个流程 {total['commands_per_flow'] or 0:.1f} 条命令、{total['round_trips_per_flow'] or 0:.1f} 次往返，"
+          f"其中请求线程之外 {report['redis']['other']['commands']} 条命令、{report['redis']['other']['round_trips']} 次往返；"
+          f"处理路径 {report['dispatch']}", file=sys.stderr)
+
+def _parse_list(value, cast):
+    return [cast(item) for item in str(value).split(',') if item.strip()]
+
+def main():
+    parser = argparse.ArgumentParser(description='上传→处理→轮询→下载的负载测试')
+    parser.add_argument('--users', default='4', help='并发用户数（开环时为同时执行的上限），逗号分隔时依次运行')
+    parser.add_argument('--rate', help='开环模式的到达率（流程/秒），逗号分隔时依次运行')
+    parser.add_argument('--duration', type=float, default=10, help='每轮的持续时间（秒）')
+    parser.add_argument('--redis', default='fake', help='fake使用进程内的fakeredis，或本地Redis的URL')
+    parser.add_argument('--workers', choices=('eager', 'thread', 'external'), default='eager',
+                        help='任务的执行方式')
+    parser.add_argument('--worker-concurrency', type=int, default=2, help='--workers thread 时worker的线程数')
+    parser.add_argument('--kind', choices=corpus.KINDS, default='text', help='上传文档的类型')
+    parser.add_argument('--pages', type=int, default=20, help='上传文档的页数')
+    parser.add_argument('--delete', default='1', help='每个流程要删除的页面')
+    parser.add_argument('--same-file', dest='unique', action='store_false',
+                        help='每次上传相同的内容（命中去重和结果缓存）；默认每次上传的内容不同')
+    parser.add_argument('--poll-interval', type=float, default=0.1, help='轮询 /status 的间隔（秒）')
+    parser.add_argument('--long-poll', type=float, default=0, help='使用长轮询，每次最多等待的秒数')
+    parser.add_argument('--timeout', type=float, default=60, help='等待单个任务完成的最长时间（秒）')
+    parser.add_argument('--seed', type=int, default=0, help='开环到达时间的随机种子')
+    parser.add_argument('--corpus-dir', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), '.corpus'),
+                        help='测试文档目录')
+    parser.add_argument('--log-level', default='WARNING', help='应用的日志级别')
+    parser.add_argument('--output', help='结果JSON文件路径，默认输出到标准输出')
+    args = parser.parse_args()
+
+    user_levels = _parse_list(args.users, int)
+    rates = _parse_list(args.rate, float) if args.rate else [None]
+    if len(user_levels) > 1 and len(rates) > 1:
+        parser.error("--users 和 --rate 不能同时为多个值")
+
+    document_path = corpus.ensure(args.corpus_dir, args.kind, args.pages)
+    with open(document_path, 'rb') as document_file:
+        document = document_file.read()
+
+    upload_folder = tempfile.mkdtemp(prefix='pdfedit-load-')
+    configure_environment(args, upload_folder)
+    from pdfeditserver.app import app
+    from pdfeditserver.celery_app import celery_app, metrics
+
+    worker = None
+    if args.workers == 'eager':
+        celery_app.conf.task_always_eager = True
+    elif args.workers == 'thread':
+        from celery.contrib.testing.worker import start_worker
+        if args.redis == 'fake':
+            # 内存传输轮询队列，默认间隔1秒会计入排队等待时间
+            celery_app.conf.broker_transport_options = {'polling_interval': 0.005}
+        worker = start_worker(celery_app, concurrency=args.worker_concurrency, pool='threads',
+                              perform_ping_check=False)
+        worker.__enter__()
+
+    stages = []
+    try:
+        for users in user_levels:
+            for rate in rates:
+                report = run_stage(app, metrics, document, args, users, rate)
+                print_stage(report)
+                stages.append(report)
+    finally:
+        if worker is not None:
+            worker.__exit__(None, None, None)
+        shutil.rmtree(upload_folder, ignore_errors=True)
+
+    result = {
+        'version': 1,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'settings': {
+            'redis': 'fake' if args.redis == 'fake' else 'url',
+            'workers': args.workers,
+            'worker_concurrency': args.worker_concurrency if args.workers == 'thread' else None,
+            'document': {'kind': args.kind, 'pages': args.pages, 'bytes': len(document), 'unique': args.unique},
+            'delete': args.delete,
+            'poll_interval': args.poll_interval,
+            'long_poll': args.long_poll,
+            'duration': args.duration
+        },
+        'stages': stages
+    }
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output_file:
+            output_file.write(text + '\n')
+    else:
+        print(text)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+pdfedits基准测试
+
+对合成测试集（见corpus.py）中的每种文档类型、页数、删除比例和输出方式执行一次
+apply_edit_plan，分别记录解析（parse）、复制页面（copy）、写出（write）的耗时和进程的
+峰值内存，结果写成JSON，用compare.py比较两次运行。
+
+每个用例在单独的子进程（spawn）中执行，峰值内存不受之前用例的影响。整个过程不需要网络、
+Redis或Celery worker。
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import resource
+import statistics
+import subprocess
+import multiprocessing
+
+from . import corpus
+
+# 默认页数；--full 时加入大文档
+QUICK_SIZES = (1, 10, 100, 1000)
+FULL_SIZES = QUICK_SIZES + (5000, 20000)
+# 删除页面占总页数的比例
+DELETE_RATIOS = (0.0, 0.1, 0.5, 0.9)
+# 输出方式：rewrite/incremental对应apply_edit_plan的output_mode，large为大文件模式的逐页写出
+MODES = ('rewrite', 'incremental', 'large')
+STAGES = ('parse', 'copy', 'write', 'total')
+
+DEFAULT_CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.corpus')
+
+def pages_to_delete(pages, ratio):
+    """均匀分布在整个文档中的待删除页面，至少保留一页"""
+    count = min(int(pages * ratio), pages - 1)
+    if count <= 0:
+        return []
+    step = pages / count
+    return sorted({int(i * step) + 1 for i in range(count)})
+
+def _max_rss():
+    """进程的峰值常驻内存（字节）；Linux上ru_maxrss以KB为单位，macOS上以字节为单位"""
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage if sys.platform == 'darwin' else usage * 1024
+
+def _plan(pages, deleted):
+    """删除页面的编辑计划；不删除时保留全部页面，只测量复制整个文档的开销"""
+    from pdfeditserver.pdfedits import EditPlan
+    if deleted:
+        return EditPlan.from_delete(deleted)
+    return EditPlan([{'op': 'keep', 'pages': f"1-{pages}"}])
+
+def _run_case(connection, input_path, pages, deleted, mode, repeat, output_path):
+    """子进程中执行一个用例，通过connection返回结果"""
+    try:
+        from pdfeditserver.pdfedits import apply_edit_plan
+
+        baseline = _max_rss()
+        samples = []
+        for _ in range(repeat):
+            plan = _plan(pages, deleted)
+            timings = {}
+            start = time.perf_counter()
+            apply_edit_plan(input_path, plan, output_path=output_path, large=(mode == 'large'),
+                            output_mode='incremental' if mode == 'incremental' else 'rewrite',
+                            timings=timings)
+            timings['total'] = time.perf_counter() - start
+            samples.append(timings)
+        connection.send({
+            'samples': samples,
+            'output_bytes': os.path.getsize(output_path),
+            'baseline_rss': baseline,
+            'peak_rss': _max_rss()
+        })
+    except Exception as e:
+        connection.send({'error': f"{type(e).__name__}: {str(e)}"})
+    finally:
+        connection.close()
+        if os.path.exists(output_path):
+            os.remove(output_path)
+
+def run_case(input_path, pages, deleted, mode, repeat, work_dir):
+    """
+    在子进程中执行一个用例
+
+    Returns:
+        dict: 各阶段耗时的最小值和中位数（秒）、峰值内存等
+    """
+    context = multiprocessing.get_context('spawn')
+    receiver, sender = context.Pipe(duplex=False)
+    output_path = os.path.join(work_dir, f"bench_{os.getpid()}.pdf")
+    process = context.Process(target=_run_case, args=(sender, input_path, pages, deleted, mode, repeat, output_path))
+    process.start()
+    sender.close()
+    try:
+        result = receiver.recv()
+    except EOFError:
+        result = {'error': f"子进程异常退出（退出码 {process.exitcode}）"}
+    process.join()
+    if 'error' in result:
+        return result
+
+    timings = {}
+    for stage in STAGES:
+        values = [sample.get(stage, 0.0) for sample in result['samples']]
+        timings[stage] = {'min': min(values), 'median': statistics.median(values)}
+    return {
+        'timings': timings,
+        'output_bytes': result['output_bytes'],
+        'peak_rss_bytes': result['peak_rss'],
+        # 解析之前（导入模块之后）的内存，峰值减去它即为处理文档占用的内存
+        'peak_rss_delta_bytes': result['peak_rss'] - result['baseline_rss']
+    }
+
+def bench_output_path(repeat=10000):
+    """generate_output_path的单次耗时（秒），每个任务都会调用"""
+    from pdfeditserver.pdfedits import generate_output_path
+    start = time.perf_counter()
+    for _ in range(repeat):
+        generate_output_path('/tmp/uploads/document.pdf')
+    return (time.perf_counter() - start) / repeat
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, timeout=5,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def environment():
+    """运行环境，比较结果时用于判断两次运行是否可比"""
+    import PyPDF2
+    return {
+        'python': platform.python_version(),
+        'pypdf2': PyPDF2.__version__,
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'commit': _git_commit()
+    }
+
+def _parse_list(value, cast):
+    return [cast(item) for item in value.split(',') if item.strip()]
+
+def main():
+    parser = argparse.ArgumentParser(description='pdfedits基准测试')
+    parser.add_argument('--sizes', help=f"页数，逗号分隔（默认 {','.join(map(str, QUICK_SIZES))}）")
+    parser.add_argument('--full', action='store_true', help=f"使用完整的页数 {','.join(map(str, FULL_SIZES))}")
+    parser.add_argument('--kinds', default=','.join(corpus.KINDS), help='文档类型，逗号分隔')
+    parser.add_argument('--ratios', default=','.join(map(str, DELETE_RATIOS)), help='删除比例，逗号分隔')
+    parser.add_argument('--modes', default=','.join(MODES), help='输出方式，逗号分隔')
+    parser.add_argument('--repeat', type=int, default=3, help='每个用例的重复次数')
+    parser.add_argument('--seed', type=int, default=0, help='测试集的随机种子')
+    parser.add_argument('--corpus-dir', default=DEFAULT_CORPUS_DIR, help='测试集目录，已生成的文件会复用')
+    parser.add_argument('--output', help='结果JSON文件路径，默认输出到标准输出')
+    args = parser.parse_args()
+
+    sizes = _parse_list(args.sizes, int) if args.sizes else (FULL_SIZES if args.full else QUICK_SIZES)
+    kinds = _parse_list(args.kinds, str)
+    ratios = _parse_list(args.ratios, float)
+    modes = _parse_list(args.modes, str)
+    for kind in kinds:
+        if kind not in corpus.KINDS:
+            parser.error(f"无效的文档类型: {kind}")
+    for mode in modes:
+        if mode not in MODES:
+            parser.error(f"无效的输出方式: {mode}")
+
+    results = []
+    for kind in kinds:
+        for pages in sizes:
+            input_path = corpus.ensure(args.corpus_dir, kind, pages, args.seed)
+            for ratio in ratios:
+                deleted = pages_to_delete(pages, ratio)
+                for mode in modes:
+                    case = {'kind': kind, 'pages': pages, 'delete_ratio': ratio, 'mode': mode,
+                            'deleted_pages': len(deleted), 'input_bytes': os.path.getsize(input_path)}
+                    case.update(run_case(input_path, pages, deleted, mode, args.repeat, args.corpus_dir))
+                    results.append(case)
+                    if 'error' in case:
+                        summary = case['error']
+                    else:
+                        summary = ' '.join(f"{stage}={case['timings'][stage]['median']:.4f}s" for stage in STAGES)
+                        summary += f" peak={case['peak_rss_delta_bytes'] // 1024}KB"
+                    print(f"{kind:<7} {pages:>6}页 删除{ratio:>4.0%} {mode:<11} {summary}", file=sys.stderr)
+
+    report = {
+        'version': 1,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'environment': environment(),
+        'settings': {'repeat': args.repeat, 'seed': args.seed},
+        'micro': {'generate_output_path_seconds': bench_output_path()},
+        'results': results
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output_file:
+            output_file.write(text + '\n')
+    else:
+        print(text)
+
+if __name__ == '__main__':
+    main()
@@ -10,34 +10,108 @@ PDF编辑服务器 - 后端应用
 """
 
 import os
+import json
 import uuid
 import time
-from flask import Flask, request, jsonify, render_template, send_from_directory
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, Response, g, request, jsonify, render_template, send_file, redirect
 from werkzeug.utils import secure_filename
-import glob
+import zipfile
+import urllib.parse
 import dotenv
+from celery import chord
 
 # 加载环境变量
 dotenv.load_dotenv()
 
 # 使用相对导入
 from . import pdfedits
-from .tasks import process_pdf_task, task_store, cleanup_old_tasks
-from .celery_app import celery_app
+from .tasks import (process_pdf_task, split_pdf_task, merge_pdf_task, execute_edit, PERMANENT_ERRORS,
+                    task_store, cleanup_old_tasks, finalize_batch, summarize_batch)
+from .celery_app import celery_app, redis_client, broker_redis, batch_store, metrics, select_queue, UPLOAD_FOLDER
+from .celery_app import QUEUE_SMALL, QUEUE_LARGE, QUEUE_MAINTENANCE
+from .metrics import directory_usage
+from .connections import RedisBatch
+from .logs import SAMPLED, bind_correlation_id, reset_correlation_id
+from .blobs import blob_store, release_task_files, task_output_key, task_file_key, task_result_key
+from .storage import storage
+from .result_cache import result_cache, plan_operation
+from .upload_sessions import upload_sessions, UploadOffsetError, UploadBusyError, UploadPartMissingError, UPLOAD_CHUNK_SIZE
 
 # 创建Flask应用
 app = Flask(__name__)
 
 # 配置
-app.config['UPLOAD_FOLDER'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads')
+app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['ALLOWED_EXTENSIONS'] = {'pdf'}
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 限制上传文件大小为16MB
+app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 限制单个请求大小为16MB，更大的文件使用分块上传
 
 # 确保上传目录存在
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
-# 打印上传目录路径，便于调试
-print(f"应用中的上传目录路径: {app.config['UPLOAD_FOLDER']}")
+logger = logging.getLogger(__name__)
+logger.info(f"应用中的上传目录路径: {app.config['UPLOAD_FOLDER']}")
+
+# /status 响应需要的任务字段
+STATUS_FIELDS = ['status', 'total_pages', 'pages_kept', 'pages_deleted', 'error', 'retry_count',
+                 'output_format', 'parts']
+# 任务结束的状态，到达后停止推送
+TERMINAL_STATUSES = ('completed', 'failed')
+# 状态事件流和长轮询的最长等待时间（秒），需小于gunicorn的超时时间
+STATUS_STREAM_TIMEOUT = float(os.environ.get('STATUS_STREAM_TIMEOUT', 55))
+# 事件流心跳间隔（秒）
+SSE_KEEPALIVE_INTERVAL = 15
+# 每个Web进程中同时等待状态变化的请求数（长轮询和事件流），需小于gunicorn的--threads；
+# 等待中的请求各占用一个线程，达到上限后长轮询立即返回当前状态，事件流只发送当前状态后关闭，
+# 其余线程留给上传、下载和/process
+STATUS_STREAM_MAX_WATCHERS = int(os.environ.get('STATUS_STREAM_MAX_WATCHERS', 4))
+# 事件流因等待数达到上限而关闭时，浏览器重连前等待的时间（毫秒）
+SSE_BUSY_RETRY_MS = 3000
+# 每个批量任务最多包含的文件数
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', 500))
+# 每个合并任务最多包含的文件数
+MERGE_MAX_INPUTS = int(os.environ.get('MERGE_MAX_INPUTS', 100))
+# 快速路径：不超过该页数和大小的文件直接在Web进程中处理，同一响应中返回结果，不经过Celery
+FAST_PATH_MAX_PAGES = int(os.environ.get('FAST_PATH_MAX_PAGES', 50))
+FAST_PATH_MAX_BYTES = int(os.environ.get('FAST_PATH_MAX_BYTES', 4 * 1024 * 1024))
+# 每个Web进程中快速路径的线程数，为0时关闭快速路径；线程全部占用时请求进入任务队列
+FAST_PATH_WORKERS = int(os.environ.get('FAST_PATH_WORKERS', 2))
+# 处理路径（fast：快速路径，queued：任务队列，fast_fallback：快速路径已满或出错后转入队列）
+DISPATCH_PATHS = ('fast', 'fast_fallback', 'queued')
+
+# 快速路径的线程池在第一次使用时创建，gunicorn fork出的每个进程各自持有
+_fast_path_executor = None
+_fast_path_lock = threading.Lock()
+_fast_path_slots = threading.BoundedSemaphore(max(FAST_PATH_WORKERS, 1))
+# 状态等待的名额，每个进程各自计数
+_watcher_slots = threading.BoundedSemaphore(max(STATUS_STREAM_MAX_WATCHERS, 1))
+# 打包下载时每次读取的字节数
+ZIP_CHUNK_SIZE = 1024 * 1024
+# 下载方式：direct由Flask发送文件；accel通过X-Accel-Redirect交给nginx发送
+DOWNLOAD_MODE = os.environ.get('DOWNLOAD_MODE', 'direct')
+# nginx中映射到上传目录的internal location
+DOWNLOAD_ACCEL_PREFIX = os.environ.get('DOWNLOAD_ACCEL_PREFIX', '/uploads/')
+
+@app.before_request
+def bind_request_id():
+    """使用nginx传入的X-Request-ID（没有时生成）作为本次请求日志的关联ID"""
+    g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+    g.request_id_token = bind_correlation_id(g.request_id)
+
+@app.after_request
+def add_request_id(response):
+    """在响应中返回关联ID，便于按ID查找日志"""
+    if 'request_id' in g:
+        response.headers['X-Request-ID'] = g.request_id
+    return response
+
+@app.teardown_request
+def reset_request_id(exc):
+    if 'request_id_token' in g:
+        reset_correlation_id(g.pop('request_id_token'))
 
 def allowed_file(filename):
     """检查文件扩展名是否允许上传"""
@@ -49,6 +123,143 @@ def index():
     """渲染主页"""
     return render_template('index.html')
 
+def register_upload(stream, original_filename, **extra):
+    """
+    保存上传的文件并创建任务记录
+
+    Args:
+        stream: 上传文件的数据流
+        original_filename (str): 原始文件名
+        **extra: 需要一并写入任务记录的其他字段
+
+    Returns:
+        tuple: (任务ID, 任务记录)
+    """
+    # 按内容摘要保存文件，相同内容的文件只保存一份
+    start = time.perf_counter()
+    digest, file_key, size = blob_store.save_stream(stream)
+    metrics.observe('pdf_upload_duration_seconds', time.perf_counter() - start, kind='form')
+    metrics.inc('pdf_upload_bytes_total', size, kind='form')
+    metrics.inc('pdf_uploads_total', kind='form')
+    return create_upload_task(digest, file_key, original_filename, **extra)
+
+def create_upload_task(digest, file_key, original_filename, **extra):
+    """
+    为已放入内容寻址存储的文件创建任务记录，并记录文档描述信息
+
+    Returns:
+        tuple: (任务ID, 任务记录)
+    """
+    # 创建任务ID并存储任务信息
+    task_id = str(uuid.uuid4())
+    task = {
+        'status': 'uploaded',
+        'file_key': file_key,
+        'file_digest': digest,
+        'original_filename': original_filename,
+        'created_at': time.time()
+    }
+    task.update(extra)
+    
+    # 上传时解析一次PDF，记录文档描述信息，后续流程不再重复解析；
+    # 相同内容的文件直接使用按摘要缓存的描述信息
+    # 已知无效的文件（按摘要缓存的检查结果）直接拒绝，不再解析
+    # 两项缓存在一次往返中读取
+    with RedisBatch(redis_client) as batch:
+        cached_invalid = blob_store.get_invalid(digest, batch=batch)
+        cached_document = blob_store.get_document(digest, batch=batch)
+    invalid = cached_invalid.value
+    document = cached_document.value
+    
+    # 新的检查结果或描述信息与任务记录在一次往返中写入
+    with RedisBatch(redis_client, transaction=True) as batch:
+        try:
+            if invalid is not None:
+                metrics.inc('pdf_document_cache_total', result='invalid')
+                raise pdfedits.InvalidPDFError(invalid)
+            metrics.inc('pdf_document_cache_total', result='miss' if document is None else 'hit')
+            if document is None:
+                with storage.reading(file_key) as file_path:
+                    document = pdfedits.extract_pdf_metadata(file_path)
+                blob_store.set_document(digest, document, batch=batch)
+            task['document'] = document
+            task['total_pages'] = document['page_count']
+        except pdfedits.InvalidPDFError as e:
+            # 文件结构无效或无法解析，记录检查结果，相同内容的文件再次上传时直接拒绝；
+            # 可能来自程序错误的解析异常不记录，修复后重新上传即可处理
+            if invalid is None and e.cacheable:
+                blob_store.set_invalid(digest, str(e), batch=batch)
+            task['metadata_error'] = str(e)
+            task['invalid'] = True
+            logger.warning(f"无效的PDF文件 {digest}: {str(e)}")
+        except Exception as e:
+            task['metadata_error'] = f"获取PDF页数时出错: {str(e)}"
+            logger.error(task['metadata_error'])
+        
+        task_store.put(task_id, task, batch=batch)
+    return task_id, task
+
+def compile_edit_request(task, pages_to_delete, operations):
+    """
+    校验编辑请求并编译编辑计划，无效的请求无需进入任务队列
+
+    Args:
+        task (dict): 任务记录
+        pages_to_delete (str|list): 要删除的页面，operations为None时使用
+        operations (list): 编辑计划的操作列表
+
+    Returns:
+        tuple: (编译后的PlanPage列表，未知总页数时为None, 需要写入任务记录的请求字段)
+
+    Raises:
+        ValueError: 当页面或编辑操作无效时
+    """
+    total_pages = task.get('total_pages')
+    if operations is not None:
+        plan = pdfedits.EditPlan(operations)
+        fields = {'operations': operations}
+    else:
+        page_set = pdfedits.parse_page_spec(pages_to_delete, total_pages)
+        # 任务记录和消息中保存紧凑的范围表达式，而不是可能很长的页面列表
+        if isinstance(pages_to_delete, list):
+            pages_to_delete = page_set.to_spec()
+        plan = pdfedits.EditPlan.from_delete(pages_to_delete)
+        fields = {'pages_to_delete': pages_to_delete, 'pages_count': len(page_set)}
+    plan_pages = plan.compile(total_pages) if total_pages is not None else None
+    return plan_pages, fields
+
+def complete_from_cache(task_id, task, plan_pages, fields):
+    """
+    相同文件上的相同编辑已有结果时，直接复制缓存的输出文件并完成任务
+
+    Args:
+        plan_pages (list): 编译后的PlanPage列表
+        fields (dict): 需要一并写入任务记录的请求字段
+
+    Returns:
+        dict: 命中时返回写入任务记录的结果，未命中返回None
+    """
+    if 'file_digest' not in task or plan_pages is None:
+        return None
+    
+    cache_key = result_cache.make_key(task['file_digest'], plan_operation(plan_pages))
+    output_key = task_output_key(task_id)
+    cached = result_cache.fetch(cache_key, output_key)
+    if cached is None:
+        return None
+    
+    result = {
+        'status': 'completed',
+        'output_key': output_key,
+        'output_format': 'pdf',
+        'total_pages': cached['total_pages'],
+        'pages_kept': cached['pages_kept'],
+        'pages_deleted': cached['pages_deleted']
+    }
+    result.update(fields)
+    task_store.update(task_id, result, fetch=False)
+    return result
+
 @app.route('/upload', methods=['POST'])
 def upload_file():
     """处理文件上传请求"""
@@ -66,99 +277,242 @@ def upload_file():
     if not allowed_file(file.filename):
         return jsonify({'error': '不支持的文件类型，仅支持PDF文件'}), 400
     
-    # 确保上传目录存在
-    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-    
     # 保存原始文件名（不使用secure_filename处理，以保留中文字符）
-    original_filename = file.filename
-    
-    # 为了安全存储，使用UUID作为文件名
-    unique_id = str(uuid.uuid4())
-    _, ext = os.path.splitext(original_filename)
-    unique_filename = f"{unique_id}{ext}"
-    file_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-    file.save(file_path)
+    task_id, task = register_upload(file.stream, file.filename)
     
-    # 创建任务ID并存储任务信息
-    task_id = str(uuid.uuid4())
-    task_store[task_id] = {
+    rejected = reject_invalid_upload(task_id, task)
+    if rejected is not None:
+        return rejected
+    return jsonify(upload_response(task_id, task))
+
+def reject_invalid_upload(task_id, task):
+    """
+    无效的PDF文件在上传时直接拒绝，删除任务记录和文件
+
+    Returns:
+        Response: 文件无效时返回错误响应，否则返回None
+    """
+    if not task.get('invalid'):
+        return None
+    release_task_files(task)
+    del task_store[task_id]
+    return jsonify({'error': task['metadata_error'], 'invalid': True}), 400
+
+def upload_response(task_id, task):
+    """上传完成后的响应"""
+    response = {
+        'task_id': task_id,
         'status': 'uploaded',
-        'file_path': file_path,
-        'original_filename': original_filename,
-        'created_at': time.time()
+        'message': '文件上传成功'
     }
+    if 'total_pages' in task:
+        response['total_pages'] = task['total_pages']
+    return response
+
+@app.errorhandler(UploadPartMissingError)
+def upload_part_missing(e):
+    """分块上传的请求到达了没有临时文件的服务器，参见upload_sessions模块说明"""
+    logger.error(f"分块上传的临时文件不在此服务器上: {request.path}")
+    return jsonify({'error': str(e)}), 409
+
+@app.route('/upload/sessions', methods=['POST'])
+def create_upload_session():
+    """
+    创建分块上传会话
+
+    请求体为 {"filename": "...", "size": 总字节数}，返回会话ID和建议的分块大小。
+    """
+    data = request.get_json(silent=True)
+    if not data or not isinstance(data.get('filename'), str) or 'size' not in data:
+        return jsonify({'error': '无效的请求数据'}), 400
+    if not allowed_file(data['filename']):
+        return jsonify({'error': '不支持的文件类型，仅支持PDF文件'}), 400
+    
+    try:
+        upload_id = upload_sessions.create(data['filename'], data['size'])
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
     return jsonify({
-        'task_id': task_id,
-        'status': 'uploaded',
-        'message': '文件上传成功'
+        'upload_id': upload_id,
+        'offset': 0,
+        'size': data['size'],
+        'chunk_size': UPLOAD_CHUNK_SIZE
+    })
+
+@app.route('/upload/sessions/<upload_id>', methods=['GET'])
+def get_upload_session(upload_id):
+    """查询分块上传会话的当前偏移量，中断后从该位置继续上传；HEAD请求只返回Upload-Offset头"""
+    session = upload_sessions.get(upload_id)
+    if session is None:
+        return jsonify({'error': '上传会话不存在'}), 404
+    
+    response = jsonify({
+        'upload_id': upload_id,
+        'offset': session['offset'],
+        'size': session['size'],
+        'chunk_size': UPLOAD_CHUNK_SIZE
     })
+    response.headers['Upload-Offset'] = str(session['offset'])
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+@app.route('/upload/sessions/<upload_id>', methods=['PUT'])
+def put_upload_chunk(upload_id):
+    """
+    上传一个分块
+
+    请求体为原始字节，Upload-Offset头（或offset参数）为分块的起始偏移量，
+    必须等于已上传的字节数；不一致时返回409和当前偏移量。
+    """
+    session = upload_sessions.get(upload_id)
+    if session is None:
+        return jsonify({'error': '上传会话不存在'}), 404
+    
+    offset = request.headers.get('Upload-Offset', request.args.get('offset'))
+    try:
+        offset = int(offset)
+    except (TypeError, ValueError):
+        return jsonify({'error': '缺少有效的Upload-Offset'}), 400
+    
+    start = time.perf_counter()
+    try:
+        new_offset = upload_sessions.append(upload_id, session, request.stream, offset)
+    except UploadOffsetError as e:
+        response = jsonify({'error': str(e), 'offset': e.offset})
+        response.headers['Upload-Offset'] = str(e.offset)
+        return response, 409
+    except UploadBusyError as e:
+        return jsonify({'error': str(e)}), 409
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    metrics.observe('pdf_upload_duration_seconds', time.perf_counter() - start, kind='chunked')
+    metrics.inc('pdf_upload_bytes_total', new_offset - offset, kind='chunked')
+    
+    response = jsonify({'upload_id': upload_id, 'offset': new_offset, 'size': session['size']})
+    response.headers['Upload-Offset'] = str(new_offset)
+    return response
+
+@app.route('/upload/sessions/<upload_id>/complete', methods=['POST'])
+def complete_upload_session(upload_id):
+    """完成分块上传：计算摘要、记录文档描述信息并创建任务，响应与 /upload 相同"""
+    session = upload_sessions.get(upload_id)
+    if session is None:
+        return jsonify({'error': '上传会话不存在'}), 404
+    
+    try:
+        digest, file_key, _ = upload_sessions.finish(upload_id, session)
+    except KeyError:
+        return jsonify({'error': '上传会话不存在'}), 404
+    except UploadOffsetError as e:
+        return jsonify({'error': str(e), 'offset': e.offset}), 409
+    except UploadBusyError as e:
+        return jsonify({'error': str(e)}), 409
+    metrics.inc('pdf_uploads_total', kind='chunked')
+    
+    task_id, task = create_upload_task(digest, file_key, session['filename'])
+    rejected = reject_invalid_upload(task_id, task)
+    if rejected is not None:
+        return rejected
+    return jsonify(upload_response(task_id, task))
+
+@app.route('/upload/sessions/<upload_id>', methods=['DELETE'])
+def delete_upload_session(upload_id):
+    """放弃分块上传，删除临时文件"""
+    if upload_id not in upload_sessions.sessions:
+        return jsonify({'error': '上传会话不存在'}), 404
+    try:
+        upload_sessions.discard(upload_id)
+    except UploadBusyError as e:
+        return jsonify({'error': str(e)}), 409
+    return jsonify({'message': '上传会话已删除'})
+
+def task_queue(task):
+    """按任务记录中的页数和文件大小选择队列，参见celery_app.select_queue"""
+    return select_queue(task.get('total_pages'), task.get('document', {}).get('file_size'))
+
+def record_dispatch(path):
+    """记录一次请求的处理路径"""
+    metrics.inc('pdf_dispatch_total', path=path)
+
+def fast_path_eligible(task):
+    """文件足够小时可以在Web进程中直接处理"""
+    if FAST_PATH_WORKERS <= 0 or task.get('total_pages') is None:
+        return False
+    file_size = task.get('document', {}).get('file_size')
+    return task['total_pages'] <= FAST_PATH_MAX_PAGES and file_size is not None and \
+        file_size <= FAST_PATH_MAX_BYTES
+
+def run_fast_path(task_id, task, pages_to_delete, operations):
+    """
+    在有界线程池中同步执行编辑
+
+    Returns:
+        dict: 处理结果；线程全部占用时返回None，由调用方将请求放入任务队列
+
+    Raises:
+        与tasks.execute_edit相同
+    """
+    global _fast_path_executor
+    
+    # 不在线程池中排队：没有空闲线程时直接交给Celery，避免慢请求拖住Web进程
+    if not _fast_path_slots.acquire(blocking=False):
+        return None
+    try:
+        with _fast_path_lock:
+            if _fast_path_executor is None:
+                _fast_path_executor = ThreadPoolExecutor(max_workers=FAST_PATH_WORKERS,
+                                                         thread_name_prefix='fast-path')
+        # 线程池中的线程不继承请求的上下文，复制当前上下文在其中执行，日志带有本次请求的关联ID
+        context = contextvars.copy_context()
+        future = _fast_path_executor.submit(context.run, execute_edit, task_id, task_file_key(task),
+                                            task['total_pages'], pages_to_delete, operations,
+                                            task.get('file_digest'))
+        return future.result()
+    finally:
+        _fast_path_slots.release()
 
 @app.route('/process', methods=['POST'])
 def process_file():
-    """处理PDF编辑请求"""
+    """
+    处理PDF编辑请求
+
+    pages_to_delete为要删除的页面；operations为编辑计划的操作列表，
+    可以组合删除、保留、重排、旋转、复制和插入空白页，参见pdfedits.EditPlan。
+    """
     data = request.json
     
     # 验证请求数据
-    if not data or 'task_id' not in data or 'pages_to_delete' not in data:
+    if not data or 'task_id' not in data or ('pages_to_delete' not in data and 'operations' not in data):
         return jsonify({'error': '无效的请求数据'}), 400
     
     task_id = data['task_id']
-    pages_to_delete = data['pages_to_delete']
+    pages_to_delete = data.get('pages_to_delete', '')
+    operations = data.get('operations')
     
     # 检查任务是否存在
-    if task_id not in task_store:
+    task = task_store.get(task_id)
+    if task is None:
         return jsonify({'error': '任务不存在'}), 404
     
-    # 检查页面号是否有效
-    if not all(isinstance(page, int) and page > 0 for page in pages_to_delete):
-        return jsonify({'error': '页面号必须是正整数'}), 400
+    # 页面可以是页面号列表，也可以是范围表达式，例如 "1-500,702,900-"、"odd"、"even"
+    if operations is None and not isinstance(pages_to_delete, (list, str)):
+        return jsonify({'error': '页面号必须是正整数列表或页面范围表达式'}), 400
     
-    # 获取文件路径和原始文件名
-    file_path = task_store[task_id]['file_path']
-    original_filename = task_store[task_id]['original_filename']
+    # 获取文件的存储键和原始文件名
+    file_key = task_file_key(task)
+    original_filename = task['original_filename']
     
-    # 打印调试信息
-    print(f"处理PDF请求: task_id={task_id}, pages_to_delete={pages_to_delete}")
+    logger.info("处理PDF请求: task_id=%s, pages_to_delete=%s, operations=%s", task_id, pages_to_delete, operations)
     
-    # 如果是空的pages_to_delete（即只是获取PDF信息），直接处理而不使用Celery
-    if not pages_to_delete:
-        print(f"这是一个PDF信息请求，直接处理")
-        try:
-            import PyPDF2
-            with open(file_path, 'rb') as pdf_file:
-                pdf_reader = PyPDF2.PdfReader(pdf_file)
-                total_pages = len(pdf_reader.pages)
-                
-                # 更新任务信息 - 直接设置为completed
-                task_store[task_id].update({
-                    'status': 'completed',
-                    'total_pages': total_pages,
-                    'pages_kept': total_pages,
-                    'pages_deleted': 0
-                })
-                
-                print(f"PDF信息获取完成，总页数: {total_pages}")
-                
-                # 构建响应
-                response = {
-                    'task_id': task_id,
-                    'status': 'completed',
-                    'message': 'PDF信息获取完成',
-                    'total_pages': total_pages,
-                    'pages_kept': total_pages,
-                    'pages_deleted': 0
-                }
-                
-                print(f"返回响应: {response}")
-                return jsonify(response)
-                
-        except Exception as e:
-            error_msg = f"获取PDF页数时出错: {str(e)}"
-            print(error_msg)
+    # 如果是空的pages_to_delete（即只是获取PDF信息），直接使用上传时记录的文档信息
+    if operations is None and not (pages_to_delete.strip() if isinstance(pages_to_delete, str) else pages_to_delete):
+        if 'total_pages' not in task:
+            error_msg = task.get('metadata_error', '获取PDF页数时出错: 缺少文档信息')
+            logger.error(error_msg)
             
             # 更新任务状态为失败
-            task_store[task_id].update({
+            task_store.update(task_id, {
                 'status': 'failed',
                 'error': error_msg
             })
@@ -168,74 +522,259 @@ def process_file():
                 'status': 'failed',
                 'error': error_msg
             }), 500
+        
+        total_pages = task['total_pages']
+        
+        # 更新任务信息 - 直接设置为completed
+        task_store.update(task_id, {
+            'status': 'completed',
+            'pages_kept': total_pages,
+            'pages_deleted': 0
+        })
+        
+        logger.info(f"PDF信息获取完成，总页数: {total_pages}")
+        
+        # 构建响应
+        response = {
+            'task_id': task_id,
+            'status': 'completed',
+            'message': 'PDF信息获取完成',
+            'total_pages': total_pages,
+            'pages_kept': total_pages,
+            'pages_deleted': 0
+        }
+        
+        logger.debug("返回响应: %s", response)
+        return jsonify(response)
     
-    # 对于实际的页面删除操作，使用Celery异步处理
-    # 启动Celery任务处理PDF
-    celery_task = process_pdf_task.delay(task_id, file_path, pages_to_delete, original_filename)
+    # 提前解析并校验页面和编辑操作，无效的请求无需进入任务队列
+    try:
+        plan_pages, fields = compile_edit_request(task, pages_to_delete, operations)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    pages_to_delete = fields.get('pages_to_delete', '')
     
-    # 更新任务信息
-    task_store[task_id].update({
-        'status': 'processing',
-        'celery_task_id': celery_task.id,
-        'pages_to_delete': pages_to_delete,
-        'pages_count': len(pages_to_delete)
-    })
+    # 相同文件上的相同编辑已有结果时直接返回，不进入任务队列
+    result = complete_from_cache(task_id, task, plan_pages, fields)
+    if result is not None:
+        response = build_status_response(task_id, result)
+        response['message'] = 'PDF处理已完成'
+        logger.info("命中结果缓存: %s", task_id)
+        logger.debug("返回响应: %s", response)
+        return jsonify(response)
+    
+    # 先更新任务信息，避免覆盖worker已经写入的完成状态；
+    # 直接进入任务队列时预先生成Celery任务ID，与状态在同一次往返中写入
+    fast_path = fast_path_eligible(task)
+    celery_task_id = str(uuid.uuid4())
+    update = dict(fields, status='processing')
+    if not fast_path:
+        update['celery_task_id'] = celery_task_id
+    task_store.update(task_id, update, fetch=False)
+    
+    # 小文件直接在Web进程中处理，省去任务队列的往返和客户端轮询
+    if fast_path:
+        try:
+            result = run_fast_path(task_id, task, pages_to_delete, operations)
+        except PERMANENT_ERRORS as e:
+            # 与Celery任务相同，这些错误重试也不会成功
+            task_store.update(task_id, {'status': 'failed', 'error': str(e)}, fetch=False)
+            record_dispatch('fast')
+            return jsonify({'task_id': task_id, 'status': 'failed', 'error': str(e)})
+        except Exception as e:
+            # 其他错误交给Celery任务处理，失败时可以重试
+            logger.warning(f"快速路径处理出错，转入任务队列: {str(e)}")
+            result = None
+        if result is not None:
+            record_dispatch('fast')
+            response = build_status_response(task_id, result)
+            response['message'] = 'PDF处理已完成'
+            response.update(fields)
+            logger.info("快速路径处理完成: %s", task_id)
+            logger.debug("返回响应: %s", response)
+            return jsonify(response)
+        record_dispatch('fast_fallback')
+    
+    # 对于实际的编辑操作，使用Celery异步处理
+    record_dispatch('queued')
+    process_pdf_task.apply_async((task_id, file_key, pages_to_delete, original_filename, operations),
+                                 queue=task_queue(task), task_id=celery_task_id)
+    if fast_path:
+        task_store.update(task_id, {'celery_task_id': celery_task_id}, fetch=False)
     
     # 构建响应
     response = {
         'task_id': task_id,
         'status': 'processing',
-        'message': 'PDF处理已开始',
-        'pages_to_delete': pages_to_delete,
-        'pages_count': len(pages_to_delete)
+        'message': 'PDF处理已开始'
     }
+    response.update(fields)
     
     # 如果任务存储中已经有total_pages信息，添加到响应中
-    if 'total_pages' in task_store[task_id]:
-        response['total_pages'] = task_store[task_id]['total_pages']
-        print(f"响应中包含总页数: {response['total_pages']}")
+    if 'total_pages' in task:
+        response['total_pages'] = task['total_pages']
     
-    print(f"返回响应: {response}")
+    logger.debug("返回响应: %s", response)
     return jsonify(response)
 
-@app.route('/status/<task_id>', methods=['GET'])
-def get_status(task_id):
-    """获取任务状态"""
-    if task_id not in task_store:
+@app.route('/split', methods=['POST'])
+def split_file():
+    """
+    将PDF拆分为多个文件，结果打包为一个ZIP下载
+
+    请求体为 {"task_id": ..., "ranges": "1-3,4-10,11-"}（每一项生成一个文件），
+    或 {"task_id": ..., "every": 10}（每10页生成一个文件）。
+    """
+    data = request.json
+    if not data or 'task_id' not in data or ('ranges' not in data and 'every' not in data):
+        return jsonify({'error': '无效的请求数据'}), 400
+    
+    task_id = data['task_id']
+    ranges = data.get('ranges')
+    every = data.get('every')
+    
+    task = task_store.get(task_id)
+    if task is None:
         return jsonify({'error': '任务不存在'}), 404
     
-    task = task_store[task_id]
+    # 已知总页数时提前校验拆分范围，无效的请求无需进入任务队列
+    try:
+        if 'total_pages' in task:
+            parts = len(pdfedits.parse_split_spec(ranges, every, task['total_pages']))
+        elif (ranges is None) == (every is None):
+            raise ValueError("拆分时必须且只能指定 ranges 或 every 之一")
+        else:
+            parts = None
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # 预先生成Celery任务ID，与状态在同一次往返中写入
+    celery_task_id = str(uuid.uuid4())
+    task_store.update(task_id, {'status': 'processing', 'celery_task_id': celery_task_id}, fetch=False)
+    split_pdf_task.apply_async((task_id, task_file_key(task), task['original_filename']),
+                               {'ranges': ranges, 'every': every}, queue=task_queue(task), task_id=celery_task_id)
+    
+    response = {
+        'task_id': task_id,
+        'status': 'processing',
+        'message': 'PDF拆分已开始'
+    }
+    if parts is not None:
+        response['parts'] = parts
+    if 'total_pages' in task:
+        response['total_pages'] = task['total_pages']
+    return jsonify(response)
+
+def rollback_acquired(sources, acquired, task_ids):
+    """
+    检查为已有文件增加的引用，有文件的引用已经归零时撤销本次创建的任务
+
+    引用归零说明源任务在读取之后被删除，文件正在或已经被删除，不能再引用。
+
+    Args:
+        sources (list): 源任务记录
+        acquired (list): 与sources对应的blob_store.acquire结果（BatchResult）
+        task_ids (list): 与引用在同一次往返中创建的任务ID
+
+    Returns:
+        int: 第一个文件已被删除的源任务的序号；全部引用成功时返回None
+    """
+    failed = [index for index, result in enumerate(acquired) if not result.value]
+    if not failed:
+        return None
+    for source, result in zip(sources, acquired):
+        if result.value:
+            blob_store.release(source['file_digest'])
+    task_store.delete_many(task_ids)
+    return failed[0]
+
+@app.route('/merge', methods=['POST'])
+def merge_files():
+    """
+    按顺序合并多个已上传的PDF
+
+    请求体为 {"items": [{"task_id": ..., "pages": "1-3"}, {"task_id": ...}], "filename": "merged.pdf"}；
+    pages为该文件中保留的页面，省略时保留全部页面；项中提供operations时按编辑计划选择页面。
+    内容相同的字体、图片等资源只写入一次。合并结果作为一个新任务，通过/status和/download查询、下载。
+    """
+    data = request.get_json(silent=True)
+    if not data or not isinstance(data.get('items'), list) or len(data['items']) < 2:
+        return jsonify({'error': '合并至少需要两个文件'}), 400
+    if len(data['items']) > MERGE_MAX_INPUTS:
+        return jsonify({'error': f'每次最多合并 {MERGE_MAX_INPUTS} 个文件'}), 400
+    
+    items = data['items']
+    if not all(isinstance(item, dict) for item in items):
+        return jsonify({'error': '无效的请求数据'}), 400
+    
+    sources = task_store.mget([item.get('task_id') for item in items])
+    plans = []
+    for item, source in zip(items, sources):
+        if source is None or 'file_digest' not in source:
+            return jsonify({'error': f"任务不存在: {item.get('task_id')}"}), 404
+        # 提前校验每个文件的页面选择，无效的请求无需进入任务队列
+        if 'operations' in item:
+            operations = item['operations']
+        elif item.get('pages'):
+            operations = [{'op': 'keep', 'pages': item['pages']}]
+        else:
+            operations = None
+        try:
+            if operations is not None and 'total_pages' in source:
+                pdfedits.EditPlan(operations).compile(source['total_pages'])
+            elif operations is not None:
+                pdfedits.EditPlan(operations)
+        except ValueError as e:
+            return jsonify({'error': f"{source.get('original_filename', item.get('task_id'))}: {str(e)}"}), 400
+        plans.append(operations)
+    
+    # 合并任务持有每个输入文件的引用，输入任务被删除后文件仍然可用；
+    # 引用和任务记录（包括预先生成的Celery任务ID）在一次往返中写入
+    task_id = str(uuid.uuid4())
+    celery_task_id = str(uuid.uuid4())
+    # 与上传文件相同，文件名只用于下载时的Content-Disposition，保留中文字符
+    filename = os.path.basename(str(data.get('filename') or '')) or 'merged.pdf'
+    with RedisBatch(redis_client, transaction=True) as batch:
+        acquired = [blob_store.acquire(source['file_digest'], batch=batch) for source in sources]
+        task_store.put(task_id, {
+            'status': 'processing',
+            'original_filename': filename,
+            'source_digests': [source['file_digest'] for source in sources],
+            'source_task_ids': [item['task_id'] for item in items],
+            'celery_task_id': celery_task_id,
+            'created_at': time.time()
+        }, batch=batch)
+    
+    # 输入任务在此期间被删除、文件的引用已归零时撤销合并任务
+    missing = rollback_acquired(sources, acquired, [task_id])
+    if missing is not None:
+        return jsonify({'error': f"任务不存在: {items[missing]['task_id']}"}), 404
+    merge_sources = [[blob_store.key(source['file_digest']), operations] for source, operations in zip(sources, plans)]
     
-    # 打印调试信息
-    print(f"获取任务状态: {task_id}")
-    print(f"任务信息: {task}")
+    # 输入文件的页数和大小之和决定合并任务的队列
+    total_pages = sum(source.get('total_pages', 0) for source in sources)
+    total_bytes = sum(source.get('document', {}).get('file_size', 0) for source in sources)
+    merge_pdf_task.apply_async((task_id, merge_sources), queue=select_queue(total_pages, total_bytes),
+                               task_id=celery_task_id)
     
+    return jsonify({
+        'task_id': task_id,
+        'status': 'processing',
+        'message': f'PDF合并已开始，共 {len(items)} 个文件'
+    })
+
+def build_status_response(task_id, task):
+    """根据任务字段构建状态响应"""
     response = {
         'task_id': task_id,
         'status': task['status']
     }
     
-    # 如果有total_pages信息，始终返回
+    # 总页数在上传时已记录，这里直接返回，不再解析PDF
     if 'total_pages' in task:
         response['total_pages'] = task['total_pages']
-        print(f"响应中包含总页数: {response['total_pages']}")
     else:
-        print(f"警告: 任务 {task_id} 中没有total_pages信息")
-        
-        # 尝试从文件中获取总页数
-        if 'file_path' in task and os.path.exists(task['file_path']):
-            try:
-                import PyPDF2
-                with open(task['file_path'], 'rb') as pdf_file:
-                    pdf_reader = PyPDF2.PdfReader(pdf_file)
-                    total_pages = len(pdf_reader.pages)
-                    
-                    # 更新任务信息
-                    task_store[task_id]['total_pages'] = total_pages
-                    response['total_pages'] = total_pages
-                    print(f"从文件中获取到总页数: {total_pages}")
-            except Exception as e:
-                print(f"尝试获取PDF页数时出错: {str(e)}")
+        logger.debug("任务 %s 中没有total_pages信息", task_id)
     
     # 根据状态添加额外信息
     if task['status'] == 'completed':
@@ -244,6 +783,9 @@ def get_status(task_id):
             'pages_deleted': task.get('pages_deleted', 0),
             'download_url': f"/download/{task_id}"
         })
+        if task.get('output_format') == 'zip':
+            response['output_format'] = 'zip'
+            response['parts'] = task.get('parts', 0)
     elif task['status'] == 'failed':
         response.update({
             'error': task.get('error', '未知错误')
@@ -254,45 +796,514 @@ def get_status(task_id):
             'retry_count': task.get('retry_count', 0)
         })
     
-    print(f"返回响应: {response}")
+    return response
+
+def acquire_watcher_slot():
+    """
+    为长轮询或事件流占用一个等待名额，使用完毕后调用_watcher_slots.release()
+
+    单线程的worker（例如gunicorn的sync）等待时无法处理其他请求，不分配名额。
+
+    Returns:
+        bool: 是否可以等待状态变化
+    """
+    if STATUS_STREAM_MAX_WATCHERS <= 0 or not request.environ.get('wsgi.multithread'):
+        return False
+    return _watcher_slots.acquire(blocking=False)
+
+@app.route('/status/<task_id>', methods=['GET'])
+def get_status(task_id):
+    """
+    获取任务状态
+
+    支持长轮询：传入 wait=<秒数> 和 since=<客户端已知的状态> 时，如果当前状态
+    与since相同，则等待状态变化或超时后再返回。等待的请求数达到STATUS_STREAM_MAX_WATCHERS时
+    立即返回当前状态。
+    """
+    wait = min(request.args.get('wait', 0, type=float), STATUS_STREAM_TIMEOUT)
+    since = request.args.get('since')
+    
+    waiting = wait > 0 and acquire_watcher_slot()
+    pubsub = task_store.subscribe(task_id) if waiting else None
+    try:
+        # 一次往返只读取状态响应需要的字段
+        task = task_store.get_fields(task_id, STATUS_FIELDS)
+        if task is None:
+            return jsonify({'error': '任务不存在'}), 404
+        
+        # 订阅之后才读取当前状态，两者之间发生的状态变化不会丢失
+        if pubsub is not None and task['status'] == since and since not in TERMINAL_STATUSES:
+            if task_store.wait_for_event(pubsub, wait) is not None:
+                task = task_store.get_fields(task_id, STATUS_FIELDS) or task
+    finally:
+        if pubsub is not None:
+            pubsub.close()
+        if waiting:
+            _watcher_slots.release()
+    
+    # 状态轮询非常频繁，只抽样记录
+    logger.info("获取任务状态: %s %s", task_id, task['status'], extra=SAMPLED)
+    
+    response = build_status_response(task_id, task)
+    logger.debug("返回响应: %s", response)
     return jsonify(response)
 
+@app.route('/events/<task_id>', methods=['GET'])
+def task_events(task_id):
+    """
+    以Server-Sent Events推送任务状态
+
+    状态变化由任务存储发布到Redis频道，这里订阅后逐条推送，不再需要客户端轮询。
+    任务结束（completed/failed）或达到STATUS_STREAM_TIMEOUT后关闭连接，
+    浏览器的EventSource会自动重连。等待的请求数达到STATUS_STREAM_MAX_WATCHERS时
+    只发送当前状态，并让浏览器在SSE_BUSY_RETRY_MS之后重连。
+    """
+    waiting = acquire_watcher_slot()
+    pubsub = task_store.subscribe(task_id) if waiting else None
+    
+    def close():
+        if pubsub is not None:
+            pubsub.close()
+        if waiting:
+            _watcher_slots.release()
+    
+    try:
+        task = task_store.get_fields(task_id, STATUS_FIELDS)
+    except Exception:
+        close()
+        raise
+    if task is None:
+        close()
+        return jsonify({'error': '任务不存在'}), 404
+    
+    def generate():
+        response = build_status_response(task_id, task)
+        yield f"retry: {1000 if waiting else SSE_BUSY_RETRY_MS}\ndata: {json.dumps(response)}\n\n"
+        if not waiting:
+            return
+        
+        deadline = time.time() + STATUS_STREAM_TIMEOUT
+        while response['status'] not in TERMINAL_STATUSES:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            
+            if task_store.wait_for_event(pubsub, min(remaining, SSE_KEEPALIVE_INTERVAL)) is None:
+                # 注释行作为心跳，防止代理因空闲关闭连接
+                yield ": keepalive\n\n"
+                continue
+            
+            current = task_store.get_fields(task_id, STATUS_FIELDS)
+            if current is None:
+                break
+            response = build_status_response(task_id, current)
+            yield f"data: {json.dumps(response)}\n\n"
+    
+    response = Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # 禁止nginx缓冲事件流
+    })
+    # 客户端在生成器开始之前断开时生成器不会执行，订阅和名额在响应关闭时释放
+    response.call_on_close(close)
+    return response
+
+def file_etag(key):
+    """
+    根据文件的修改时间和大小生成ETag
+
+    格式与nginx为静态文件生成的ETag相同（"十六进制mtime-十六进制大小"），
+    两种下载方式返回的ETag一致，客户端缓存不会因切换方式而失效。
+
+    Returns:
+        tuple: (ETag值，不含引号, storage.ObjectStat)
+    """
+    stat = storage.stat(key)
+    return f"{int(stat.mtime):x}-{stat.size:x}", stat
+
 @app.route('/download/<task_id>', methods=['GET'])
 def download_file(task_id):
-    """下载处理后的文件"""
-    if task_id not in task_store or task_store[task_id]['status'] != 'completed':
+    """
+    下载处理后的文件
+
+    Flask只负责校验任务状态和生成响应头。DOWNLOAD_MODE为accel时通过X-Accel-Redirect
+    将文件传输交给nginx，不再占用gunicorn线程；为redirect且使用对象存储时重定向到预签名地址，
+    由客户端直接从对象存储下载；为direct时由Flask直接发送，适用于没有nginx的部署。
+    本地存储的文件都支持Range和ETag/If-None-Match；对象存储的文件由Flask转发时只支持ETag。
+    """
+    task = task_store.get_fields(task_id, ['status', 'output_key', 'split_key', 'output_path', 'split_path',
+                                           'output_format', 'original_filename'])
+    if task is None or task.get('status') != 'completed':
         return jsonify({'error': '文件不可用'}), 404
     
-    task = task_store[task_id]
-    output_path = task['output_path']
-    
-    # 获取目录和文件名
-    directory = os.path.dirname(output_path)
-    filename = os.path.basename(output_path)
-    
-    # 设置下载的文件名（保留原始文件名但添加_edit后缀）
+    # 设置下载的文件名（保留原始文件名但添加_edit后缀，拆分结果为_split.zip）
     original_name = task['original_filename']
     base, ext = os.path.splitext(original_name)
-    download_name = f"{base}_edit{ext}"
+    if task.get('output_format') == 'zip':
+        download_name = f"{base}_split.zip"
+        mimetype = 'application/zip'
+    else:
+        download_name = f"{base}_edit{ext}"
+        mimetype = 'application/pdf'
+    output_key = task_result_key(task)
+    if output_key is None:
+        return jsonify({'error': '文件不可用'}), 404
+    
+    if DOWNLOAD_MODE == 'redirect':
+        url = storage.download_url(output_key, download_name)
+        if url is not None:
+            return redirect(url)
     
-    # 使用URL编码处理文件名
-    import urllib.parse
+    try:
+        etag, stat = file_etag(output_key)
+    except FileNotFoundError:
+        return jsonify({'error': '文件不可用'}), 404
+    
+    # 使用URL编码处理文件名，使用RFC 5987编码设置Content-Disposition头
     encoded_name = urllib.parse.quote(download_name)
+    content_disposition = f"attachment; filename*=UTF-8''{encoded_name}"
+    
+    # nginx只能访问上传目录中的文件，其他位置的旧文件和对象存储中的文件由Flask发送
+    output_path = storage.filesystem_path(output_key)
+    relative_path = None if output_path is None else os.path.relpath(output_path, app.config['UPLOAD_FOLDER'])
+    if DOWNLOAD_MODE == 'accel' and relative_path is not None and not relative_path.startswith('..'):
+        # 客户端缓存仍然有效时无需交给nginx
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            response = Response(mimetype=mimetype)
+            response.headers['X-Accel-Redirect'] = DOWNLOAD_ACCEL_PREFIX + urllib.parse.quote(relative_path)
+            response.headers['Content-Disposition'] = content_disposition
+        response.set_etag(etag)
+        return response
+    
+    if output_path is None:
+        # 对象存储中的文件边读取边发送
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            try:
+                response = send_file(storage.open(output_key), mimetype=mimetype, as_attachment=True,
+                                     download_name=download_name, last_modified=stat.mtime)
+            except FileNotFoundError:
+                return jsonify({'error': '文件不可用'}), 404
+            response.content_length = stat.size
+            response.headers['Content-Disposition'] = content_disposition
+        response.set_etag(etag)
+        return response
     
-    # 直接使用send_from_directory，不设置download_name参数
-    response = send_from_directory(
-        directory,
-        filename,
-        as_attachment=True
+    # send_file在conditional模式下处理Range、If-Range和If-None-Match请求
+    response = send_file(
+        output_path,
+        mimetype=mimetype,
+        as_attachment=True,
+        conditional=True,
+        etag=etag,
+        last_modified=stat.mtime
     )
+    response.headers['Content-Disposition'] = content_disposition
+    
+    return response
+
+def prepare_batch_item(task_id, task, spec):
+    """
+    校验批量任务中的一项并尝试使用结果缓存
+
+    Args:
+        spec: 要删除的页面，或包含operations字段的编辑计划
+
+    Returns:
+        bool: 是否需要进入任务队列处理
+    """
+    operations = spec.get('operations') if isinstance(spec, dict) else None
+    pages_to_delete = '' if isinstance(spec, dict) else spec
+    if operations is None and (not isinstance(pages_to_delete, (list, str)) or not pages_to_delete):
+        error = '页面号必须是正整数列表或页面范围表达式'
+    elif 'total_pages' not in task:
+        error = task.get('metadata_error', '获取PDF页数时出错: 缺少文档信息')
+    else:
+        try:
+            plan_pages, fields = compile_edit_request(task, pages_to_delete, operations)
+        except ValueError as e:
+            error = str(e)
+        else:
+            if complete_from_cache(task_id, task, plan_pages, fields) is not None:
+                return False
+            task_store.update(task_id, dict(fields, status='processing'), fetch=False)
+            task.update(fields)
+            return True
     
-    # 手动设置Content-Disposition头，使用RFC 5987编码
-    response.headers['Content-Disposition'] = f"attachment; filename*=UTF-8''{encoded_name}"
+    # 无效的项直接标记为失败，不影响同一批中的其他文件
+    task_store.update(task_id, {'status': 'failed', 'error': error}, fetch=False)
+    return False
+
+@app.route('/batch', methods=['POST'])
+def create_batch():
+    """
+    创建批量任务
+
+    支持两种请求格式：
+    - multipart表单：files为多个PDF文件，pages_to_delete为所有文件共用的页面表达式，
+      或specs为与files一一对应的JSON数组，数组元素也可以是 {"operations": [...]} 编辑计划
+    - JSON：{"items": [{"task_id": ..., "pages_to_delete": ...}, ...]}，
+      引用已上传的文件，同一个文件可以出现多次并使用不同的页面表达式；
+      项中提供operations时按编辑计划处理
+
+    所有需要处理的文件作为一个Celery group分发，chord回调在全部结束后记录汇总结果。
+    """
+    batch_id = str(uuid.uuid4())
+    items = []
+    
+    if request.files:
+        files = request.files.getlist('files')
+        if not files:
+            return jsonify({'error': '没有文件部分'}), 400
+        if len(files) > BATCH_MAX_ITEMS:
+            return jsonify({'error': f'每批最多 {BATCH_MAX_ITEMS} 个文件'}), 400
+        
+        if 'specs' in request.form:
+            try:
+                specs = json.loads(request.form['specs'])
+            except ValueError:
+                return jsonify({'error': 'specs必须是JSON数组'}), 400
+            if not isinstance(specs, list) or len(specs) != len(files):
+                return jsonify({'error': 'specs必须是与文件数量相同的JSON数组'}), 400
+        else:
+            specs = [request.form.get('pages_to_delete', '')] * len(files)
+        
+        for file in files:
+            if file.filename == '' or not allowed_file(file.filename):
+                return jsonify({'error': f'不支持的文件类型，仅支持PDF文件: {file.filename}'}), 400
+        
+        for file, spec in zip(files, specs):
+            task_id, task = register_upload(file.stream, file.filename, batch_id=batch_id)
+            items.append((task_id, task, spec))
+    else:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict) or not isinstance(data.get('items'), list) or not data['items']:
+            return jsonify({'error': '无效的请求数据'}), 400
+        if len(data['items']) > BATCH_MAX_ITEMS:
+            return jsonify({'error': f'每批最多 {BATCH_MAX_ITEMS} 个文件'}), 400
+        if not all(isinstance(item, dict) for item in data['items']):
+            return jsonify({'error': '无效的请求数据'}), 400
+        
+        sources = task_store.mget([item.get('task_id') for item in data['items']])
+        for item, source in zip(data['items'], sources):
+            if source is None or 'file_digest' not in source:
+                return jsonify({'error': f"任务不存在: {item.get('task_id')}"}), 404
+        
+        # 每一项使用新的任务记录，共享同一个上传文件，输出文件互不影响；
+        # 所有引用和任务记录在一次往返中写入
+        acquired = []
+        with RedisBatch(redis_client, transaction=True) as batch:
+            for item, source in zip(data['items'], sources):
+                acquired.append(blob_store.acquire(source['file_digest'], batch=batch))
+                task = {
+                    'status': 'uploaded',
+                    'file_key': blob_store.key(source['file_digest']),
+                    'created_at': time.time(),
+                    'batch_id': batch_id
+                }
+                for field in ('file_digest', 'original_filename', 'document', 'total_pages', 'metadata_error'):
+                    if field in source:
+                        task[field] = source[field]
+                task_id = str(uuid.uuid4())
+                task_store.put(task_id, task, batch=batch)
+                items.append((task_id, task, item if 'operations' in item else item.get('pages_to_delete')))
+        
+        missing = rollback_acquired(sources, acquired, [task_id for task_id, _, _ in items])
+        if missing is not None:
+            return jsonify({'error': f"任务不存在: {data['items'][missing].get('task_id')}"}), 404
+    
+    task_ids = [task_id for task_id, _, _ in items]
+    batch_store[batch_id] = {
+        'status': 'processing',
+        'task_ids': task_ids,
+        'total': len(task_ids),
+        'created_at': time.time()
+    }
+    
+    header = [
+        process_pdf_task.s(task_id, task_file_key(task), task.get('pages_to_delete', ''), task['original_filename'],
+                           task.get('operations')).set(queue=task_queue(task))
+        for task_id, task, spec in items
+        if prepare_batch_item(task_id, task, spec)
+    ]
+    
+    if header:
+        # 子任务失败时chord不调用回调，通过错误回调同样记录汇总结果
+        callback = finalize_batch.si(batch_id)
+        result = chord(header)(callback.on_error(finalize_batch.si(batch_id)))
+        batch_store.update(batch_id, {'celery_task_id': result.id}, fetch=False)
+    else:
+        # 全部命中缓存或全部无效，无需进入任务队列
+        finalize_batch(batch_id)
+    
+    response = build_batch_response(batch_id)
+    response['message'] = f'批量任务已创建，共 {len(task_ids)} 个文件，{len(header)} 个进入处理队列'
+    return jsonify(response)
+
+def build_batch_response(batch_id):
+    """汇总批量任务及各子任务的状态，批量任务不存在时返回None"""
+    batch = batch_store.get(batch_id)
+    if batch is None:
+        return None
     
+    tasks = task_store.mget(batch['task_ids'])
+    summary = summarize_batch(tasks)
+    
+    items = []
+    for task_id, task in zip(batch['task_ids'], tasks):
+        if task is None:
+            items.append({'task_id': task_id, 'status': 'failed', 'error': '任务不存在'})
+            continue
+        item = build_status_response(task_id, task)
+        item['original_filename'] = task.get('original_filename')
+        items.append(item)
+    
+    response = {
+        'batch_id': batch_id,
+        'status': 'completed' if summary['pending'] == 0 else batch['status'],
+        'items': items
+    }
+    response.update(summary)
+    if summary['done']:
+        response['download_url'] = f"/batch/{batch_id}/download"
     return response
 
+@app.route('/batch/<batch_id>', methods=['GET'])
+def get_batch_status(batch_id):
+    """获取批量任务的汇总状态：完成、失败和总数，以及每个文件的结果"""
+    response = build_batch_response(batch_id)
+    if response is None:
+        return jsonify({'error': '批量任务不存在'}), 404
+    return jsonify(response)
+
+class _ZipStream:
+    """只写的缓冲区，zipfile写入的数据由生成器分块取出后发送"""
+    
+    def __init__(self):
+        self._chunks = []
+    
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+    
+    def flush(self):
+        pass
+    
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+@app.route('/batch/<batch_id>/download', methods=['GET'])
+def download_batch(batch_id):
+    """
+    打包下载批量任务中已完成的文件
+
+    ZIP边生成边发送，不在服务器上生成临时压缩包；PDF本身已压缩，使用存储模式。
+    """
+    task_ids = batch_store.get_field(batch_id, 'task_ids')
+    if task_ids is None:
+        return jsonify({'error': '批量任务不存在'}), 404
+    
+    entries = []
+    used_names = set()
+    for task in task_store.mget(task_ids):
+        if task is None or task.get('status') != 'completed':
+            continue
+        base, ext = os.path.splitext(task['original_filename'])
+        name = f"{base}_edit{ext}"
+        # 同名文件添加序号，避免压缩包中的文件互相覆盖
+        counter = 2
+        while name in used_names:
+            name = f"{base}_edit ({counter}){ext}"
+            counter += 1
+        used_names.add(name)
+        entries.append((name, task_result_key(task)))
+    
+    if not entries:
+        return jsonify({'error': '没有已完成的文件'}), 404
+    
+    def generate():
+        stream = _ZipStream()
+        with zipfile.ZipFile(stream, 'w', zipfile.ZIP_STORED) as archive:
+            for name, key in entries:
+                try:
+                    src = storage.open(key)
+                except FileNotFoundError:
+                    # 文件在打包过程中被清理
+                    continue
+                with src, archive.open(name, 'w', force_zip64=True) as dest:
+                    while True:
+                        chunk = src.read(ZIP_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        dest.write(chunk)
+                        yield stream.drain()
+                yield stream.drain()
+        yield stream.drain()
+    
+    return Response(generate(), mimetype='application/zip', headers={
+        'Content-Disposition': f"attachment; filename=batch_{batch_id}.zip"
+    })
+
+@app.route('/delete_batch/<batch_id>', methods=['POST'])
+def delete_batch(batch_id):
+    """删除批量任务及其所有子任务"""
+    task_ids = batch_store.get_field(batch_id, 'task_ids')
+    if task_ids is None:
+        return jsonify({'error': '批量任务不存在'}), 404
+    
+    for task_id, task in zip(task_ids, task_store.mget(task_ids)):
+        if task is not None:
+            release_task_files(task)
+    task_store.delete_many(task_ids)
+    del batch_store[batch_id]
+    
+    return jsonify({'message': '批量任务已删除'})
+
+@app.route('/stats', methods=['GET'])
+def get_stats():
+    """处理路径和结果缓存的统计"""
+    return jsonify({
+        'dispatch': {path: int(metrics.get('pdf_dispatch_total', path=path)) for path in DISPATCH_PATHS},
+        'result_cache': result_cache.stats()
+    })
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Prometheus文本格式的运行指标
+
+    计数器和直方图由各进程汇总在Redis中；队列长度、上传目录占用和结果缓存在抓取时读取。
+    """
+    # Celery的Redis代理将每个队列保存为同名的列表
+    # 代理不是Redis时不输出队列长度
+    queues = (QUEUE_SMALL, QUEUE_LARGE, QUEUE_MAINTENANCE) if broker_redis is not None else ()
+    depths = []
+    if queues:
+        pipe = broker_redis.pipeline(transaction=False)
+        for queue in queues:
+            pipe.llen(queue)
+        depths = pipe.execute()
+    disk_bytes, disk_files = directory_usage(UPLOAD_FOLDER)
+    cache = result_cache.stats()
+
+    samples = [('pdf_queue_length', 'gauge', '队列中等待执行的任务数', {'queue': queue}, depth)
+               for queue, depth in zip(queues, depths)]
+    samples.extend([
+        ('pdf_upload_folder_bytes', 'gauge', '上传目录中文件的总字节数', {}, disk_bytes),
+        ('pdf_upload_folder_files', 'gauge', '上传目录中的文件数', {}, disk_files),
+        ('pdf_result_cache_hits_total', 'counter', '结果缓存命中次数', {}, cache['hits']),
+        ('pdf_result_cache_misses_total', 'counter', '结果缓存未命中次数', {}, cache['misses']),
+        ('pdf_result_cache_entries', 'gauge', '结果缓存项数量', {}, cache['entries']),
+        ('pdf_result_cache_bytes', 'gauge', '结果缓存占用的字节数', {}, cache['bytes']),
+    ])
+    return Response(metrics.render(samples), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 @app.route('/cleanup', methods=['POST'])
-def cleanup_old_tasks():
+def trigger_cleanup():
     """手动触发清理旧任务"""
     # 启动Celery任务进行清理
     result = cleanup_old_tasks.delay()
@@ -307,18 +1318,16 @@ def delete_all_tasks():
     """删除所有任务"""
     for task_id in list(task_store.keys()):
         delete_task(task_id)
+    batch_store.clear()
     return jsonify({'message': '所有任务已删除'})
 
 @app.route('/delete_task/<task_id>', methods=['POST'])
 def delete_task(task_id):
     """删除指定任务"""
-    if task_id in task_store:
-        task = task_store[task_id]
-        if 'file_path' in task and os.path.exists(task['file_path']):
-            os.remove(task['file_path'])
-            
-        if 'output_path' in task and os.path.exists(task['output_path']):
-            os.remove(task['output_path'])
+    task = task_store.get(task_id)
+    if task is not None:
+        # 上传文件可能被其他任务共享，通过引用计数释放
+        release_task_files(task)
             
         # 从任务字典中删除
         del task_store[task_id]
@@ -329,7 +1338,7 @@ def delete_task(task_id):
 
 @app.route('/clean', methods=['GET'])
 def clean_uploads():
-    """清理uploads目录下的所有PDF文件（需要密码验证）"""
+    """清理存储中的所有PDF文件（需要密码验证）"""
     # 获取请求中的密码参数
     password = request.args.get('password', '')
     
@@ -345,20 +1354,24 @@ def clean_uploads():
         return jsonify({'error': '密码错误，无权清理文件'}), 403
     
     try:
-        # 获取uploads目录中的所有PDF文件
-        pdf_files = glob.glob(os.path.join(app.config['UPLOAD_FOLDER'], '*.pdf'))
+        # 获取存储中的所有PDF文件
+        pdf_files = storage.keys('.pdf')
         
         # 删除文件
         deleted_count = 0
-        for file_path in pdf_files:
+        for file_key in pdf_files:
             try:
-                os.remove(file_path)
+                storage.delete(file_key)
                 deleted_count += 1
             except Exception as e:
-                print(f"删除文件 {file_path} 时出错: {str(e)}")
+                logger.error(f"删除文件 {file_key} 时出错: {str(e)}")
         
-        # 清空Redis中的任务信息
+        # 清空Redis中的任务信息和文件引用计数
         tasks_cleared = task_store.clear()
+        batch_store.clear()
+        upload_sessions.clear()
+        blob_store.clear()
+        result_cache.clear()
         
         return jsonify({
             'success': True,
@@ -371,15 +1384,5 @@ def clean_uploads():
             'error': f'清理文件时出错: {str(e)}'
         }), 500
 
-# 设置定时任务，每天自动清理过期任务
-@celery_app.on_after_configure.connect
-def setup_periodic_tasks(sender, **kwargs):
-    # 每天午夜执行清理任务
-    sender.add_periodic_task(
-        86400.0,  # 24小时 = 86400秒
-        cleanup_old_tasks.s(),
-        name='每天清理过期任务'
-    )
-
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=9000, debug=True) 
\ No newline at end of file
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+上传文件的内容寻址存储
+
+上传的文件在写入临时文件的同时计算SHA-256摘要，并以摘要作为存储键（<摘要>.pdf）放入
+文件存储，相同内容的文件只保存一份，多个任务记录引用同一个文件。
+每个文件的引用计数保存在Redis哈希中，只有没有任务引用时才删除文件。
+文档描述信息也按摘要缓存，重复上传的文件不需要再次解析。
+
+同一内容的上传和释放通过按摘要的锁互斥：引用计数归零到文件删除之间，
+新上传的相同文件不会放入存储后又被删除。
+"""
+
+import os
+import json
+import hashlib
+from contextlib import contextmanager
+
+from .celery_app import redis_client, TASK_RETENTION_SECONDS, TASK_FILE_FIELDS
+from .storage import storage
+from .connections import hold_lock, queue_script
+
+# 流式写入时每次读取的字节数
+CHUNK_SIZE = 1024 * 1024
+# 无效文件的检查结果按摘要缓存的时间（秒），同一个损坏的文件再次上传时直接拒绝
+INVALID_PDF_TTL = int(os.environ.get('INVALID_PDF_TTL', 7 * 24 * 60 * 60))
+# 按摘要的锁的过期时间（秒），持有期间自动续期
+BLOB_LOCK_TIMEOUT = 30
+
+class BlobStore:
+    """按内容摘要保存上传文件，并用Redis维护引用计数"""
+
+    # 文件仍有引用时引用计数加一并返回1；已没有引用（文件正在或已经被删除）时返回0
+    ACQUIRE_SCRIPT = """
+    if redis.call('HEXISTS', KEYS[1], ARGV[1]) == 0 then
+        return 0
+    end
+    redis.call('HINCRBY', KEYS[1], ARGV[1], 1)
+    return 1
+    """
+
+    # 引用计数减一，归零时删除计数并返回1，由调用方删除文件
+    RELEASE_SCRIPT = """
+    local count = redis.call('HINCRBY', KEYS[1], ARGV[1], -1)
+    if count <= 0 then
+        redis.call('HDEL', KEYS[1], ARGV[1])
+        return 1
+    end
+    return 0
+    """
+
+    def __init__(self, redis_client, storage, refs_key='pdf_blob_refs', document_prefix='pdf_doc:',
+                 invalid_prefix='pdf_invalid:'):
+        self.redis = redis_client
+        self.storage = storage
+        self.refs_key = refs_key
+        self.document_prefix = document_prefix
+        self.invalid_prefix = invalid_prefix
+        self._acquire_script = self.redis.register_script(self.ACQUIRE_SCRIPT)
+        self._release_script = self.redis.register_script(self.RELEASE_SCRIPT)
+
+    @staticmethod
+    def key(digest):
+        """摘要对应的存储键"""
+        return f"{digest}.pdf"
+
+    def save_stream(self, stream):
+        """
+        将上传的数据流写入存储，写入的同时计算摘要
+
+        内容已存在时丢弃本次写入的数据，只增加引用计数。
+
+        Args:
+            stream: 可读取字节的文件对象
+
+        Returns:
+            tuple: (摘要, 存储键, 字节数)
+        """
+        tmp_path = self.storage.temp_path()
+        hasher = hashlib.sha256()
+        size = 0
+        try:
+            with open(tmp_path, 'wb') as tmp_file:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    hasher.update(chunk)
+                    tmp_file.write(chunk)
+                    size += len(chunk)
+            digest = hasher.hexdigest()
+            return digest, self.add_file(tmp_path, digest), size
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def save_file(self, path):
+        """
+        将磁盘上已完整写入的文件放入存储，例如分块上传完成后的文件
+
+        文件被移动到存储中；内容已存在时删除该文件，只增加引用计数。
+
+        Returns:
+            tuple: (摘要, 存储键, 字节数)
+        """
+        hasher = hashlib.sha256()
+        size = 0
+        with open(path, 'rb') as source:
+            while True:
+                chunk = source.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                hasher.update(chunk)
+                size += len(chunk)
+        digest = hasher.hexdigest()
+        try:
+            return digest, self.add_file(path, digest), size
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+
+    @contextmanager
+    def _locked(self, digest):
+        """持有摘要的锁，等待其他请求放置或删除同一内容的文件"""
+        with hold_lock(self.redis, f"{self.refs_key}_lock:{digest}", BLOB_LOCK_TIMEOUT, blocking=True):
+            yield
+
+    def add_file(self, tmp_path, digest):
+        """
+        将已计算摘要的临时文件放入存储并增加引用计数
+
+        临时文件在内容已存在时保持不动，由调用方删除。
+
+        Returns:
+            str: 存储键
+        """
+        key = self.key(digest)
+        with self._locked(digest):
+            count = self.redis.hincrby(self.refs_key, digest, 1)
+            # 第一个引用负责放置文件；文件可能在引用归零后刚被删除，此时也需要重新放置
+            if count == 1 or not self.storage.exists(key):
+                self.storage.put_file(key, tmp_path)
+        return key
+
+    def acquire(self, digest, batch=None):
+        """
+        为已存在的文件增加一个引用，多个任务共享同一个上传文件时使用
+
+        文件的引用已经归零（正在或已经被删除）时不增加引用，调用方应按文件不存在处理。
+
+        Args:
+            digest (str): 内容摘要
+            batch (RedisBatch, optional): 提供时加入batch并返回BatchResult，引用在batch执行时增加
+
+        Returns:
+            bool: 是否增加了引用
+        """
+        if batch is not None:
+            return batch.add(lambda pipe: queue_script(pipe, self._acquire_script, [self.refs_key], [digest]),
+                             lambda results: bool(results[-1]))
+        return bool(self._acquire_script(keys=[self.refs_key], args=[digest]))
+
+    def release(self, digest):
+        """
+        释放一个引用，没有任务引用时删除文件
+
+        Returns:
+            bool: 文件是否已被删除
+        """
+        with self._locked(digest):
+            if not self._release_script(keys=[self.refs_key], args=[digest]):
+                return False
+            self.storage.delete(self.key(digest))
+        self.redis.delete(f"{self.document_prefix}{digest}")
+        return True
+
+    def get_document(self, digest, batch=None):
+        """
+        读取按摘要缓存的文档描述信息，不存在时返回None
+
+        batch参数与RedisTaskStore相同，提供时加入batch并返回BatchResult。
+        """
+        key = f"{self.document_prefix}{digest}"
+        if batch is not None:
+            return batch.add(lambda pipe: pipe.get(key), lambda results: self._document(results[-1]))
+        return self._document(self.redis.get(key))
+
+    @staticmethod
+    def _document(data):
+        return None if data is None else json.loads(data)
+
+    def set_document(self, digest, document, batch=None):
+        """按摘要缓存文档描述信息"""
+        key = f"{self.document_prefix}{digest}"
+        data = json.dumps(document)
+        if batch is not None:
+            return batch.add(lambda pipe: pipe.set(key, data, ex=TASK_RETENTION_SECONDS))
+        self.redis.set(key, data, ex=TASK_RETENTION_SECONDS)
+
+    def get_invalid(self, digest, batch=None):
+        """读取按摘要缓存的无效文件错误信息，没有记录时返回None"""
+        key = f"{self.invalid_prefix}{digest}"
+        if batch is not None:
+            return batch.add(lambda pipe: pipe.get(key), lambda results: self._invalid(results[-1]))
+        return self._invalid(self.redis.get(key))
+
+    @staticmethod
+    def _invalid(error):
+        return None if error is None else error.decode('utf-8')
+
+    def set_invalid(self, digest, error, batch=None):
+        """记录无效文件的错误信息，文件删除后仍然保留，直到INVALID_PDF_TTL过期"""
+        key = f"{self.invalid_prefix}{digest}"
+        if batch is not None:
+            return batch.add(lambda pipe: pipe.set(key, error, ex=INVALID_PDF_TTL))
+        self.redis.set(key, error, ex=INVALID_PDF_TTL)
+
+    def clear(self):
+        """清除所有引用计数"""
+        self.redis.delete(self.refs_key)
+
+# 创建全局文件存储实例
+blob_store = BlobStore(redis_client, storage)
+
+def task_output_key(task_id):
+    """任务输出文件的存储键，上传文件可能被多个任务共享，输出文件按任务ID命名"""
+    return f"{task_id}_edit.pdf"
+
+def task_split_key(task_id):
+    """拆分任务输出的ZIP文件的存储键"""
+    return f"{task_id}_split.zip"
+
+def task_file_key(task):
+    """任务上传文件的存储键；存储键之前的任务记录中只有绝对路径，本地存储可以直接使用"""
+    return task.get('file_key') or task['file_path']
+
+def task_result_key(task):
+    """任务处理结果的存储键，拆分任务为ZIP文件；没有结果时返回None"""
+    if task.get('output_format') == 'zip':
+        return task.get('split_key') or task.get('split_path')
+    return task.get('output_key') or task.get('output_path')
+
+def release_task_files(task, released=None):
+    """
+    删除任务关联的文件
+
+    上传文件通过引用计数释放，处理结果文件属于单个任务，直接删除。
+    结果文件先删除：重复删除没有影响，引用计数则不能重复释放。
+
+    Args:
+        task (dict): 任务数据，或RedisTaskStore.mget_files返回的文件引用
+        released (callable, optional): 每释放一个文件后以剩余的文件字段调用，用于记录进度，
+            中途出错时已释放的引用不会在重试时再次释放
+    """
+    remaining = {field: task[field] for field in TASK_FILE_FIELDS if field in task}
+    if 'file_digest' in remaining:
+        # 上传文件由引用计数管理，不按路径删除
+        remaining.pop('file_path', None)
+
+    def done(field, value=None):
+        if value:
+            remaining[field] = value
+        else:
+            del remaining[field]
+        if released is not None:
+            released(dict(remaining))
+
+    # 编辑结果和拆分结果（output_path和split_path为存储键之前的任务记录中的绝对路径）
+    for field in ('output_key', 'split_key', 'output_path', 'split_path'):
+        if field in remaining:
+            storage.delete(remaining[field])
+            done(field)
+
+    if 'file_digest' in remaining:
+        blob_store.release(remaining['file_digest'])
+        done('file_digest')
+    elif 'file_path' in remaining:
+        # 兼容内容寻址存储之前上传的文件
+        storage.delete(remaining['file_path'])
+        done('file_path')
+    # 合并任务引用的所有输入文件
+    digests = remaining.get('source_digests', [])
+    for index, digest in enumerate(digests):
+        blob_store.release(digest)
+        done('source_digests', digests[index + 1:])
@@ -9,108 +9,577 @@ Celery应用配置
 
 import os
 import redis
-from celery import Celery
+from celery import Celery, signals
+from kombu import Queue
 import dotenv
 import json
+import time
+import logging
+import functools
 
 # 加载环境变量
 dotenv.load_dotenv()
 
+from .logs import configure_logging, correlation_id, bind_correlation_id, reset_correlation_id
+from .metrics import MetricsRegistry
+from .connections import get_client, hold_lock, queue_script, REDIS_HEALTH_CHECK_INTERVAL
+
+# 日志配置读取环境变量，需在加载.env之后进行
+configure_logging()
+logger = logging.getLogger(__name__)
+
 # 获取Celery配置
 broker_url = os.environ.get('CELERY_BROKER_URL', os.environ.get('REDIS_URL', 'redis://localhost:6379/0'))
 result_backend = os.environ.get('CELERY_RESULT_BACKEND', os.environ.get('REDIS_URL', 'redis://localhost:6379/0'))
 
-# 创建Redis连接
-redis_client = redis.from_url(broker_url)
+# 上传文件和处理结果的保存目录，web和worker进程共用
+UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads'))
+
+# 任务保留时间（秒），过期任务的记录和文件会被清理
+TASK_RETENTION_SECONDS = int(os.environ.get('TASK_RETENTION_SECONDS', 24 * 60 * 60))
+# 过期任务清理的执行间隔（秒）
+TASK_REAP_INTERVAL = int(os.environ.get('TASK_REAP_INTERVAL', 5 * 60))
+
+# 单个PDF任务的内存预算（字节），预计超出时改用大文件模式，大文件模式仍超出时拒绝处理
+TASK_MEMORY_BUDGET = int(os.environ.get('TASK_MEMORY_BUDGET', 512 * 1024 * 1024))
+# 达到该大小（字节）的PDF直接使用大文件模式：mmap读取、逐页写出
+LARGE_DOCUMENT_BYTES = int(os.environ.get('LARGE_DOCUMENT_BYTES', 64 * 1024 * 1024))
+# worker子进程的常驻内存上限（KiB），超过后处理完当前任务即替换该子进程
+WORKER_MAX_MEMORY_PER_CHILD = int(os.environ.get('WORKER_MAX_MEMORY_PER_CHILD', 1024 * 1024))
+# 结果文件的输出方式：rewrite重新写出，incremental在原文件后追加增量更新，auto按保留页面比例选择；
+# 增量更新保留被删除页面的内容，只能显式启用
+PDF_OUTPUT_MODE = os.environ.get('PDF_OUTPUT_MODE', 'rewrite')
+# 拆分任务生成文件使用的进程数；每个拆分任务各自创建进程池，与worker并发数相乘，默认值保持较小
+SPLIT_WORKERS = int(os.environ.get('SPLIT_WORKERS', 2))
+
+# 任务队列：小文件和大文件分开处理，大文件任务不会阻塞小文件任务；定时清理使用单独的队列
+QUEUE_SMALL = 'pdf.small'
+QUEUE_LARGE = 'pdf.large'
+QUEUE_MAINTENANCE = 'maintenance'
+# 不超过该页数和大小（字节）的PDF任务进入pdf.small队列，其余进入pdf.large队列
+SMALL_JOB_MAX_PAGES = int(os.environ.get('SMALL_JOB_MAX_PAGES', 100))
+SMALL_JOB_MAX_BYTES = int(os.environ.get('SMALL_JOB_MAX_BYTES', 16 * 1024 * 1024))
+
+def select_queue(page_count, file_size):
+    """
+    根据任务记录中的页数和文件大小选择PDF任务的队列
+
+    Args:
+        page_count (int): 总页数，未知时为None
+        file_size (int): 文件字节数，未知时为None
+
+    Returns:
+        str: 队列名称，页数或大小未知时按大文件处理
+    """
+    if page_count is None or file_size is None:
+        return QUEUE_LARGE
+    if page_count <= SMALL_JOB_MAX_PAGES and file_size <= SMALL_JOB_MAX_BYTES:
+        return QUEUE_SMALL
+    return QUEUE_LARGE
+
+# 任务记录、结果缓存、指标等数据保存在REDIS_URL，与Celery代理和结果分开，可以使用单独的数据库或实例；
+# 不回退到代理地址：代理可能不是Redis，任务数据也不应与代理的队列混在同一个数据库中。
+# 只有代理也未设置（本地开发）时使用默认地址
+REDIS_URL = os.environ.get('REDIS_URL')
+if REDIS_URL is None:
+    if 'CELERY_BROKER_URL' in os.environ:
+        raise RuntimeError("设置了CELERY_BROKER_URL时必须同时设置REDIS_URL（保存任务记录等数据的Redis）")
+    REDIS_URL = 'redis://localhost:6379/0'
+
+# 创建Redis连接，每个进程使用自己的连接池，参见connections模块
+redis_client = get_client(REDIS_URL)
+# Celery代理为Redis时，/metrics 通过它读取队列长度
+broker_redis = get_client(broker_url) if broker_url.startswith(('redis://', 'rediss://', 'unix://')) else None
+
+# 运行指标，各进程缓冲后在Redis中汇总
+metrics = MetricsRegistry(redis_client)
+
+def _instrumented(operation):
+    """记录RedisTaskStore方法的调用次数和耗时"""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if self.metrics is None:
+                return method(self, *args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                labels = {'store': self.prefix.rstrip(':'), 'operation': operation}
+                self.metrics.inc('pdf_store_operations_total', **labels)
+                self.metrics.observe('pdf_store_operation_seconds', time.perf_counter() - start, **labels)
+        return wrapper
+    return decorator
 
 # 创建任务存储类
 class RedisTaskStore:
-    def __init__(self, redis_client):
+    """
+    基于Redis哈希的任务存储
+
+    每个任务保存为一个Redis哈希，字段值为JSON编码。部分更新通过服务端脚本
+    在一次往返中原子完成，单个字段（例如status）可以直接读取而无需解码整条记录。
+    更新中包含status字段时，脚本同时向任务的事件频道发布新状态，供状态推送使用。
+
+    file_fields中的字段（文件的存储键、摘要）同时写入一个不过期的文件引用哈希：
+    任务记录被Redis过期删除后，清理任务仍能通过索引和文件引用找到并删除文件。
+    """
+
+    # 仅当任务存在时合并字段；ARGV[1]为'1'时返回合并后的整条记录；
+    # ARGV[2]非空时作为消息发布到KEYS[2]频道；ARGV[3]为文件字段数，排在最前的这些字段同时写入KEYS[3]
+    UPDATE_SCRIPT = """
+    if redis.call('EXISTS', KEYS[1]) == 0 then
+        return false
+    end
+    redis.call('HSET', KEYS[1], unpack(ARGV, 4))
+    local files = tonumber(ARGV[3])
+    if files > 0 then
+        redis.call('HSET', KEYS[3], unpack(ARGV, 4, 3 + 2 * files))
+    end
+    if ARGV[2] ~= '' then
+        redis.call('PUBLISH', KEYS[2], ARGV[2])
+    end
+    if ARGV[1] == '1' then
+        return redis.call('HGETALL', KEYS[1])
+    end
+    return 1
+    """
+
+    def __init__(self, redis_client, prefix='pdf_task:', ttl=None, metrics=None, file_fields=()):
         self.redis = redis_client
-        self.prefix = 'pdf_task:'
-        print("初始化 RedisTaskStore")
+        self.prefix = prefix
+        # 记录在created_at之后ttl秒由Redis自动过期，None表示不过期
+        self.ttl = ttl
+        # 提供MetricsRegistry时记录各操作的次数和耗时
+        self.metrics = metrics
+        # 引用文件的字段，同时保存在不过期的文件引用哈希中
+        self.file_fields = tuple(file_fields)
+        # 按created_at排序的二级索引，键名不匹配 f"{prefix}*"，不会被SCAN当作任务
+        self.index_key = f"{prefix.rstrip(':')}_index:created_at"
+        # 旧版本记录的索引补建完成后设置的标记
+        self.migrated_key = f"{prefix.rstrip(':')}_index:migrated"
+        self.files_prefix = f"{prefix.rstrip(':')}_files:"
+        self._update_script = self.redis.register_script(self.UPDATE_SCRIPT)
+        logger.debug("初始化 RedisTaskStore: %s", prefix)
+        
+    def _key(self, task_id):
+        return f"{self.prefix}{task_id}"
+        
+    def _files_key(self, task_id):
+        return f"{self.files_prefix}{task_id}"
+        
+    def _file_refs(self, value):
+        """任务数据中引用文件的字段"""
+        return {field: value[field] for field in self.file_fields if field in value}
         
+    def channel(self, task_id):
+        """任务状态变化的发布/订阅频道"""
+        return f"{self.prefix.rstrip(':')}_events:{task_id}"
+        
+    @staticmethod
+    def _encode(value):
+        """将任务数据编码为哈希字段映射"""
+        return {field: json.dumps(item) for field, item in value.items()}
+        
+    @staticmethod
+    def _decode(data):
+        """将HGETALL的结果解码为任务数据，支持字典或扁平列表两种形式"""
+        if isinstance(data, list):
+            data = dict(zip(data[::2], data[1::2]))
+        return {
+            (field.decode('utf-8') if isinstance(field, bytes) else field): json.loads(item)
+            for field, item in data.items()
+        }
+        
+    @_instrumented('get')
     def __getitem__(self, task_id):
-        key = f"{self.prefix}{task_id}"
-        data = self.redis.get(key)
-        if data is None:
-            print(f"Redis中找不到任务: {key}")
+        key = self._key(task_id)
+        try:
+            data = self.redis.hgetall(key)
+        except redis.exceptions.ResponseError:
+            # 兼容旧版本以JSON字符串保存的任务
+            raw = self.redis.get(key)
+            data = None if raw is None else {k: json.dumps(v) for k, v in json.loads(raw).items()}
+        if not data:
+            logger.debug("Redis中找不到任务: %s", key)
             raise KeyError(task_id)
-        result = json.loads(data)
-        print(f"从Redis获取任务 {key}: {result}")
+        result = self._decode(data)
+        logger.debug("从Redis获取任务 %s: %s", key, result)
         return result
         
     def __setitem__(self, task_id, value):
-        key = f"{self.prefix}{task_id}"
-        print(f"更新Redis任务 {key}: {value}")
-        self.redis.set(key, json.dumps(value))
+        self.put(task_id, value)
+        
+    @_instrumented('set')
+    def put(self, task_id, value, batch=None):
+        """
+        保存整条任务记录，替换已有的记录
+
+        Args:
+            task_id (str): 任务ID
+            value (dict): 任务数据，为空时只删除已有的记录
+            batch (RedisBatch, optional): 提供时加入batch，与其他操作在一次往返中执行；
+                batch为事务（transaction=True）时与其中的其他操作一起原子执行
+        """
+        key = self._key(task_id)
+        logger.debug("更新Redis任务 %s: %s", key, value)
+        
+        def queue(pipe):
+            pipe.delete(key)
+            if value:
+                created_at = value.get('created_at', time.time())
+                pipe.hset(key, mapping=self._encode(value))
+                files = self._file_refs(value)
+                if files:
+                    pipe.hset(self._files_key(task_id), mapping=self._encode(files))
+                pipe.zadd(self.index_key, {task_id: created_at})
+                if self.ttl is not None:
+                    pipe.expireat(key, int(created_at + self.ttl))
+            else:
+                pipe.zrem(self.index_key, task_id)
+                
+        if batch is not None:
+            return batch.add(queue)
+        pipe = self.redis.pipeline(transaction=True)
+        queue(pipe)
+        pipe.execute()
         
     def __delitem__(self, task_id):
-        key = f"{self.prefix}{task_id}"
-        print(f"删除Redis任务: {key}")
-        self.redis.delete(key)
+        key = self._key(task_id)
+        logger.debug("删除Redis任务: %s", key)
+        self.delete_many([task_id])
         
+    @_instrumented('exists')
     def __contains__(self, task_id):
-        key = f"{self.prefix}{task_id}"
-        exists = self.redis.exists(key)
-        print(f"检查Redis任务是否存在 {key}: {exists}")
+        key = self._key(task_id)
+        exists = bool(self.redis.exists(key))
+        logger.debug("检查Redis任务是否存在 %s: %s", key, exists)
         return exists
         
-    def update(self, task_id, value):
-        """更新任务状态，合并现有数据和新数据"""
-        key = f"{self.prefix}{task_id}"
+    def get(self, task_id, default=None):
+        """获取任务数据，任务不存在时返回default"""
         try:
-            # 获取现有数据
-            current_data = self[task_id]
-            # 合并数据
-            current_data.update(value)
-            # 保存更新后的数据
-            print(f"更新Redis任务 {key}，合并后的数据: {current_data}")
-            self[task_id] = current_data
-            return current_data
-        except Exception as e:
-            print(f"更新Redis任务时出错 {key}: {str(e)}")
-            raise
+            return self[task_id]
+        except KeyError:
+            return default
+            
+    @_instrumented('get_field')
+    def get_field(self, task_id, field, default=None):
+        """读取任务的单个字段，无需获取整条记录"""
+        item = self.redis.hget(self._key(task_id), field)
+        return default if item is None else json.loads(item)
+        
+    @_instrumented('get_fields')
+    def get_fields(self, task_id, fields, batch=None):
+        """
+        一次往返读取任务的多个字段
+
+        Args:
+            batch (RedisBatch, optional): 提供时加入batch并返回BatchResult，执行之后读取结果
+
+        Returns:
+            dict: 存在的字段及其值；任务不存在时返回None
+        """
+        key = self._key(task_id)
+        if batch is not None:
+            return batch.add(lambda pipe: pipe.hmget(key, fields),
+                             lambda results: self._fields(fields, results[-1]))
+        return self._fields(fields, self.redis.hmget(key, fields))
+        
+    @staticmethod
+    def _fields(fields, items):
+        result = {field: json.loads(item) for field, item in zip(fields, items) if item is not None}
+        return result or None
+        
+    @_instrumented('update')
+    def update(self, task_id, value, fetch=True, batch=None):
+        """
+        原子地合并更新任务字段
+
+        Args:
+            task_id (str): 任务ID
+            value (dict): 要更新的字段
+            fetch (bool): 是否在同一次往返中返回合并后的整条记录
+            batch (RedisBatch, optional): 提供时加入batch并返回BatchResult，
+                执行之后读取的结果与直接调用的返回值相同，任务不存在时读取结果抛出KeyError
+
+        Returns:
+            dict: 合并后的任务数据（fetch为False时返回None）
+
+        Raises:
+            KeyError: 任务不存在时
+        """
+        keys = self._update_keys(task_id)
+        args = self._update_args(value, fetch)
+        if batch is not None:
+            return batch.add(lambda pipe: queue_script(pipe, self._update_script, keys, args),
+                             lambda results: self._updated(task_id, results[-1], fetch))
+        return self._updated(task_id, self._update_script(keys=keys, args=args), fetch)
+        
+    def _updated(self, task_id, result, fetch):
+        """处理更新脚本的返回值"""
+        key = self._key(task_id)
+        if not result:
+            logger.debug("更新Redis任务时出错 %s: 任务不存在", key)
+            raise KeyError(task_id)
+        if not fetch:
+            return None
+        current_data = self._decode(result)
+        logger.debug("更新Redis任务 %s，合并后的数据: %s", key, current_data)
+        return current_data
+        
+    def _update_keys(self, task_id):
+        return [self._key(task_id), self.channel(task_id), self._files_key(task_id)]
+        
+    def _update_args(self, value, fetch):
+        files = self._file_refs(value)
+        args = ['1' if fetch else '0', value['status'] if 'status' in value else '', str(len(files))]
+        # 文件字段排在最前，脚本将它们同时写入文件引用哈希
+        ordered = dict(files)
+        ordered.update(value)
+        for field, item in self._encode(ordered).items():
+            args.extend((field, item))
+        return args
+        
+    def subscribe(self, task_id):
+        """
+        订阅任务的状态变化
+
+        Returns:
+            redis.client.PubSub: 已订阅任务频道的PubSub对象，使用完毕后需要close()
+        """
+        pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self.channel(task_id))
+        return pubsub
+        
+    @staticmethod
+    def wait_for_event(pubsub, timeout):
+        """
+        等待订阅频道上的下一条状态消息
+
+        Returns:
+            str: 新的状态；超时返回None
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            # 订阅确认等消息被忽略时get_message也会返回None，需要继续等待
+            message = pubsub.get_message(timeout=remaining)
+            if message is not None:
+                return message['data'].decode('utf-8')
+        
+    @_instrumented('mget')
+    def mget(self, task_ids):
+        """
+        批量获取多个任务，一次往返
+
+        Returns:
+            list: 与task_ids顺序对应的任务数据，不存在的任务为None
+        """
+        pipe = self.redis.pipeline(transaction=False)
+        for task_id in task_ids:
+            pipe.hgetall(self._key(task_id))
+        results = []
+        for task_id, data in zip(task_ids, pipe.execute(raise_on_error=False)):
+            if isinstance(data, redis.exceptions.ResponseError):
+                # 旧版本以JSON字符串保存的任务
+                results.append(self.get(task_id))
+            else:
+                results.append(self._decode(data) if data else None)
+        return results
+        
+    @_instrumented('mupdate')
+    def mupdate(self, updates):
+        """
+        批量合并更新多个任务，一次往返
+
+        Args:
+            updates (dict): 任务ID到待更新字段的映射
+
+        Returns:
+            dict: 任务ID到是否更新成功（任务存在）的映射
+        """
+        pipe = self.redis.pipeline(transaction=False)
+        task_ids = list(updates)
+        for task_id in task_ids:
+            queue_script(pipe, self._update_script, self._update_keys(task_id),
+                         self._update_args(updates[task_id], False))
+        return {task_id: bool(result) for task_id, result in zip(task_ids, pipe.execute())}
+            
+    @_instrumented('delete')
+    def delete_many(self, task_ids):
+        """批量删除任务及其索引项和文件引用，一次往返；调用方应先删除任务的文件"""
+        if not task_ids:
+            return
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.delete(*[self._key(task_id) for task_id in task_ids])
+        if self.file_fields:
+            pipe.delete(*[self._files_key(task_id) for task_id in task_ids])
+        pipe.zrem(self.index_key, *task_ids)
+        pipe.execute()
+        
+    def mget_files(self, task_ids):
+        """
+        批量读取任务的文件引用，一次往返；任务记录已过期时仍然可以读取
+
+        Returns:
+            list: 与task_ids顺序对应的文件字段，没有文件引用的任务为None
+        """
+        pipe = self.redis.pipeline(transaction=False)
+        for task_id in task_ids:
+            pipe.hgetall(self._files_key(task_id))
+        return [self._decode(data) if data else None for data in pipe.execute()]
+        
+    def set_files(self, task_id, value):
+        """
+        替换任务的文件引用，用于记录清理进度：已删除的文件不再出现在文件引用中
+
+        Args:
+            task_id (str): 任务ID
+            value (dict): 剩余的文件字段，为空时删除文件引用
+        """
+        key = self._files_key(task_id)
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.delete(key)
+        if value:
+            pipe.hset(key, mapping=self._encode(value))
+        pipe.execute()
+        
+    @_instrumented('expired')
+    def expired(self, before, limit=None, offset=0):
+        """
+        通过created_at索引查找在指定时间之前创建的任务
+
+        查询代价与过期任务数量成正比，与任务总数无关。
+
+        Args:
+            before (float): 时间戳，created_at不晚于该时间的任务视为过期
+            limit (int, optional): 最多返回的任务数
+            offset (int): 跳过最早的若干个任务，例如本轮清理失败、仍留在索引中的任务
+
+        Returns:
+            list: 按created_at升序排列的任务ID
+        """
+        if limit is None and not offset:
+            ids = self.redis.zrangebyscore(self.index_key, '-inf', before)
+        else:
+            ids = self.redis.zrangebyscore(self.index_key, '-inf', before, start=offset,
+                                           num=-1 if limit is None else limit)
+        return [task_id.decode('utf-8') for task_id in ids]
+        
+    def keys(self, batch_size=500):
+        """使用SCAN增量遍历所有任务ID，不会阻塞Redis"""
+        for key in self.redis.scan_iter(match=f"{self.prefix}*", count=batch_size):
+            yield key.decode('utf-8')[len(self.prefix):]
+            
+    def reindex(self, batch_size=500):
+        """
+        为缺少索引项的任务补建created_at索引
+
+        用于从没有索引的旧版本升级，使用SCAN遍历，不会阻塞Redis。
+
+        Returns:
+            int: 补建的索引项数量
+        """
+        added = 0
+        batch = []
+        for task_id in self.keys(batch_size):
+            batch.append(task_id)
+            if len(batch) >= batch_size:
+                added += self._reindex_batch(batch)
+                batch = []
+        if batch:
+            added += self._reindex_batch(batch)
+        logger.info(f"已补建 {added} 个任务索引")
+        return added
+        
+    def migrate_index(self, batch_size=500, lock_timeout=60):
+        """
+        为旧版本的任务补建索引，只执行一次
+
+        旧版本的任务记录没有索引项和过期时间，只有补建索引后才会被清理任务删除。
+        补建完成后设置迁移标记，之后的调用只检查标记；多个进程同时调用时只有一个执行补建。
+
+        Args:
+            batch_size (int): 每批处理的任务数
+            lock_timeout (int): 补建期间持有的锁的过期时间（秒），持有期间自动续期
+
+        Returns:
+            int or None: 补建的索引项数量，已经迁移过或其他进程正在迁移时为None
+        """
+        if self.redis.exists(self.migrated_key):
+            return None
+        with hold_lock(self.redis, f"{self.migrated_key}:lock", lock_timeout) as lock:
+            if lock is None or self.redis.exists(self.migrated_key):
+                return None
+            added = self.reindex(batch_size)
+            self.redis.set(self.migrated_key, 1)
+            return added
+        
+    def _reindex_batch(self, task_ids):
+        scores = {}
+        for task_id, task in zip(task_ids, self.mget(task_ids)):
+            if task is not None:
+                scores[task_id] = task.get('created_at', time.time())
+        if not scores:
+            return 0
+        # NX: 只补建缺失的索引项
+        return self.redis.zadd(self.index_key, scores, nx=True)
             
     def clear(self):
         """清除所有任务"""
         try:
-            # 获取所有任务的键
-            pattern = f"{self.prefix}*"
-            keys = self.redis.keys(pattern)
-            print(f"正在清除所有任务，找到 {len(keys)} 个任务")
-            
-            if keys:
-                # 删除所有任务
-                self.redis.delete(*keys)
-                print(f"已清除 {len(keys)} 个任务")
-            return len(keys)
+            # 使用SCAN分批删除，避免KEYS阻塞Redis
+            count = 0
+            batch = []
+            for task_id in self.keys():
+                batch.append(self._key(task_id))
+                if len(batch) >= 500:
+                    self.redis.delete(*batch)
+                    count += len(batch)
+                    batch = []
+            if batch:
+                self.redis.delete(*batch)
+                count += len(batch)
+            self.redis.delete(self.index_key)
+            logger.info(f"已清除 {count} 个任务")
+            return count
         except Exception as e:
-            print(f"清除任务时出错: {str(e)}")
+            logger.error(f"清除任务时出错: {str(e)}")
             raise
             
-    def items(self):
-        """获取所有任务的迭代器"""
+    def items(self, batch_size=500):
+        """获取所有任务的迭代器，使用SCAN分批读取"""
         try:
-            # 获取所有任务的键
-            pattern = f"{self.prefix}*"
-            keys = self.redis.keys(pattern)
-            
-            # 遍历所有键，返回(task_id, task_data)对
-            for key in keys:
-                task_id = key.decode('utf-8').replace(self.prefix, '')
-                try:
-                    task_data = self[task_id]
-                    yield task_id, task_data
-                except Exception as e:
-                    print(f"获取任务数据时出错 {key}: {str(e)}")
-                    continue
+            batch = []
+            for task_id in self.keys(batch_size):
+                batch.append(task_id)
+                if len(batch) >= batch_size:
+                    yield from self._items_batch(batch)
+                    batch = []
+            if batch:
+                yield from self._items_batch(batch)
         except Exception as e:
-            print(f"获取任务列表时出错: {str(e)}")
+            logger.error(f"获取任务列表时出错: {str(e)}")
             raise
+            
+    def _items_batch(self, task_ids):
+        for task_id, task_data in zip(task_ids, self.mget(task_ids)):
+            if task_data is not None:
+                yield task_id, task_data
+
+# 任务记录中引用文件的字段，由blobs.release_task_files释放
+TASK_FILE_FIELDS = ('file_digest', 'file_path', 'source_digests', 'output_key', 'split_key', 'output_path', 'split_path')
 
 # 创建全局任务存储实例
-task_store = RedisTaskStore(redis_client)
+# Redis过期时间比保留时间多出两个清理周期，清理任务没有运行时，Redis过期作为兜底，记录不会无限堆积；
+# 文件引用不过期，记录过期后清理任务仍能通过索引找到并删除文件
+task_store = RedisTaskStore(redis_client, ttl=TASK_RETENTION_SECONDS + 2 * TASK_REAP_INTERVAL, metrics=metrics,
+                            file_fields=TASK_FILE_FIELDS)
+# 批量任务记录，结构与单个任务相同，保存子任务ID列表和汇总结果
+batch_store = RedisTaskStore(redis_client, prefix='pdf_batch:', ttl=TASK_RETENTION_SECONDS + 2 * TASK_REAP_INTERVAL,
+                             metrics=metrics)
 
 # 创建Celery应用
 celery_app = Celery(
@@ -129,15 +598,71 @@ celery_app.conf.update(
     timezone='Asia/Shanghai',
     enable_utc=False,
     worker_max_tasks_per_child=100,  # 每个worker处理的最大任务数
+    worker_max_memory_per_child=WORKER_MAX_MEMORY_PER_CHILD,  # 按内存增长回收worker子进程
     task_acks_late=True,  # 任务完成后再确认
     task_reject_on_worker_lost=True,  # worker丢失时拒绝任务
     task_track_started=True,  # 跟踪任务开始状态
     broker_connection_retry=True,  # 连接代理失败时重试
     broker_connection_retry_on_startup=True,  # 启动时连接代理失败时重试
     broker_connection_max_retries=10,  # 最大重试次数
-    worker_prefetch_multiplier=4,  # worker预取任务数量
+    redis_backend_health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,  # 结果后端的空闲连接在使用前先检查
+    # 默认的预取数量和并发数，各队列的worker在supervisord.conf中单独设置
+    worker_prefetch_multiplier=1,  # worker预取任务数量
     worker_concurrency=os.cpu_count() or 4,  # worker并发数
+    # PDF任务在提交时按文件大小指定队列（select_queue），未指定队列的任务进入pdf.small
+    task_queues=(
+        Queue(QUEUE_SMALL),
+        Queue(QUEUE_LARGE),
+        Queue(QUEUE_MAINTENANCE),
+    ),
+    task_default_queue=QUEUE_SMALL,
+    task_routes={
+        'pdfeditserver.tasks.cleanup_old_tasks': {'queue': QUEUE_MAINTENANCE},
+    },
+    beat_schedule={
+        # 增量清理过期任务，每个周期只处理刚过期的任务，磁盘占用随实际任务量变化
+        'cleanup-old-tasks': {
+            'task': 'pdfeditserver.tasks.cleanup_old_tasks',
+            'schedule': float(TASK_REAP_INTERVAL),
+        },
+    },
 )
 
+# 任务开始执行的时间和关联ID的恢复令牌，{任务ID: (perf_counter, Token)}，只在执行任务的进程中使用
+_task_started = {}
+
+@signals.before_task_publish.connect
+def _stamp_published_at(headers=None, **kwargs):
+    """提交任务时在消息头中记录时间和当前请求的关联ID，worker据此计算排队等待时间、关联日志"""
+    if headers is not None:
+        headers['published_at'] = time.time()
+        if correlation_id.get() != '-':
+            headers['correlation_id'] = correlation_id.get()
+
+@signals.task_prerun.connect
+def _record_task_start(task_id=None, task=None, **kwargs):
+    # 沿用提交任务的请求的关联ID；在当前进程中直接执行（eager）时保留当前的关联ID
+    current = correlation_id.get()
+    token = bind_correlation_id(getattr(task.request, 'correlation_id', None) or
+                                (current if current != '-' else task_id))
+    _task_started[task_id] = (time.perf_counter(), token)
+    published_at = getattr(task.request, 'published_at', None)
+    # 延迟执行（eta/countdown）的任务不计入排队等待时间
+    if published_at is not None and not task.request.eta:
+        queue = (task.request.delivery_info or {}).get('routing_key') or 'unknown'
+        metrics.observe('pdf_task_queue_wait_seconds', max(0.0, time.time() - published_at),
+                        task=task.name, queue=queue)
+
+@signals.task_postrun.connect
+def _record_task_end(task_id=None, task=None, state=None, **kwargs):
+    queue = (task.request.delivery_info or {}).get('routing_key') or 'unknown'
+    metrics.inc('pdf_tasks_total', task=task.name, queue=queue, state=state or 'unknown')
+    started = _task_started.pop(task_id, None)
+    if started is not None:
+        metrics.observe('pdf_task_duration_seconds', time.perf_counter() - started[0], task=task.name, queue=queue)
+        reset_correlation_id(started[1])
+    # prefork子进程可能随时被回收，每个任务结束时立即合并指标
+    metrics.flush()
+
 if __name__ == '__main__':
     celery_app.start() 
\ No newline at end of file
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Redis连接管理
+
+gunicorn worker和Celery prefork子进程都由fork产生，导入时创建的连接池会被子进程继承，
+父子进程共用同一个套接字会读到对方的响应。这里每个Redis地址在进程中只有一个客户端，
+fork出的子进程为它换上新的连接池；客户端对象本身不变，持有它的存储和已注册的脚本无需重新创建。
+
+连接池按进程中访问Redis的线程数设置上限，用尽时等待空闲连接而不是无限新建连接；
+空闲超过REDIS_HEALTH_CHECK_INTERVAL的连接在使用前先PING，避免使用已被服务器或网络设备断开的连接。
+
+RedisBatch把多个存储操作合并到一个pipeline中，一次往返发送。
+hold_lock提供跨进程的互斥锁，持有期间自动续期。
+"""
+
+import os
+import logging
+import threading
+from contextlib import contextmanager
+
+import redis
+from redis.exceptions import LockError, LockNotOwnedError
+
+logger = logging.getLogger(__name__)
+
+# 每个进程中同时访问Redis的线程数：gunicorn的--threads加上快速路径线程数，或worker的并发线程数
+REDIS_POOL_THREADS = int(os.environ.get('REDIS_POOL_THREADS', 4))
+# 每个进程中每个Redis地址的连接数上限；每个线程可能同时占用两个连接（状态长轮询和事件流的订阅各占一个），
+# 另外留给指标合并等后台线程
+REDIS_MAX_CONNECTIONS = int(os.environ.get('REDIS_MAX_CONNECTIONS', 2 * REDIS_POOL_THREADS + 2))
+# 连接数达到上限时等待空闲连接的时间（秒），超时抛出redis.exceptions.ConnectionError
+REDIS_POOL_TIMEOUT = float(os.environ.get('REDIS_POOL_TIMEOUT', 5))
+# 空闲超过该时间（秒）的连接在使用前先PING检查，为0时不检查
+REDIS_HEALTH_CHECK_INTERVAL = int(os.environ.get('REDIS_HEALTH_CHECK_INTERVAL', 30))
+# 建立连接的超时时间（秒）
+REDIS_CONNECT_TIMEOUT = float(os.environ.get('REDIS_CONNECT_TIMEOUT', 5))
+
+_lock = threading.Lock()
+# {Redis地址: 客户端}
+_clients = {}
+
+def _create_pool(url):
+    return redis.BlockingConnectionPool.from_url(
+        url,
+        max_connections=REDIS_MAX_CONNECTIONS,
+        timeout=REDIS_POOL_TIMEOUT,
+        health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+        socket_connect_timeout=REDIS_CONNECT_TIMEOUT,
+        socket_keepalive=True
+    )
+
+def get_client(url):
+    """
+    获取Redis地址对应的客户端，同一进程中相同的地址共用一个客户端和连接池
+
+    Args:
+        url (str): Redis地址，例如 redis://localhost:6379/0
+
+    Returns:
+        redis.Redis: 客户端，fork之后在子进程中仍可直接使用
+    """
+    with _lock:
+        client = _clients.get(url)
+        if client is None:
+            client = _clients[url] = redis.Redis(connection_pool=_create_pool(url))
+        return client
+
+def _reset_pools():
+    """
+    fork出的子进程中为每个客户端换上新的连接池
+
+    继承来的连接不关闭：套接字仍由父进程使用，关闭（shutdown）会断开父进程的连接。
+    父进程fork时可能有线程持有旧连接池的锁，因此不复用旧连接池。
+    """
+    global _lock
+    _lock = threading.Lock()
+    for url, client in _clients.items():
+        client.connection_pool = _create_pool(url)
+
+os.register_at_fork(after_in_child=_reset_pools)
+
+def queue_script(pipe, script, keys, args):
+    """
+    在pipeline中执行服务端脚本
+
+    使用EVAL而不是EVALSHA：pipeline中有EVALSHA时执行前要先用SCRIPT EXISTS检查，多一次往返。
+
+    Args:
+        pipe (redis.client.Pipeline): 目标pipeline
+        script (redis.commands.core.Script): register_script返回的脚本
+        keys (list): 脚本的KEYS
+        args (list): 脚本的ARGV
+    """
+    pipe.eval(script.script, len(keys), *keys, *args)
+
+class BatchResult:
+    """RedisBatch执行之后才能读取的操作结果"""
+
+    def __init__(self, start, end, convert=None):
+        self.start = start
+        self.end = end
+        self._convert = convert
+        self._done = False
+        self._value = None
+        self._error = None
+
+    def _set(self, results):
+        try:
+            for item in results:
+                if isinstance(item, Exception):
+                    raise item
+            self._value = self._convert(results) if self._convert is not None else results[-1]
+        except Exception as e:
+            self._error = e
+        self._done = True
+
+    @property
+    def value(self):
+        """
+        操作的结果
+
+        Raises:
+            RuntimeError: RedisBatch尚未执行时
+            Exception: 操作的命令出错，或处理结果时出错（例如任务不存在时的KeyError）
+        """
+        if not self._done:
+            raise RuntimeError("RedisBatch尚未执行")
+        if self._error is not None:
+            raise self._error
+        return self._value
+
+class RedisBatch:
+    """
+    在一次往返中执行多个存储操作
+
+    支持batch参数的存储方法把命令加入同一个pipeline并返回BatchResult，退出with块时一起执行：
+
+        with RedisBatch(redis_client) as batch:
+            invalid = blob_store.get_invalid(digest, batch=batch)
+            document = blob_store.get_document(digest, batch=batch)
+        invalid.value, document.value
+
+    with块中出现异常时已加入的命令不会执行。与pipeline相同，命令出错时所有命令执行完之后抛出第一个错误；
+    处理结果时的错误（例如更新的任务不存在）只在读取该操作的结果时抛出，不影响其他操作。
+    """
+
+    def __init__(self, client, transaction=False):
+        self.pipeline = client.pipeline(transaction=transaction)
+        self._results = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        try:
+            if exc_type is None:
+                self.execute()
+        finally:
+            self.pipeline.reset()
+        return False
+
+    def add(self, queue, convert=None):
+        """
+        加入一个操作
+
+        Args:
+            queue (callable): 接收pipeline，向其中加入该操作的命令
+            convert (callable, optional): 接收这些命令的结果列表，返回操作的结果；默认取最后一条命令的结果
+
+        Returns:
+            BatchResult: 执行之后可以读取的结果
+        """
+        start = len(self.pipeline)
+        queue(self.pipeline)
+        result = BatchResult(start, len(self.pipeline), convert)
+        self._results.append(result)
+        return result
+
+    def execute(self):
+        """
+        发送已加入的命令并填充各操作的结果，没有命令时不产生往返
+
+        Raises:
+            redis.exceptions.RedisError: 命令出错时，其他操作的结果仍然可以读取
+        """
+        if not self._results:
+            return
+        replies = self.pipeline.execute(raise_on_error=False)
+        for result in self._results:
+            result._set(replies[result.start:result.end])
+        self._results = []
+        for reply in replies:
+            if isinstance(reply, Exception):
+                raise reply
+
+@contextmanager
+def hold_lock(client, name, timeout, blocking=False, blocking_timeout=None):
+    """
+    持有Redis锁，持有期间由后台线程每timeout/3秒续期一次
+
+    锁的值是随机令牌，续期和释放由服务端脚本比较令牌后执行：锁因进程卡住或退出而过期、
+    被其他请求取得后，原持有者不会续期或删除别人的锁。续期使持有时间不受timeout限制，
+    timeout只决定持有者异常退出后锁多久失效。
+
+    Args:
+        client (redis.Redis): Redis客户端
+        name (str): 锁的键名
+        timeout (float): 锁的过期时间（秒）
+        blocking (bool): 锁被占用时是否等待
+        blocking_timeout (float, optional): 最长等待时间（秒），None表示一直等待
+
+    Yields:
+        redis.lock.Lock: 取得的锁；未取得时为None
+    """
+    # 续期在另一个线程中进行，令牌不能保存在线程局部变量中
+    lock = client.lock(name, timeout=timeout, blocking=blocking, blocking_timeout=blocking_timeout,
+                       thread_local=False)
+    if not lock.acquire():
+        yield None
+        return
+
+    stop = threading.Event()
+
+    def renew():
+        while not stop.wait(timeout / 3):
+            try:
+                lock.reacquire()
+            except LockError:
+                logger.warning("锁在持有期间失效: %s", name)
+                return
+            except redis.exceptions.RedisError as e:
+                logger.warning("锁续期失败，稍后重试: %s: %s", name, e)
+
+    renewer = threading.Thread(target=renew, name=f"lock-renew:{name}", daemon=True)
+    renewer.start()
+    try:
+        yield lock
+    finally:
+        stop.set()
+        renewer.join()
+        try:
+            lock.release()
+        except LockNotOwnedError:
+            logger.warning("锁已过期并可能被其他请求取得，未删除: %s", name)
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+日志配置
+
+pdfeditserver下所有模块的日志通过QueueHandler放入内存队列，由后台线程中的
+QueueListener写出，请求线程和任务不会因写stdout而阻塞。每条日志带有关联ID：
+Web请求使用X-Request-ID（没有时生成），Celery任务沿用提交任务的请求的关联ID，
+没有时使用Celery任务ID。状态轮询这类高频日志按LOG_SAMPLE_RATE抽样记录。
+"""
+
+import os
+import sys
+import json
+import queue
+import atexit
+import random
+import logging
+import logging.handlers
+import contextvars
+
+# 日志级别，DEBUG时记录完整的任务数据
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+# 日志格式：text为单行文本，json为每行一个JSON对象
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')
+# 高频日志（extra=SAMPLED）的抽样比例，0到1之间
+LOG_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', 0.01))
+# 内存队列的最大长度，写出跟不上时丢弃新的日志而不是阻塞调用方
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+
+# 高频日志使用的extra参数，例如 logger.info("...", extra=SAMPLED)
+SAMPLED = {'sampled': True}
+
+# 当前请求或任务的关联ID
+correlation_id = contextvars.ContextVar('correlation_id', default='-')
+
+TEXT_FORMAT = '%(asctime)s %(levelname)s [%(correlation_id)s] %(name)s: %(message)s'
+
+class CorrelationFilter(logging.Filter):
+    """在日志记录中加入当前的关联ID"""
+
+    def filter(self, record):
+        record.correlation_id = correlation_id.get()
+        return True
+
+class SamplingFilter(logging.Filter):
+    """按比例抽样标记了sampled的日志，其他日志全部保留"""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if not getattr(record, 'sampled', False):
+            return True
+        return random.random() < self.rate
+
+class JsonFormatter(logging.Formatter):
+    """每条日志输出为一行JSON"""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'correlation_id': getattr(record, 'correlation_id', '-'),
+            'message': record.getMessage()
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """队列已满时丢弃日志，不阻塞调用方"""
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+_handler = None
+_listener = None
+
+def _start_listener():
+    """创建队列和写出线程；fork出的子进程中写出线程不存在，需要重新创建"""
+    global _listener
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter() if LOG_FORMAT == 'json' else logging.Formatter(TEXT_FORMAT))
+    _handler.queue = queue.Queue(LOG_QUEUE_SIZE)
+    _listener = logging.handlers.QueueListener(_handler.queue, output)
+    _listener.start()
+
+def _stop_listener():
+    """进程退出前写出队列中剩余的日志"""
+    if _listener is not None:
+        _listener.stop()
+
+def configure_logging():
+    """
+    为pdfeditserver配置日志，每个进程只配置一次
+
+    级别、抽样过滤和消息参数的代入在调用方线程中完成，添加时间等格式化和写出在后台线程中完成；
+    低于LOG_LEVEL的日志在调用logger方法时即被丢弃，使用 %s 参数的日志不会代入参数。
+    """
+    global _handler
+    if _handler is not None:
+        return
+
+    _handler = DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    _handler.addFilter(SamplingFilter(LOG_SAMPLE_RATE))
+    _handler.addFilter(CorrelationFilter())
+    _start_listener()
+
+    logger = logging.getLogger('pdfeditserver')
+    logger.setLevel(LOG_LEVEL)
+    logger.addHandler(_handler)
+    # Celery worker会接管根日志记录器，本包的日志不再传递给它，避免重复输出
+    logger.propagate = False
+
+    os.register_at_fork(after_in_child=_start_listener)
+    atexit.register(_stop_listener)
+
+def bind_correlation_id(value):
+    """
+    设置当前上下文的关联ID
+
+    Returns:
+        contextvars.Token: 传给reset_correlation_id以恢复之前的值
+    """
+    return correlation_id.set(value)
+
+def reset_correlation_id(token):
+    """恢复bind_correlation_id之前的关联ID"""
+    correlation_id.reset(token)
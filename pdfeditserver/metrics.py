@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+运行指标
+
+计数器和直方图先在每个进程的内存中累加，定期（以及每个Celery任务结束时）用一次
+pipeline以HINCRBY/HINCRBYFLOAT合并到Redis哈希中，gunicorn的多个worker进程和
+Celery prefork子进程的数据因此在Redis中汇总，记录指标本身不产生Redis往返。
+/metrics 读取汇总后的数据，以Prometheus文本格式输出。
+"""
+
+import os
+import time
+import atexit
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# 进程内缓冲的指标合并到Redis的间隔（秒）
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))
+# 目录占用空间的统计结果在每个进程中缓存的时间（秒），避免每次抓取都遍历上传目录
+DISK_USAGE_MAX_AGE = float(os.environ.get('METRICS_DISK_USAGE_MAX_AGE', 60))
+
+# 耗时直方图的上界（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+# Redis操作耗时直方图的上界（秒）
+REDIS_LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+
+# 指标定义：{名称: (类型, 说明, 直方图上界)}
+METRICS = {
+    'pdf_tasks_total': ('counter', 'Celery任务执行次数，按任务名称、队列和结果状态区分', None),
+    'pdf_task_duration_seconds': ('histogram', 'Celery任务的执行耗时', LATENCY_BUCKETS),
+    'pdf_task_queue_wait_seconds': ('histogram', '任务从提交到开始执行的等待时间', LATENCY_BUCKETS),
+    'pdf_stage_duration_seconds': ('histogram', 'PDF处理各阶段的耗时（parse/copy/write）', LATENCY_BUCKETS),
+    'pdf_store_operations_total': ('counter', 'RedisTaskStore的操作次数', None),
+    'pdf_store_operation_seconds': ('histogram', 'RedisTaskStore的操作耗时', REDIS_LATENCY_BUCKETS),
+    'pdf_upload_bytes_total': ('counter', '上传的字节数', None),
+    'pdf_uploads_total': ('counter', '完成的上传次数', None),
+    'pdf_upload_duration_seconds': ('histogram', '接收上传数据的耗时', LATENCY_BUCKETS),
+    'pdf_document_cache_total': ('counter', '上传时文档描述信息缓存的查询结果（hit/miss/invalid）', None),
+    'pdf_dispatch_total': ('counter', '/process 请求的处理路径（fast/fast_fallback/queued）', None),
+}
+
+def _series(name, labels):
+    """序列名，例如 pdf_tasks_total{queue="pdf.small",task="process_pdf"}"""
+    if not labels:
+        return name
+    body = ','.join(f'{key}="{value}"' for key, value in sorted(labels.items()))
+    return f"{name}{{{body}}}"
+
+def _family(series):
+    """序列所属的指标名称，直方图的 _bucket/_sum/_count 序列归入同一指标"""
+    name = series.split('{', 1)[0]
+    if name not in METRICS:
+        for suffix in ('_bucket', '_sum', '_count'):
+            if name.endswith(suffix) and name[:-len(suffix)] in METRICS:
+                return name[:-len(suffix)]
+    return name
+
+def _format_value(value):
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+class MetricsRegistry:
+    """
+    进程内缓冲、在Redis中汇总的计数器和直方图
+
+    fork出的子进程丢弃从父进程复制来的缓冲，避免同一份数据被合并两次。
+    """
+
+    def __init__(self, redis_client, key='pdf_metrics', flush_interval=METRICS_FLUSH_INTERVAL):
+        self.redis = redis_client
+        self.key = key
+        self.flush_interval = flush_interval
+        self._reset()
+        os.register_at_fork(after_in_child=self._reset)
+        atexit.register(self.flush)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        # {序列名: 增量}
+        self._pending = {}
+        self._flusher = None
+
+    def _add(self, series, value):
+        self._pending[series] = self._pending.get(series, 0) + value
+
+    def inc(self, name, value=1, **labels):
+        """计数器加value"""
+        with self._lock:
+            self._add(_series(name, labels), value)
+        self._ensure_flusher()
+
+    def observe(self, name, value, **labels):
+        """向直方图记录一个观测值"""
+        buckets = METRICS[name][2]
+        with self._lock:
+            # 桶按Prometheus的约定累计：每个上界记录不超过它的观测次数
+            for bound in buckets:
+                if value <= bound:
+                    self._add(_series(f"{name}_bucket", dict(labels, le=_format_value(bound))), 1)
+            self._add(_series(f"{name}_bucket", dict(labels, le='+Inf')), 1)
+            self._add(_series(f"{name}_sum", labels), float(value))
+            self._add(_series(f"{name}_count", labels), 1)
+        self._ensure_flusher()
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """记录with块的耗时"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def _ensure_flusher(self):
+        """每个进程在第一次记录指标时启动后台线程，定期合并缓冲"""
+        if self._flusher is not None:
+            return
+        with self._lock:
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, name='metrics-flush', daemon=True)
+                self._flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        """将缓冲的增量合并到Redis，失败时保留增量，下次再合并"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            for series, value in pending.items():
+                if isinstance(value, int):
+                    pipe.hincrby(self.key, series, value)
+                else:
+                    pipe.hincrbyfloat(self.key, series, value)
+            pipe.execute()
+        except Exception as e:
+            logger.error(f"合并运行指标时出错: {str(e)}")
+            with self._lock:
+                for series, value in pending.items():
+                    self._add(series, value)
+
+    def get(self, name, **labels):
+        """读取一个序列在所有进程中的汇总值（包括当前进程尚未合并的部分）"""
+        self.flush()
+        value = self.redis.hget(self.key, _series(name, labels))
+        return 0 if value is None else float(value)
+
+    def collect(self):
+        """读取Redis中汇总的所有序列"""
+        data = self.redis.hgetall(self.key)
+        return {series.decode('utf-8'): float(value) for series, value in data.items()}
+
+    def render(self, samples=None):
+        """
+        以Prometheus文本格式输出汇总的指标
+
+        Args:
+            samples (list, optional): 抓取时读取的值，[(名称, 类型, 说明, {标签}, 值), ...]
+
+        Returns:
+            str: 文本格式的指标
+        """
+        self.flush()
+        families = {}
+        for series, value in self.collect().items():
+            families.setdefault(_family(series), []).append((series, value))
+
+        lines = []
+        for name in sorted(families):
+            kind, description, _ = METRICS.get(name, ('untyped', '', None))
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            for series, value in sorted(families[name], key=_bucket_order):
+                lines.append(f"{series} {_format_value(value)}")
+
+        described = set()
+        for name, kind, description, labels, value in samples or []:
+            if name not in described:
+                lines.append(f"# HELP {name} {description}")
+                lines.append(f"# TYPE {name} {kind}")
+                described.add(name)
+            lines.append(f"{_series(name, labels)} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        """清除所有汇总的指标"""
+        with self._lock:
+            self._pending = {}
+        self.redis.delete(self.key)
+
+def _bucket_order(item):
+    """同一组标签的桶按上界从小到大排列，+Inf在最后"""
+    series = item[0]
+    if '_bucket{' not in series or 'le="' not in series:
+        return (series, 0)
+    bound = series.split('le="', 1)[1].split('"', 1)[0]
+    prefix = series.replace(f'le="{bound}"', '')
+    return (prefix, float('inf') if bound == '+Inf' else float(bound))
+
+# {目录: (统计时间, (字节数, 文件数))}
+_disk_usage_cache = {}
+
+def directory_usage(path, max_age=DISK_USAGE_MAX_AGE):
+    """
+    统计目录（含子目录）中文件的总字节数和文件数，结果缓存max_age秒
+
+    Returns:
+        tuple: (字节数, 文件数)
+    """
+    cached = _disk_usage_cache.get(path)
+    if cached is not None and time.monotonic() - cached[0] < max_age:
+        return cached[1]
+    total = files = 0
+    pending = [path]
+    while pending:
+        try:
+            entries = list(os.scandir(pending.pop()))
+        except FileNotFoundError:
+            continue
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    # 缓存中的硬链接会被重复计入
+                    total += entry.stat(follow_symlinks=False).st_size
+                    files += 1
+            except FileNotFoundError:
+                # 统计期间被删除的文件
+                continue
+    _disk_usage_cache[path] = (time.monotonic(), (total, files))
+    return total, files
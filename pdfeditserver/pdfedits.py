@@ -8,12 +8,162 @@ PDF页面删除工具
 使用方法：
 python pdfedits.py input.pdf 1 2 3
 将会删除input.pdf中的第1,2,3页，并生成新文件input_edit.pdf
+页面也可以用范围表达式指定，例如 1-500,702,900-、odd、even
+删除、保留、重排、旋转、复制和插入空白页可以组合为一个编辑计划，一次读写完成：
+python pdfedits.py input.pdf --plan plan.json
 """
 
+import io
 import os
+import re
 import sys
+import json
+import mmap
+import zlib
+import bisect
+import time
+import shutil
+import logging
+import hashlib
+import contextlib
+import struct
+import zipfile
 import argparse
+import multiprocessing
+from collections import namedtuple
 from PyPDF2 import PdfReader, PdfWriter
+from PyPDF2.errors import PyPdfError
+from PyPDF2.generic import (ArrayObject, BooleanObject, DictionaryObject, FloatObject, IndirectObject,
+                            NameObject, NumberObject, StreamObject)
+
+logger = logging.getLogger(__name__)
+
+class PageSet:
+    """
+    页面号集合
+
+    以排序、合并后的闭区间列表保存，成员判断在区间起点上二分查找，
+    内存只与区间数量有关：总页数未知时，"1-2000000000" 这样的范围也只占一个区间。
+    """
+
+    def __init__(self, ranges, total_pages):
+        """
+        Args:
+            ranges (list): 排序且互不重叠的 (起始页, 结束页) 闭区间列表
+            total_pages (int): 文档总页数
+        """
+        self.ranges = ranges
+        self.total_pages = total_pages
+        self._starts = [start for start, _ in ranges]
+        self._count = sum(end - start + 1 for start, end in ranges)
+
+    def __contains__(self, page_num):
+        if not 0 < page_num <= self.total_pages:
+            return False
+        index = bisect.bisect_right(self._starts, page_num) - 1
+        return index >= 0 and page_num <= self.ranges[index][1]
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        for start, end in self.ranges:
+            yield from range(start, end + 1)
+
+    def __bool__(self):
+        return self._count > 0
+
+    def to_spec(self):
+        """规范化的页面范围表达式，例如 "1-500,702,900-1000" """
+        return ','.join(str(start) if start == end else f"{start}-{end}"
+                        for start, end in self.ranges)
+
+def _page_number(text, total_pages):
+    """解析并校验单个页面号"""
+    try:
+        page_num = int(text)
+    except ValueError:
+        raise ValueError(f"无效的页面号: {text}")
+    if page_num < 1 or (total_pages is not None and page_num > total_pages):
+        raise ValueError(f"页面号 {page_num} 无效。PDF总共有 {total_pages} 页")
+    return page_num
+
+def parse_page_spec(spec, total_pages=None):
+    """
+    解析页面选择
+
+    支持以下形式，可以用逗号组合：
+        "3"        单个页面
+        "5-7"      闭区间
+        "900-"     从第900页到最后一页
+        "odd"      所有奇数页
+        "even"     所有偶数页
+    也接受页面号列表（例如 [1, 2, 3]）或已解析的PageSet。
+
+    Args:
+        spec (str|list|PageSet): 页面选择
+        total_pages (int, optional): 文档总页数，用于校验页面号；
+            使用 "900-"、"odd"、"even" 时必须提供
+
+    Returns:
+        PageSet: 解析后的页面集合
+
+    Raises:
+        ValueError: 当页面选择无效时
+    """
+    if isinstance(spec, PageSet):
+        if total_pages is None or total_pages == spec.total_pages:
+            return spec
+        if spec.ranges:
+            _page_number(spec.ranges[-1][1], total_pages)
+        return PageSet(spec.ranges, total_pages)
+
+    ranges = []
+    if isinstance(spec, str):
+        tokens = [token.strip().lower() for token in spec.split(',')]
+    else:
+        tokens = list(spec)
+
+    for token in tokens:
+        if isinstance(token, bool) or not isinstance(token, (int, str)):
+            raise ValueError(f"无效的页面号: {token}")
+        if isinstance(token, int):
+            page_num = _page_number(token, total_pages)
+            ranges.append((page_num, page_num))
+        elif not token:
+            continue
+        elif token in ('odd', 'even'):
+            if total_pages is None:
+                raise ValueError(f"使用 {token} 时需要知道PDF总页数")
+            first = 1 if token == 'odd' else 2
+            ranges.extend((page_num, page_num) for page_num in range(first, total_pages + 1, 2))
+        elif '-' in token:
+            start_text, end_text = (part.strip() for part in token.split('-', 1))
+            start = _page_number(start_text, total_pages)
+            if end_text:
+                end = _page_number(end_text, total_pages)
+            elif total_pages is None:
+                raise ValueError(f"使用 {token} 时需要知道PDF总页数")
+            else:
+                end = total_pages
+            if start > end:
+                raise ValueError(f"无效的页面范围: {token}，起始页大于结束页")
+            ranges.append((start, end))
+        else:
+            page_num = _page_number(token, total_pages)
+            ranges.append((page_num, page_num))
+
+    # 排序并合并重叠或相邻的区间
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+
+    if total_pages is None:
+        total_pages = merged[-1][1] if merged else 0
+    return PageSet(merged, total_pages)
 
 def generate_output_path(input_path):
     """
@@ -37,78 +187,1079 @@ def generate_output_path(input_path):
         # 生成新的输出路径
         output_path = os.path.join(dir_path, f"{file_name}_edit{ext}")
         
-        # 打印路径信息，便于调试
-        print(f"输入路径: {input_path}")
-        print(f"基础路径: {base_path}")
-        print(f"目录路径: {dir_path}")
-        print(f"文件名: {file_name}")
-        print(f"输出路径: {output_path}")
+        logger.debug("输入路径: %s, 输出路径: %s", input_path, output_path)
         
         return output_path
     except Exception as e:
         # 记录错误信息
-        print(f"生成输出路径时出错: {str(e)}")
+        logger.error(f"生成输出路径时出错: {str(e)}")
         # 使用简单的方法作为备选
         return f"{input_path}_edit"
 
-def delete_pdf_pages(input_path, pages_to_delete):
+class InvalidPDFError(ValueError):
     """
-    从PDF文件中删除指定页面
-    
+    文件不是有效的PDF，或结构损坏无法解析；重试不会成功
+
+    cacheable为False时无法确定是文件损坏还是程序错误，不按摘要记录为无效文件。
+    """
+
+    def __init__(self, message, cacheable=True):
+        super().__init__(message)
+        self.cacheable = cacheable
+
+# 解析结构损坏的文件时PyPDF2抛出的异常，属于文件本身确定性的错误
+PARSE_ERRORS = (PyPdfError, zlib.error)
+# 引用指向不存在的对象时，PyPDF2会在None上取属性、按不存在的键取值；这些异常也可能来自程序错误，
+# 只在调用PyPDF2解析文件的位置转换为InvalidPDFError，且不记录到无效文件缓存
+PARSER_BUG_ERRORS = (KeyError, IndexError, TypeError, AttributeError)
+
+# 检查文件头和文件尾时读取的字节数
+STRUCTURE_PROBE_BYTES = 1024
+
+def validate_pdf_structure(input_path):
+    """
+    不解析对象，只检查PDF的基本结构：文件头、%%EOF结束标记和startxref
+
+    截断的上传、误传的其他格式文件在这一步就能识别，无需交给PdfReader。
+    startxref指向的位置不是交叉引用表时不报错，PdfReader可以重建交叉引用。
+
+    Args:
+        input_path (str): PDF文件路径
+
+    Raises:
+        InvalidPDFError: 当文件结构无效时
+    """
+    file_size = os.path.getsize(input_path)
+    if file_size == 0:
+        raise InvalidPDFError("文件为空")
+
+    with open(input_path, 'rb') as pdf_file:
+        head = pdf_file.read(STRUCTURE_PROBE_BYTES)
+        pdf_file.seek(max(0, file_size - STRUCTURE_PROBE_BYTES))
+        tail = pdf_file.read()
+
+    if b'%PDF-' not in head:
+        raise InvalidPDFError("文件不是PDF格式：缺少 %PDF- 文件头")
+    if b'%%EOF' not in tail:
+        raise InvalidPDFError("PDF文件不完整：缺少 %%EOF 结束标记，文件可能被截断")
+
+    position = tail.rfind(b'startxref')
+    if position < 0:
+        raise InvalidPDFError("PDF文件损坏：缺少 startxref")
+    try:
+        xref_offset = int(tail[position + len(b'startxref'):].split()[0])
+    except (ValueError, IndexError):
+        raise InvalidPDFError("PDF文件损坏：startxref 的值无效")
+    if xref_offset >= file_size:
+        raise InvalidPDFError("PDF文件不完整：交叉引用表位于文件之外，文件可能被截断")
+
+def extract_pdf_metadata(input_path):
+    """
+    解析一次PDF文件，提取文档描述信息
+
+    上传时调用一次，结果保存在任务记录中，后续的状态查询和处理任务
+    直接读取该描述信息，不再重复解析PDF。
+
     Args:
         input_path (str): 输入PDF文件的路径
-        pages_to_delete (list): 要删除的页面号列表（从1开始）
-    
+
+    Returns:
+        dict: 文档描述信息，包含以下字段：
+            page_count (int): 总页数
+            pages (list): 每页的宽、高（单位pt）和旋转角度
+            encrypted (bool): 是否加密
+            pdf_version (str): PDF版本号，例如 "1.4"
+            file_size (int): 文件字节数
+
     Raises:
         FileNotFoundError: 当输入文件不存在时
-        ValueError: 当页面号无效时
+        InvalidPDFError: 当文件结构无效、无法解析，或已加密且无法使用空密码打开时
+    """
+    if not os.path.exists(input_path):
+        raise FileNotFoundError(f"找不到输入文件：{input_path}")
+
+    validate_pdf_structure(input_path)
+
+    try:
+        with open(input_path, 'rb') as pdf_file:
+            pdf_reader = PdfReader(pdf_file)
+
+            encrypted = pdf_reader.is_encrypted
+            if encrypted and not pdf_reader.decrypt(''):
+                raise InvalidPDFError("PDF文件已加密，无法处理")
+
+            pages = []
+            for page in pdf_reader.pages:
+                mediabox = page.mediabox
+                pages.append({
+                    'width': float(mediabox.width),
+                    'height': float(mediabox.height),
+                    'rotation': page.rotation
+                })
+
+            # pdf_header形如 "%PDF-1.4"
+            pdf_version = pdf_reader.pdf_header.replace('%PDF-', '').strip()
+    except PARSE_ERRORS as e:
+        raise InvalidPDFError(f"无法解析PDF文件: {str(e)}")
+    except PARSER_BUG_ERRORS as e:
+        logger.exception("解析PDF文件时出现意外错误: %s", input_path)
+        raise InvalidPDFError(f"无法解析PDF文件: {type(e).__name__}: {str(e)}", cacheable=False)
+
+    return {
+        'page_count': len(pages),
+        'pages': pages,
+        'encrypted': encrypted,
+        'pdf_version': pdf_version,
+        'file_size': os.path.getsize(input_path)
+    }
+
+# 编辑计划中的一页：source为原文档页面号（空白页为None），rotation为追加的旋转角度，
+# size为空白页的 (宽, 高)，未指定时使用相邻页面的尺寸
+PlanPage = namedtuple('PlanPage', ['source', 'rotation', 'size'])
+
+# 未指定尺寸且文档没有任何页面可参照时，空白页使用Letter尺寸
+DEFAULT_PAGE_SIZE = (612, 792)
+
+# 大文件模式的内存估算：固定开销，加上页面树中每页的对象
+LARGE_MODE_BASE_MEMORY = 64 * 1024 * 1024
+LARGE_MODE_PAGE_MEMORY = 4 * 1024
+# 大文件模式每写出多少页检查一次内存
+MEMORY_CHECK_INTERVAL = 16
+
+# 输出方式：rewrite重新写出整个文件，incremental在原文件后追加增量更新，auto自动选择
+OUTPUT_MODES = ('rewrite', 'incremental', 'auto')
+# auto方式下，保留的原页面占总页数的比例达到该值时使用增量更新
+INCREMENTAL_MIN_KEPT_RATIO = 0.75
+
+# 一次拆分最多生成的文件数
+SPLIT_MAX_PARTS = 10000
+# 拆分时每个进程平均分到的分组数
+SPLIT_GROUPS_PER_WORKER = 4
+
+# 合并时按内容去重的资源类别
+DEDUPLICATED_RESOURCES = ('/Font', '/XObject', '/ColorSpace', '/Pattern', '/Shading', '/ExtGState')
+
+class EditPlan:
+    """
+    编辑计划：按顺序执行的编辑操作列表
+
+    每个操作是一个字典，op字段为操作类型，页面号指执行到该操作时的当前页面序列：
+        {"op": "delete", "pages": "1-3"}                 删除页面
+        {"op": "keep", "pages": "odd"}                   只保留页面
+        {"op": "reorder", "order": "3,1,2"}              重排页面，必须恰好包含每一页一次，
+                                                         支持降序范围 "10-1" 和 "reverse"
+        {"op": "rotate", "pages": "2", "angle": 90}      顺时针旋转，角度为90的倍数
+        {"op": "duplicate", "pages": "5", "copies": 1}   在页面之后插入副本
+        {"op": "insert_blank", "after": 0, "count": 1}   在第after页之后插入空白页，0表示最前面，
+                                                         可选width和height
+
+    计划先编译为输出页面序列（只需要总页数，不读取PDF），再由apply_edit_plan
+    通过一次读取和一次写入完成所有操作。编译结果的规范形式可作为结果缓存的键。
+    """
+
+    OPERATIONS = ('delete', 'keep', 'reorder', 'rotate', 'duplicate', 'insert_blank')
+
+    def __init__(self, operations):
+        """
+        Args:
+            operations (list): 编辑操作列表
+
+        Raises:
+            ValueError: 当操作格式无效时
+        """
+        if not isinstance(operations, list) or not operations:
+            raise ValueError("编辑操作必须是非空列表")
+        for index, operation in enumerate(operations, 1):
+            if not isinstance(operation, dict) or operation.get('op') not in self.OPERATIONS:
+                raise ValueError(f"第 {index} 个编辑操作无效，支持的操作: {', '.join(self.OPERATIONS)}")
+        self.operations = operations
+
+    @classmethod
+    def from_delete(cls, pages_to_delete):
+        """只删除页面的编辑计划"""
+        if isinstance(pages_to_delete, PageSet):
+            pages_to_delete = pages_to_delete.to_spec()
+        return cls([{'op': 'delete', 'pages': pages_to_delete}])
+
+    def compile(self, total_pages):
+        """
+        依次执行各操作，得到输出页面序列
+
+        Args:
+            total_pages (int): 原文档总页数
+
+        Returns:
+            list: PlanPage列表
+
+        Raises:
+            ValueError: 当页面号或参数无效时
+        """
+        pages = [PlanPage(page_num, 0, None) for page_num in range(1, total_pages + 1)]
+        for index, operation in enumerate(self.operations, 1):
+            try:
+                pages = getattr(self, f"_{operation['op']}")(pages, operation)
+            except ValueError as e:
+                raise ValueError(f"第 {index} 个编辑操作 ({operation['op']}) 无效: {str(e)}")
+        return pages
+
+    @staticmethod
+    def _selection(pages, operation):
+        if 'pages' not in operation:
+            raise ValueError("缺少pages字段")
+        return parse_page_spec(operation['pages'], len(pages))
+
+    def _delete(self, pages, operation):
+        selected = self._selection(pages, operation)
+        return [page for page_num, page in enumerate(pages, 1) if page_num not in selected]
+
+    def _keep(self, pages, operation):
+        selected = self._selection(pages, operation)
+        return [page for page_num, page in enumerate(pages, 1) if page_num in selected]
+
+    def _reorder(self, pages, operation):
+        order = _parse_page_order(operation.get('order'), len(pages))
+        return [pages[page_num - 1] for page_num in order]
+
+    def _rotate(self, pages, operation):
+        angle = operation.get('angle')
+        if isinstance(angle, bool) or not isinstance(angle, int) or angle % 90 != 0:
+            raise ValueError("angle必须是90的倍数")
+        selected = self._selection(pages, operation)
+        return [page._replace(rotation=(page.rotation + angle) % 360) if page_num in selected else page
+                for page_num, page in enumerate(pages, 1)]
+
+    def _duplicate(self, pages, operation):
+        copies = _positive_int(operation.get('copies', 1), 'copies')
+        selected = self._selection(pages, operation)
+        result = []
+        for page_num, page in enumerate(pages, 1):
+            result.append(page)
+            if page_num in selected:
+                result.extend([page] * copies)
+        return result
+
+    def _insert_blank(self, pages, operation):
+        after = operation.get('after', len(pages))
+        if isinstance(after, bool) or not isinstance(after, int) or not 0 <= after <= len(pages):
+            raise ValueError(f"after必须在0到{len(pages)}之间")
+        count = _positive_int(operation.get('count', 1), 'count')
+        size = None
+        if 'width' in operation or 'height' in operation:
+            width, height = operation.get('width'), operation.get('height')
+            if not all(isinstance(value, (int, float)) and not isinstance(value, bool) and value > 0
+                       for value in (width, height)):
+                raise ValueError("width和height必须同时指定且为正数")
+            size = (width, height)
+        return pages[:after] + [PlanPage(None, 0, size)] * count + pages[after:]
+
+def _positive_int(value, name):
+    """校验编辑操作中的正整数参数"""
+    if isinstance(value, bool) or not isinstance(value, int) or value < 1:
+        raise ValueError(f"{name}必须是正整数")
+    return value
+
+def _parse_page_order(order, total_pages):
+    """
+    解析重排顺序，保留给定的先后顺序
+
+    支持页面号列表，或逗号分隔的表达式，范围可以降序（例如 "10-1"），
+    "reverse" 表示倒序。结果必须恰好包含每一页一次。
+    """
+    if order == 'reverse':
+        return list(range(total_pages, 0, -1))
+    if isinstance(order, str):
+        tokens = [token.strip() for token in order.split(',') if token.strip()]
+    elif isinstance(order, list):
+        tokens = order
+    else:
+        raise ValueError("缺少order字段")
+
+    result = []
+    for token in tokens:
+        if isinstance(token, str) and '-' in token:
+            start_text, end_text = (part.strip() for part in token.split('-', 1))
+            start = _page_number(start_text, total_pages)
+            end = _page_number(end_text, total_pages) if end_text else total_pages
+            step = 1 if start <= end else -1
+            result.extend(range(start, end + step, step))
+        elif isinstance(token, bool) or not isinstance(token, (int, str)):
+            raise ValueError(f"无效的页面号: {token}")
+        else:
+            result.append(_page_number(token, total_pages))
+
+    if len(result) != total_pages or len(set(result)) != total_pages:
+        raise ValueError(f"重排顺序必须恰好包含第1到{total_pages}页各一次")
+    return result
+
+def canonical_plan(pages):
+    """
+    编译后页面序列的规范形式
+
+    连续递增且旋转角度相同的页面合并为范围，例如 "1-3,5@90,blank,blank:595x842,7-9"。
+    结果相同的不同编辑计划得到相同的规范形式。
+    """
+    parts = []
+    run_start = run_end = run_rotation = None
+
+    def flush():
+        if run_start is not None:
+            text = str(run_start) if run_start == run_end else f"{run_start}-{run_end}"
+            parts.append(f"{text}@{run_rotation}" if run_rotation else text)
+
+    for page in pages:
+        if page.source is not None and run_start is not None \
+                and page.source == run_end + 1 and page.rotation == run_rotation:
+            run_end = page.source
+            continue
+        flush()
+        if page.source is None:
+            run_start = None
+            parts.append('blank' if page.size is None else f"blank:{page.size[0]:g}x{page.size[1]:g}")
+        else:
+            run_start = run_end = page.source
+            run_rotation = page.rotation
+    flush()
+    return ','.join(parts)
+
+def plan_summary(pages, total_pages):
+    """
+    编辑结果的统计信息
+
+    Returns:
+        dict: total_pages、pages_kept（输出页数）和pages_deleted（未出现在输出中的原页数）
+    """
+    sources = {page.source for page in pages if page.source is not None}
+    return {
+        'total_pages': total_pages,
+        'pages_kept': len(pages),
+        'pages_deleted': total_pages - len(sources)
+    }
+
+class MemoryBudgetError(ValueError):
+    """处理过程中进程内存超过预算"""
+
+def current_rss():
+    """
+    当前进程的匿名常驻内存（字节）
+
+    使用 /proc/self/statm 的 resident - shared，不包含内存映射文件的页缓存，
+    大文件模式通过mmap读取的PDF不会被计入。无法读取时返回None。
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            fields = statm.read().split()
+        return (int(fields[1]) - int(fields[2])) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+def estimate_memory(file_size, page_count, large):
+    """
+    估算处理一个PDF需要的内存（字节）
+
+    普通模式读取时复制整个文件，解析后的对象和写入器中的副本各占约一份，按文件大小的3倍估算；
+    大文件模式通过mmap读取并逐页写出，内存只与单页对象和页面树的大小有关。
+    """
+    if large:
+        return LARGE_MODE_BASE_MEMORY + page_count * LARGE_MODE_PAGE_MEMORY
+    return file_size * 3
+
+class StreamingPdfWriter(PdfWriter):
+    """
+    逐页写出的PDF写入器
+
+    每加入一页后调用flush，将该页新增的对象写入输出文件并从内存中释放，只保留占位对象
+    用于后续页面引用共享资源（字体、图片等）。页面树、文档信息和目录在finish时最后写出，
+    内存占用与单页大小有关，而不是与整个输出文档有关。
+    """
+
+    def __init__(self, stream, pdf_header):
+        super().__init__()
+        self._stream = stream
+        self._positions = {}
+        # 目录、页面树和文档信息在最后写出
+        self._deferred = {self._root.idnum, self._pages.idnum, self._info.idnum}
+        self._next_flush = 0
+        # 所有页面来自同一个读取器，输出版本号直接使用输入文件的版本号
+        self.pdf_header = pdf_header.encode() if isinstance(pdf_header, str) else pdf_header
+        stream.write(self.pdf_header + b"\n")
+        stream.write(b"%\xE2\xE3\xCF\xD3\n")
+
+    def _write_object(self, idnum, obj):
+        self._positions[idnum] = self._stream.tell()
+        self._stream.write(f"{idnum} 0 obj\n".encode())
+        obj.write_to_stream(self._stream, None)
+        self._stream.write(b"\nendobj\n")
+
+    def flush(self):
+        """写出上次flush之后新增的对象，并用占位对象替换"""
+        for index in range(self._next_flush, len(self._objects)):
+            idnum = index + 1
+            obj = self._objects[index]
+            if idnum in self._deferred or obj is None:
+                continue
+            self._write_object(idnum, obj)
+            # 占位对象只保留引用信息：非空字典，克隆时不会被重新填充
+            placeholder = DictionaryObject({NameObject('/Flushed'): BooleanObject(True)})
+            placeholder.indirect_reference = obj.indirect_reference
+            self._objects[index] = placeholder
+        self._next_flush = len(self._objects)
+
+    def finish(self):
+        """写出剩余对象、交叉引用表和文件尾"""
+        self.flush()
+        for idnum in sorted(self._deferred):
+            self._write_object(idnum, self._objects[idnum - 1])
+
+        xref_location = self._stream.tell()
+        self._stream.write(f"xref\n0 {len(self._objects) + 1}\n".encode())
+        self._stream.write(b"0000000000 65535 f \n")
+        for idnum in range(1, len(self._objects) + 1):
+            self._stream.write(f"{self._positions.get(idnum, 0):010} 00000 n \n".encode())
+
+        self._stream.write(b"trailer\n")
+        trailer = DictionaryObject({
+            NameObject('/Size'): NumberObject(len(self._objects) + 1),
+            NameObject('/Root'): self._root,
+            NameObject('/Info'): self._info
+        })
+        trailer.write_to_stream(self._stream, None)
+        self._stream.write(f"\nstartxref\n{xref_location}\n%%EOF\n".encode())
+
+def _blank_page_size(pdf_reader, pages, index):
+    """空白页未指定尺寸时，使用前一个（没有时后一个）原文档页面的尺寸"""
+    neighbours = [page for page in reversed(pages[:index]) if page.source is not None]
+    neighbours += [page for page in pages[index + 1:] if page.source is not None]
+    if neighbours:
+        mediabox = pdf_reader.pages[neighbours[0].source - 1].mediabox
+    elif len(pdf_reader.pages):
+        mediabox = pdf_reader.pages[0].mediabox
+    else:
+        return DEFAULT_PAGE_SIZE
+    return float(mediabox.width), float(mediabox.height)
+
+def apply_edit_plan(input_path, plan, total_pages=None, output_path=None, large=False, memory_limit=None,
+                    output_mode='rewrite', timings=None):
+    """
+    执行编辑计划：读取一次PDF，写入一次结果
+
+    输入文件通过mmap交给PdfReader解析，不把整个文件读入内存。
+
+    Args:
+        input_path (str): 输入PDF文件的路径
+        plan (EditPlan): 编辑计划
+        total_pages (int, optional): 上传时记录的总页数。提供时在解析PDF之前
+            先编译计划，无效请求无需读取文件即可失败
+        output_path (str, optional): 输出文件路径，默认由generate_output_path生成
+        large (bool): 是否使用大文件模式：逐页写出，不在内存中保存整个输出文档
+        memory_limit (int, optional): 大文件模式下进程匿名内存的上限（字节），超过时中止处理
+        output_mode (str): 输出方式，rewrite重新写出整个文件；incremental复制原文件并追加
+            增量更新；auto在保留的原页面比例达到INCREMENTAL_MIN_KEPT_RATIO时使用增量更新
+        timings (dict, optional): 提供时记录各阶段的耗时（秒）：parse解析文档和页面树，
+            copy将页面加入写入器，write写出文件（增量更新时页面字典的生成也计入write）
+
+    Returns:
+        tuple: (输出文件路径, 原文档总页数, 编译后的PlanPage列表)
+
+    Raises:
+        FileNotFoundError: 当输入文件不存在时
+        ValueError: 当编辑计划或输出方式无效时
+        MemoryBudgetError: 当内存超过memory_limit时
         Exception: 其他PDF处理错误
     """
     # 检查输入文件是否存在
     if not os.path.exists(input_path):
         raise FileNotFoundError(f"找不到输入文件：{input_path}")
-    
+
+    if output_mode not in OUTPUT_MODES:
+        raise ValueError(f"无效的输出方式: {output_mode}，支持: {', '.join(OUTPUT_MODES)}")
+
+    # 已知总页数时，先编译计划再解析PDF
+    if total_pages is not None:
+        plan.compile(total_pages)
+
     try:
         # 生成输出文件路径
-        output_path = generate_output_path(input_path)
-        
+        if output_path is None:
+            output_path = generate_output_path(input_path)
+
         # 确保输出目录存在
         output_dir = os.path.dirname(output_path)
         os.makedirs(output_dir, exist_ok=True)
-        
-        # 创建PDF读取器对象
-        pdf_reader = PdfReader(input_path)
-        # 创建PDF写入器对象
-        pdf_writer = PdfWriter()
-        
-        # 获取总页数
-        total_pages = len(pdf_reader.pages)
-        
-        # 检查要删除的页面是否有效
-        for page_num in pages_to_delete:
-            if page_num < 1 or page_num > total_pages:
-                raise ValueError(f"页面号 {page_num} 无效。PDF总共有 {total_pages} 页")
-        
-        # 将不需要删除的页面添加到写入器
-        pages_kept = 0
-        for i in range(total_pages):
-            if (i + 1) not in pages_to_delete:
-                page = pdf_reader.pages[i]
-                pdf_writer.add_page(page)
-                pages_kept += 1
-        
-        # 写入新的PDF文件
-        with open(output_path, 'wb') as output_file:
-            pdf_writer.write(output_file)
-        
-        return output_path, total_pages, pages_kept
-    
+
+        with open(input_path, 'rb') as input_file, \
+                mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            with _stage(timings, 'parse'):
+                pdf_reader = PdfReader(mapped)
+                total_pages = len(pdf_reader.pages)
+            pages = plan.compile(total_pages)
+
+            if output_mode == 'auto':
+                output_mode = 'incremental' if _prefer_incremental(pages, total_pages) else 'rewrite'
+            # 无法定位原文件的交叉引用，或文件已加密（追加的对象也需要加密）时，改为重新写出
+            xref = _last_xref(mapped) if output_mode == 'incremental' else None
+            if xref is None or pdf_reader.is_encrypted:
+                output_mode = 'rewrite'
+
+            if output_mode == 'incremental':
+                with _stage(timings, 'write'):
+                    _write_incremental(input_path, pdf_reader, pages, output_path, xref)
+            elif large:
+                _write_streaming(pdf_reader, pages, output_path, memory_limit, timings)
+            else:
+                pdf_writer = PdfWriter()
+                with _stage(timings, 'copy'):
+                    for index in range(len(pages)):
+                        _add_plan_page(pdf_writer, pdf_reader, pages, index)
+                with _stage(timings, 'write'), open(output_path, 'wb') as output_file:
+                    pdf_writer.write(output_file)
+
+        logger.info(f"输出方式: {output_mode}")
+        return output_path, total_pages, pages
+
     except Exception as e:
         # 记录错误信息
-        print(f"处理PDF时出错: {str(e)}")
+        logger.error(f"处理PDF时出错: {str(e)}")
         # 重新抛出异常
         raise
 
+@contextlib.contextmanager
+def _stage(timings, name):
+    """将with块的耗时累加到timings[name]，timings为None时不记录"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            timings[name] = timings.get(name, 0) + time.perf_counter() - start
+
+def _add_plan_page(pdf_writer, pdf_reader, pages, index):
+    """将编辑计划中的一页加入写入器"""
+    page = pages[index]
+    if page.source is None:
+        width, height = page.size or _blank_page_size(pdf_reader, pages, index)
+        pdf_writer.add_blank_page(width, height)
+        return
+    # 同一页多次加入时，写入器为每个副本创建新的页面字典，页面内容共享
+    added = pdf_writer.add_page(pdf_reader.pages[page.source - 1])
+    if page.rotation:
+        added.rotate(page.rotation)
+
+def _write_streaming(pdf_reader, pages, output_path, memory_limit, timings=None):
+    """
+    大文件模式：逐页写出结果
+
+    每页写出后清空读取器的对象缓存，已写出的共享资源通过写入器的对象编号引用，
+    不会重复解析和写出。
+    """
+    with open(output_path, 'wb') as output_file:
+        pdf_writer = StreamingPdfWriter(output_file, pdf_reader.pdf_header)
+        for index in range(len(pages)):
+            with _stage(timings, 'copy'):
+                _add_plan_page(pdf_writer, pdf_reader, pages, index)
+            with _stage(timings, 'write'):
+                pdf_writer.flush()
+            pdf_reader.resolved_objects.clear()
+
+            if memory_limit is not None and index % MEMORY_CHECK_INTERVAL == 0:
+                rss = current_rss()
+                if rss is not None and rss > memory_limit:
+                    raise MemoryBudgetError(
+                        f"处理第 {index + 1} 页时内存超过预算（{rss // (1024 * 1024)}MB），已中止")
+        with _stage(timings, 'write'):
+            pdf_writer.finish()
+
+def _prefer_incremental(pages, total_pages):
+    """保留的原页面比例足够高时，追加增量更新比重新写出所有对象快得多"""
+    if not total_pages:
+        return False
+    kept = len({page.source for page in pages if page.source is not None})
+    return kept / total_pages >= INCREMENTAL_MIN_KEPT_RATIO
+
+def _last_xref(data):
+    """
+    定位文件最后一个交叉引用节
+
+    Returns:
+        tuple: (偏移量, 'table'或'stream')；无法定位时返回None
+    """
+    tail = data[max(0, len(data) - 1024):]
+    position = tail.rfind(b'startxref')
+    if position < 0:
+        return None
+    try:
+        offset = int(tail[position + len(b'startxref'):].split()[0])
+    except (ValueError, IndexError):
+        return None
+    if not 0 < offset < len(data):
+        return None
+    head = data[offset:offset + 1024]
+    if head.startswith(b'xref'):
+        return offset, 'table'
+    if re.match(rb'\d+\s+\d+\s+obj', head) and b'/XRef' in head:
+        return offset, 'stream'
+    return None
+
+def _write_incremental(input_path, pdf_reader, pages, output_path, xref):
+    """
+    以增量更新的方式写出结果
+
+    原文件的字节原样复制，之后追加重新写出的页面字典（继承的属性已展开，/Parent指向新的
+    页面树）、新的页面树根节点、替换了 /Pages 的文档目录，以及与原文件类型相同的交叉引用节，
+    /Prev 指向原文件的交叉引用。被删除的页面仍保留在文件中，只是不再被页面树引用。
+    """
+    trailer = pdf_reader.trailer
+    root_ref = trailer.raw_get('/Root')
+    # 读取交叉引用流时PyPDF2不保留 /Size，从已知的对象编号推算
+    known = [number for entries in pdf_reader.xref.values() for number in entries]
+    known.extend(pdf_reader.xref_objStm)
+    next_number = max([int(trailer.get('/Size', 0))] + [number + 1 for number in known])
+
+    def allocate():
+        nonlocal next_number
+        next_number += 1
+        return next_number - 1
+
+    pages_ref = IndirectObject(allocate(), 0, None)
+    objects = []
+    kids = ArrayObject()
+    reused = set()
+
+    for index, page in enumerate(pages):
+        if page.source is None:
+            width, height = page.size or _blank_page_size(pdf_reader, pages, index)
+            page_dict = DictionaryObject({
+                NameObject('/Type'): NameObject('/Page'),
+                NameObject('/MediaBox'): ArrayObject([NumberObject(0), NumberObject(0),
+                                                      FloatObject(width), FloatObject(height)]),
+                NameObject('/Resources'): DictionaryObject()
+            })
+            ref = IndirectObject(allocate(), 0, None)
+        else:
+            source = pdf_reader.pages[page.source - 1]
+            # PdfReader已将继承自上级页面树节点的属性复制到页面字典中
+            page_dict = DictionaryObject(source)
+            ref = source.indirect_reference
+            if ref is None or ref.idnum in reused:
+                # 同一页的副本使用新的对象编号
+                ref = IndirectObject(allocate(), 0, None)
+            else:
+                reused.add(ref.idnum)
+            if page.rotation:
+                rotation = (int(source.get('/Rotate', 0)) + page.rotation) % 360
+                page_dict[NameObject('/Rotate')] = NumberObject(rotation)
+        page_dict[NameObject('/Parent')] = pages_ref
+        objects.append((ref, page_dict))
+        kids.append(ref)
+
+    objects.append((pages_ref, DictionaryObject({
+        NameObject('/Type'): NameObject('/Pages'),
+        NameObject('/Kids'): kids,
+        NameObject('/Count'): NumberObject(len(kids))
+    })))
+    catalog = DictionaryObject(trailer['/Root'])
+    catalog[NameObject('/Pages')] = pages_ref
+    objects.append((root_ref, catalog))
+
+    xref_offset, xref_type = xref
+    new_trailer = DictionaryObject({NameObject('/Root'): root_ref})
+    for key in ('/Info', '/ID'):
+        if key in trailer:
+            new_trailer[NameObject(key)] = trailer.raw_get(key)
+    new_trailer[NameObject('/Prev')] = NumberObject(xref_offset)
+
+    # 原文件整体复制，Linux上由内核完成，不经过Python
+    shutil.copyfile(input_path, output_path)
+    with open(output_path, 'ab') as output_file:
+        output_file.write(b"\n")
+        positions = {}
+        for ref, obj in objects:
+            positions[ref.idnum] = (output_file.tell(), ref.generation)
+            output_file.write(f"{ref.idnum} {ref.generation} obj\n".encode())
+            obj.write_to_stream(output_file, None)
+            output_file.write(b"\nendobj\n")
+
+        # 原文件使用交叉引用流时，增量更新也必须使用交叉引用流
+        if xref_type == 'stream':
+            _write_xref_stream(output_file, positions, allocate(), next_number, new_trailer)
+        else:
+            _write_xref_table(output_file, positions, next_number, new_trailer)
+
+def _xref_sections(numbers):
+    """将对象编号分成连续的子节：[(起始编号, [编号, ...]), ...]"""
+    sections = []
+    for number in sorted(numbers):
+        if sections and number == sections[-1][0] + len(sections[-1][1]):
+            sections[-1][1].append(number)
+        else:
+            sections.append((number, [number]))
+    return sections
+
+def _write_xref_table(output_file, positions, size, trailer):
+    """
+    追加xref表和文件尾
+
+    第一个子节从对象0（空闲链表头）开始：PyPDF2等读取器把第一个子节的起始编号当作
+    整个表的编号偏移，不从0开始时会警告并错误地校正对象编号。
+    """
+    xref_location = output_file.tell()
+    output_file.write(b"xref\n")
+    for start, numbers in _xref_sections([0, *positions]):
+        output_file.write(f"{start} {len(numbers)}\n".encode())
+        for number in numbers:
+            if number == 0:
+                output_file.write(b"0000000000 65535 f \n")
+                continue
+            offset, generation = positions[number]
+            output_file.write(f"{offset:010} {generation:05} n \n".encode())
+    trailer[NameObject('/Size')] = NumberObject(size)
+    output_file.write(b"trailer\n")
+    trailer.write_to_stream(output_file, None)
+    output_file.write(f"\nstartxref\n{xref_location}\n%%EOF\n".encode())
+
+def _write_xref_stream(output_file, positions, number, size, trailer):
+    """追加交叉引用流（同时承担文件尾字典的作用），与xref表一样从对象0开始"""
+    xref_location = output_file.tell()
+    positions = dict(positions)
+    positions[number] = (xref_location, 0)
+
+    index = ArrayObject()
+    rows = bytearray()
+    for start, numbers in _xref_sections([0, *positions]):
+        index.extend([NumberObject(start), NumberObject(len(numbers))])
+        for item in numbers:
+            if item == 0:
+                rows += struct.pack('>BIH', 0, 0, 65535)
+                continue
+            offset, generation = positions[item]
+            rows += struct.pack('>BIH', 1, offset, generation)
+    data = zlib.compress(bytes(rows))
+
+    stream_dict = DictionaryObject(trailer)
+    stream_dict.update({
+        NameObject('/Type'): NameObject('/XRef'),
+        NameObject('/Size'): NumberObject(size),
+        NameObject('/Index'): index,
+        NameObject('/W'): ArrayObject([NumberObject(1), NumberObject(4), NumberObject(2)]),
+        NameObject('/Filter'): NameObject('/FlateDecode'),
+        NameObject('/Length'): NumberObject(len(data))
+    })
+    output_file.write(f"{number} 0 obj\n".encode())
+    stream_dict.write_to_stream(output_file, None)
+    output_file.write(b"\nstream\n" + data + b"\nendstream\nendobj\n")
+    output_file.write(f"startxref\n{xref_location}\n%%EOF\n".encode())
+
+def parse_split_spec(ranges=None, every=None, total_pages=None):
+    """
+    解析拆分请求，每个页面范围生成一个文件
+
+    Args:
+        ranges (str|list, optional): 逗号分隔的页面范围，每一项生成一个文件，例如 "1-3,4-10,11-"；
+            也可以是范围字符串或页面号组成的列表。范围之间可以重叠，不会被合并
+        every (int, optional): 每N页生成一个文件，与ranges二选一
+        total_pages (int): 文档总页数
+
+    Returns:
+        list: (起始页, 结束页) 闭区间列表，按请求顺序排列
+
+    Raises:
+        ValueError: 当拆分请求无效时
+    """
+    if (ranges is None) == (every is None):
+        raise ValueError("拆分时必须且只能指定 ranges 或 every 之一")
+
+    if every is not None:
+        every = _positive_int(every, 'every')
+        # 先计算文件数再生成列表，every=1的大文件不会先生成超长的列表
+        if -(-total_pages // every) > SPLIT_MAX_PARTS:
+            raise ValueError(f"拆分出的文件过多，最多 {SPLIT_MAX_PARTS} 个")
+        return [(start, min(start + every - 1, total_pages))
+                for start in range(1, total_pages + 1, every)]
+
+    items = ranges.split(',') if isinstance(ranges, str) else ranges
+    if not isinstance(items, list):
+        raise ValueError(f"无效的拆分范围: {ranges}")
+    parts = []
+    for item in items:
+        if isinstance(item, str) and not item.strip():
+            continue
+        # 逐项解析，"odd"、"even"这类非连续的选择不能作为一个范围
+        page_set = parse_page_spec(item if isinstance(item, str) else [item], total_pages)
+        if len(page_set.ranges) != 1:
+            raise ValueError(f"无效的拆分范围: {item}，每一项必须是单个页面或连续范围")
+        parts.append(page_set.ranges[0])
+        if len(parts) > SPLIT_MAX_PARTS:
+            raise ValueError(f"拆分出的文件过多，最多 {SPLIT_MAX_PARTS} 个")
+    if not parts:
+        raise ValueError("拆分范围不能为空")
+    return parts
+
+# 当前进程中解析的PdfReader；进程池中的每个进程在初始化时各自打开并解析输入文件
+_split_reader = None
+
+def _open_split_reader(input_path):
+    """进程池的初始化函数：打开并解析输入文件，文件在进程退出时关闭"""
+    global _split_reader
+    input_file = open(input_path, 'rb')
+    _split_reader = PdfReader(mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ))
+
+def _split_context():
+    """
+    拆分进程池使用的启动方式
+
+    不使用fork：Celery worker子进程中运行着日志队列和指标线程，fork出的进程会复制这些状态，
+    forkserver从一个干净的服务进程创建子进程，不支持时使用spawn。
+    """
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+def _render_split_group(group):
+    """生成一组连续的拆分文件，返回 [(序号, PDF字节), ...]"""
+    results = []
+    for index, (start, end) in group:
+        pdf_writer = PdfWriter()
+        for page_num in range(start, end + 1):
+            pdf_writer.add_page(_split_reader.pages[page_num - 1])
+        buffer = io.BytesIO()
+        pdf_writer.write(buffer)
+        results.append((index, buffer.getvalue()))
+    return results
+
+def split_pdf(input_path, output_path, ranges=None, every=None, base_name='part', workers=1):
+    """
+    将PDF按页面范围拆分为多个文件，打包写入一个ZIP
+
+    workers为1时在当前进程中依次生成；大于1时拆分文件按连续的分组交给进程池并行生成，
+    池中的每个进程各自解析一次输入文件（参见_split_context）。生成的文件按顺序直接写入
+    ZIP（存储模式，PDF本身已压缩），不在磁盘上单独保存。
+    当前进程是守护进程（无法创建子进程）或只有一个分组时，在当前进程中依次生成。
+
+    Args:
+        input_path (str): 输入PDF文件的路径
+        output_path (str): 输出ZIP文件的路径
+        ranges (str|list, optional): 页面范围，每一项生成一个文件，参见parse_split_spec
+        every (int, optional): 每N页生成一个文件，与ranges二选一
+        base_name (str): ZIP中文件名的前缀
+        workers (int): 进程数，进程池在拆分完成后退出
+
+    Returns:
+        int: 生成的文件数
+
+    Raises:
+        FileNotFoundError: 当输入文件不存在时
+        ValueError: 当拆分请求无效时
+    """
+    global _split_reader
+
+    if not os.path.exists(input_path):
+        raise FileNotFoundError(f"找不到输入文件：{input_path}")
+
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+
+    with open(input_path, 'rb') as input_file, \
+            mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        _split_reader = PdfReader(mapped)
+        try:
+            parts = parse_split_spec(ranges, every, len(_split_reader.pages))
+            width = len(str(len(parts)))
+            names = [f"{base_name}_{index + 1:0{width}d}_p{start}-{end}.pdf"
+                     for index, (start, end) in enumerate(parts)]
+
+            workers = max(1, workers or 1)
+            # 分组数多于进程数，页数不均匀时各进程的负载更平衡；每组的结果在内存中暂存，组不宜过大
+            group_size = max(1, -(-len(parts) // (workers * SPLIT_GROUPS_PER_WORKER)))
+            indexed = list(enumerate(parts))
+            groups = [indexed[i:i + group_size] for i in range(0, len(indexed), group_size)]
+            parallel = workers > 1 and len(groups) > 1 and not multiprocessing.current_process().daemon
+
+            with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_STORED, allowZip64=True) as archive:
+                if parallel:
+                    with _split_context().Pool(min(workers, len(groups)), initializer=_open_split_reader,
+                                               initargs=(input_path,)) as pool:
+                        for results in pool.imap(_render_split_group, groups):
+                            for index, data in results:
+                                archive.writestr(names[index], data)
+                else:
+                    for group in groups:
+                        for index, data in _render_split_group(group):
+                            archive.writestr(names[index], data)
+        finally:
+            _split_reader = None
+
+    logger.info(f"拆分完成: {len(parts)} 个文件{'（并行）' if parallel else ''}")
+    return len(parts)
+
+def _resolve(value):
+    """解析间接引用，其他值原样返回"""
+    return value.get_object() if isinstance(value, IndirectObject) else value
+
+def _object_digest(obj, digests, visiting):
+    """
+    计算PDF对象内容的摘要，间接引用按其指向的内容计算，与对象编号无关
+
+    Args:
+        obj: PDF对象
+        digests (dict): 当前文档中已计算的 {对象编号: 摘要}
+        visiting (set): 正在计算的对象编号，用于检测循环引用
+    """
+    if isinstance(obj, IndirectObject):
+        if obj.idnum in digests:
+            return digests[obj.idnum]
+        if obj.idnum in visiting:
+            # 循环引用按对象编号区分，这类对象不参与跨文档去重
+            return f"cycle:{id(obj.pdf)}:{obj.idnum}".encode()
+        visiting.add(obj.idnum)
+        digest = _object_digest(obj.get_object(), digests, visiting)
+        visiting.discard(obj.idnum)
+        digests[obj.idnum] = digest
+        return digest
+
+    hasher = hashlib.sha256(type(obj).__name__.encode())
+    if isinstance(obj, DictionaryObject):
+        for key in sorted(obj):
+            hasher.update(key.encode())
+            hasher.update(_object_digest(obj.raw_get(key), digests, visiting))
+        if isinstance(obj, StreamObject):
+            # 比较编码后的原始数据，无需解压
+            hasher.update(obj._data)
+    elif isinstance(obj, ArrayObject):
+        for item in obj:
+            hasher.update(_object_digest(item, digests, visiting))
+    else:
+        hasher.update(repr(obj).encode())
+    return hasher.digest()
+
+class ResourceDeduplicator:
+    """
+    合并文档时对字体、图片等共享资源去重
+
+    添加页面之前，计算页面引用的资源对象的内容摘要；内容相同的资源已经写入时，
+    将写入器的对象编号映射（_id_translated）指向已写入的对象，PdfWriter复制页面时
+    直接引用该对象，不再重复写出。
+    """
+
+    def __init__(self, pdf_writer):
+        self.writer = pdf_writer
+        # {摘要: (读取器, 对象编号)}，第一次出现的资源
+        self._canonical = {}
+        # {id(读取器): {对象编号: 摘要}}
+        self._digests = {}
+        self.resources = 0
+        self.deduplicated = 0
+
+    def prepare_page(self, pdf_reader, page):
+        """在page加入写入器之前调用，重定向内容与已写入资源相同的资源对象"""
+        # 资源字典和其中的分类字典都可能是间接对象（例如多个页面共用一个资源字典），
+        # 需要先解析，dict.get返回的是IndirectObject
+        resources = _resolve(page.get('/Resources'))
+        if not isinstance(resources, DictionaryObject):
+            return
+        digests = self._digests.setdefault(id(pdf_reader), {})
+        translated = self.writer._id_translated.setdefault(id(pdf_reader), {})
+        for category in DEDUPLICATED_RESOURCES:
+            entries = _resolve(resources.get(category))
+            if not isinstance(entries, DictionaryObject):
+                continue
+            for name in entries:
+                ref = entries.raw_get(name)
+                if not isinstance(ref, IndirectObject) or ref.idnum in translated:
+                    continue
+                digest = _object_digest(ref, digests, set())
+                self.resources += 1
+                canonical = self._canonical.get(digest)
+                if canonical is None:
+                    self._canonical[digest] = (pdf_reader, ref.idnum)
+                    continue
+                canonical_reader, canonical_idnum = canonical
+                target = self.writer._id_translated.get(id(canonical_reader), {}).get(canonical_idnum)
+                if target is not None:
+                    translated[ref.idnum] = target
+                    self.deduplicated += 1
+
+def merge_pdfs(inputs, output_path, timings=None):
+    """
+    按顺序合并多个PDF，内容相同的字体、图片等资源只写入一次
+
+    Args:
+        inputs (list): [(输入PDF文件的路径, EditPlan或None), ...]，
+            提供编辑计划时先按计划选择、排列该文件的页面，None表示全部页面
+        output_path (str): 输出文件路径
+        timings (dict, optional): 提供时记录各阶段的耗时（秒），含义与apply_edit_plan相同
+
+    Returns:
+        dict: 合并结果，包含以下字段：
+            pages (int): 输出页数
+            resources (int): 检查过的资源对象数
+            deduplicated (int): 因内容重复未再次写入的资源对象数
+
+    Raises:
+        FileNotFoundError: 当输入文件不存在时
+        ValueError: 当编辑计划无效时
+    """
+    for input_path, _ in inputs:
+        if not os.path.exists(input_path):
+            raise FileNotFoundError(f"找不到输入文件：{input_path}")
+
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    pdf_writer = PdfWriter()
+    deduplicator = ResourceDeduplicator(pdf_writer)
+
+    # 写入器按id(读取器)记录对象编号映射，所有读取器在写出之前都必须保持存活
+    readers = []
+    with contextlib.ExitStack() as stack:
+        for input_path, plan in inputs:
+            input_file = stack.enter_context(open(input_path, 'rb'))
+            mapped = stack.enter_context(mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ))
+            with _stage(timings, 'parse'):
+                pdf_reader = PdfReader(mapped)
+                total_pages = len(pdf_reader.pages)
+            readers.append(pdf_reader)
+            pages = plan.compile(total_pages) if plan is not None else \
+                [PlanPage(page_num, 0, None) for page_num in range(1, total_pages + 1)]
+
+            with _stage(timings, 'copy'):
+                for index, page in enumerate(pages):
+                    if page.source is not None:
+                        deduplicator.prepare_page(pdf_reader, pdf_reader.pages[page.source - 1])
+                    _add_plan_page(pdf_writer, pdf_reader, pages, index)
+
+        with _stage(timings, 'write'), open(output_path, 'wb') as output_file:
+            pdf_writer.write(output_file)
+
+    logger.info(f"合并完成: {len(pdf_writer.pages)} 页，资源 {deduplicator.resources} 个，"
+          f"去重 {deduplicator.deduplicated} 个")
+    return {
+        'pages': len(pdf_writer.pages),
+        'resources': deduplicator.resources,
+        'deduplicated': deduplicator.deduplicated
+    }
+
+def delete_pdf_pages(input_path, pages_to_delete, total_pages=None, output_path=None):
+    """
+    从PDF文件中删除指定页面
+    
+    Args:
+        input_path (str): 输入PDF文件的路径
+        pages_to_delete (str|list|PageSet): 要删除的页面（从1开始），
+            可以是页面号列表或页面范围表达式，参见parse_page_spec
+        total_pages (int, optional): 上传时记录的总页数。提供时在解析PDF之前
+            先校验页面号，无效请求无需读取文件即可失败
+        output_path (str, optional): 输出文件路径，默认由generate_output_path生成
+    
+    Returns:
+        tuple: (输出文件路径, 原文档总页数, 保留页数)
+
+    Raises:
+        FileNotFoundError: 当输入文件不存在时
+        ValueError: 当页面号无效时
+        Exception: 其他PDF处理错误
+    """
+    # 页面列表先转换为紧凑的范围表达式
+    if not isinstance(pages_to_delete, str):
+        pages_to_delete = parse_page_spec(pages_to_delete, total_pages)
+    output_path, total_pages, pages = apply_edit_plan(input_path, EditPlan.from_delete(pages_to_delete),
+                                                      total_pages, output_path)
+    return output_path, total_pages, len(pages)
+
 def main():
     """主函数：处理命令行参数并执行PDF页面删除"""
     # 创建命令行参数解析器
@@ -117,32 +1268,71 @@ def main():
         formatter_class=argparse.RawDescriptionHelpFormatter  # 保留换行格式
     )
     parser.add_argument('input_pdf', nargs='?', help='输入PDF文件的路径')
-    parser.add_argument('pages', type=int, nargs='*', help='要删除的页面号（从1开始）')
+    parser.add_argument('pages', nargs='*',
+                        help='要删除的页面（从1开始），支持 3、5-7、900-、odd、even')
+    parser.add_argument('--plan',
+                        help='编辑计划：JSON操作列表，或包含该列表的JSON文件路径')
+    parser.add_argument('--output-mode', choices=OUTPUT_MODES, default='rewrite',
+                        help='输出方式：rewrite重新写出（默认）；incremental在原文件后追加增量更新，'
+                             '被删除页面的内容仍留在文件中；auto按保留页面的比例选择')
+    parser.add_argument('--split',
+                        help='拆分为多个文件并打包为ZIP：逗号分隔的页面范围，每一项生成一个文件')
+    parser.add_argument('--every', type=int,
+                        help='拆分为多个文件并打包为ZIP：每N页生成一个文件')
     
     # 添加使用示例
     parser.epilog = '''
     使用示例:
-    python pdfedits.py input.pdf 1 2 3   # 删除 input.pdf 的第1、2、3页
-    python pdfedits.py                    # 显示此帮助信息
+    python pdfedits.py input.pdf 1 2 3        # 删除 input.pdf 的第1、2、3页
+    python pdfedits.py input.pdf 1-500,702    # 删除第1到500页和第702页
+    python pdfedits.py input.pdf 900- even    # 删除第900页及之后的页面和所有偶数页
+    python pdfedits.py input.pdf --plan '[{"op": "delete", "pages": "1"}, {"op": "rotate", "pages": "odd", "angle": 90}]'
+    python pdfedits.py input.pdf 5 --output-mode incremental  # 追加增量更新，不重写原文件内容
+    python pdfedits.py input.pdf --split 1-3,4-10,11-        # 拆分为3个文件，打包为 input_split.zip
+    python pdfedits.py input.pdf --every 2                   # 每2页拆分为一个文件
+    python pdfedits.py                         # 显示此帮助信息
     '''
     
     # 解析命令行参数
     args = parser.parse_args()
     
     # 如果没有提供输入文件或页码，显示帮助信息
-    if args.input_pdf is None or not args.pages:
+    if args.input_pdf is None or not (args.pages or args.plan or args.split or args.every):
         parser.print_help()
         sys.exit(0)
     
     try:
-        # 执行PDF页面删除
-        output_path, total_pages, pages_kept = delete_pdf_pages(args.input_pdf, args.pages)
+        if args.split or args.every:
+            # 拆分为多个文件，写入与输入文件同名的ZIP
+            base_path = os.path.splitext(args.input_pdf)[0]
+            output_path = f"{base_path}_split.zip"
+            parts = split_pdf(args.input_pdf, output_path, ranges=args.split, every=args.every,
+                              base_name=os.path.basename(base_path), workers=os.cpu_count() or 1)
+            print(f"\n拆分完成！共 {parts} 个文件，已保存为：{output_path}")
+            return
+        
+        if args.plan:
+            # 编辑计划可以直接写在命令行中，也可以保存在文件中
+            if os.path.exists(args.plan):
+                with open(args.plan, 'r', encoding='utf-8') as plan_file:
+                    operations = json.load(plan_file)
+            else:
+                operations = json.loads(args.plan)
+            plan = EditPlan(operations)
+            if args.pages:
+                plan.operations.insert(0, {'op': 'delete', 'pages': ','.join(args.pages)})
+        else:
+            plan = EditPlan.from_delete(','.join(args.pages))
+        
+        # 执行编辑计划，一次读取一次写入
+        output_path, total_pages, pages = apply_edit_plan(args.input_pdf, plan, output_mode=args.output_mode)
+        summary = plan_summary(pages, total_pages)
         
         # 打印处理结果
         print(f"\n处理完成！")
         print(f"原PDF总页数：{total_pages}")
-        print(f"删除页数：{len(args.pages)}")
-        print(f"保留页数：{pages_kept}")
+        print(f"删除页数：{summary['pages_deleted']}")
+        print(f"输出页数：{summary['pages_kept']}")
         print(f"新文件已保存为：{output_path}")
         
     except FileNotFoundError as e:
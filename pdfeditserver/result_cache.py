@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+PDF处理结果缓存
+
+缓存键由输入文件的内容摘要和编译后编辑计划的规范形式组成，相同文件上的相同编辑
+直接复用已有的输出文件，不再进入任务队列重新读写PDF。
+缓存文件以 cache/<缓存键>.pdf 保存在文件存储中，总大小超过上限时按最近最少使用的顺序淘汰；
+命中和未命中次数记录在Redis中。
+"""
+
+import os
+import json
+import time
+import hashlib
+
+from .celery_app import redis_client, PDF_OUTPUT_MODE
+from .connections import queue_script
+from .pdfedits import canonical_plan
+from .storage import storage
+
+# 结果缓存占用存储空间的上限（字节）
+RESULT_CACHE_MAX_BYTES = int(os.environ.get('RESULT_CACHE_MAX_BYTES', 1024 * 1024 * 1024))
+
+class ResultCache:
+    """以(内容摘要, 规范化操作)为键、按LRU淘汰的结果缓存"""
+
+    # 查找缓存项，同时更新LRU时间和命中统计，一次往返完成
+    LOOKUP_SCRIPT = """
+    local meta = redis.call('GET', KEYS[1])
+    if not meta then
+        redis.call('HINCRBY', KEYS[3], 'misses', 1)
+        return false
+    end
+    redis.call('ZADD', KEYS[2], 'XX', ARGV[1], ARGV[2])
+    redis.call('HINCRBY', KEYS[3], 'hits', 1)
+    return meta
+    """
+
+    # 登记缓存项并更新LRU时间，新加入的缓存项计入总大小，返回新的总大小；已存在时返回nil
+    STORE_SCRIPT = """
+    redis.call('ZADD', KEYS[2], ARGV[2], ARGV[3])
+    if not redis.call('SET', KEYS[1], ARGV[1], 'NX') then
+        return false
+    end
+    return redis.call('INCRBY', KEYS[3], ARGV[4])
+    """
+
+    def __init__(self, redis_client, storage, max_bytes, prefix='pdf_result:', directory='cache/'):
+        self.redis = redis_client
+        self.storage = storage
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.prefix = prefix
+        self.lru_key = f"{prefix.rstrip(':')}_lru"
+        self.bytes_key = f"{prefix.rstrip(':')}_bytes"
+        self.stats_key = f"{prefix.rstrip(':')}_stats"
+        self._lookup_script = self.redis.register_script(self.LOOKUP_SCRIPT)
+        self._store_script = self.redis.register_script(self.STORE_SCRIPT)
+
+    @staticmethod
+    def make_key(digest, operation):
+        """
+        生成缓存键
+
+        Args:
+            digest (str): 输入文件的内容摘要
+            operation: 规范化后的编辑操作，可JSON序列化
+
+        Returns:
+            str: 缓存键
+        """
+        canonical = json.dumps(operation, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(f"{digest}:{canonical}".encode('utf-8')).hexdigest()
+
+    def storage_key(self, key):
+        """缓存项对应的存储键"""
+        return f"{self.directory}{key}.pdf"
+
+    def fetch(self, key, dest_key):
+        """
+        查找缓存并将缓存的输出文件复制到dest_key（本地存储为硬链接，对象存储为服务端复制）
+
+        Returns:
+            dict: 命中时返回缓存的处理结果信息，未命中返回None
+        """
+        meta = self._lookup_script(keys=[self.prefix + key, self.lru_key, self.stats_key],
+                                   args=[time.time(), key])
+        if meta is None:
+            return None
+        try:
+            self.storage.copy(self.storage_key(key), dest_key)
+        except FileNotFoundError:
+            # 文件刚被其他进程淘汰
+            return None
+        return json.loads(meta)
+
+    def store(self, key, output_key, meta, batch=None):
+        """
+        将处理结果加入缓存，超过容量时淘汰最近最少使用的缓存项
+
+        Args:
+            key (str): 缓存键
+            output_key (str): 任务输出文件的存储键
+            meta (dict): 处理结果信息，命中时原样返回
+            batch (RedisBatch, optional): 提供时缓存项的登记加入batch并返回BatchResult，
+                淘汰在batch执行之后进行，淘汰出错时读取结果抛出异常
+        """
+        cache_key = self.storage_key(key)
+        if not self.storage.exists(cache_key):
+            self.storage.copy(output_key, cache_key)
+        size = self.storage.stat(cache_key).size
+
+        keys = [self.prefix + key, self.lru_key, self.bytes_key]
+        args = [json.dumps(dict(meta, size=size)), time.time(), key, size]
+        if batch is not None:
+            return batch.add(lambda pipe: queue_script(pipe, self._store_script, keys, args),
+                             lambda results: self._stored(results[-1]))
+        self._stored(self._store_script(keys=keys, args=args))
+
+    def _stored(self, total):
+        """新的缓存项使总大小超过上限时淘汰"""
+        if total is not None and total > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """淘汰最近最少使用的缓存项，直到总大小不超过上限"""
+        while int(self.redis.get(self.bytes_key) or 0) > self.max_bytes:
+            popped = self.redis.zpopmin(self.lru_key)
+            if not popped:
+                break
+            key = popped[0][0].decode('utf-8')
+            meta = self.redis.getdel(self.prefix + key)
+            if meta is not None:
+                self.redis.decrby(self.bytes_key, json.loads(meta)['size'])
+            self.storage.delete(self.storage_key(key))
+
+    def stats(self):
+        """返回命中、未命中次数以及缓存项数量和总大小"""
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hmget(self.stats_key, ['hits', 'misses'])
+        pipe.zcard(self.lru_key)
+        pipe.get(self.bytes_key)
+        (hits, misses), entries, total = pipe.execute()
+        return {
+            'hits': int(hits or 0),
+            'misses': int(misses or 0),
+            'entries': entries,
+            'bytes': int(total or 0)
+        }
+
+    def clear(self):
+        """清除所有缓存项和统计"""
+        keys = [self.prefix + key.decode('utf-8') for key in self.redis.zrange(self.lru_key, 0, -1)]
+        if keys:
+            self.redis.delete(*keys)
+        self.redis.delete(self.lru_key, self.bytes_key, self.stats_key)
+        self.storage.delete_prefix(self.directory)
+
+def plan_operation(plan_pages):
+    """
+    编辑计划的规范形式：编译后的输出页面序列
+
+    结果相同的不同计划（例如删除奇数页与保留偶数页）共享同一个缓存项。
+    输出方式也计入缓存键：增量更新的结果含有被删除页面的内容，改为重新写出后不能再复用。
+
+    Args:
+        plan_pages (list): EditPlan.compile返回的PlanPage列表
+    """
+    return {'pages': canonical_plan(plan_pages), 'output_mode': PDF_OUTPUT_MODE}
+
+# 创建全局结果缓存实例
+result_cache = ResultCache(redis_client, storage, RESULT_CACHE_MAX_BYTES)
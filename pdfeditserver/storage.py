@@ -0,0 +1,443 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+文件存储后端
+
+上传文件、处理结果和结果缓存都以存储键（相对路径，例如 <摘要>.pdf、<任务ID>_edit.pdf、
+cache/<缓存键>.pdf）保存，任务记录和任务消息中只保存存储键，不保存某台机器上的绝对路径。
+
+STORAGE_BACKEND=local时文件保存在UPLOAD_FOLDER中，Web和worker需要共享该目录；
+STORAGE_BACKEND=s3时文件保存在S3兼容的对象存储（AWS S3、MinIO等）中，Web和worker
+可以部署在不同的主机上。PyPDF2需要可随机访问的文件，worker处理时将对象下载到本地的
+读取缓存（STORAGE_CACHE_DIR），按最近最少使用的顺序淘汰；处理结果先写到缓存目录，
+再上传到对象存储，同一台机器上随后的读取直接使用缓存中的文件。
+"""
+
+import os
+import uuid
+import shutil
+import logging
+from collections import namedtuple
+from contextlib import contextmanager
+
+from .celery_app import UPLOAD_FOLDER
+
+try:
+    import boto3
+    from boto3.s3.transfer import TransferConfig
+    from botocore.exceptions import ClientError
+except ImportError:
+    boto3 = None
+
+logger = logging.getLogger(__name__)
+
+# 存储后端：local或s3
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'local')
+# S3兼容对象存储的桶、键前缀和服务地址（MinIO等需要设置S3_ENDPOINT_URL），
+# 访问密钥使用boto3的标准配置（AWS_ACCESS_KEY_ID、AWS_SECRET_ACCESS_KEY等环境变量）
+S3_BUCKET = os.environ.get('S3_BUCKET', 'pdfeditserver')
+S3_PREFIX = os.environ.get('S3_PREFIX', '')
+S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL') or None
+S3_REGION = os.environ.get('S3_REGION') or None
+# DOWNLOAD_MODE为redirect时预签名下载链接的有效期（秒）
+S3_PRESIGN_EXPIRES = int(os.environ.get('S3_PRESIGN_EXPIRES', 300))
+# 对象存储的本地读取缓存目录和占用上限（字节）
+STORAGE_CACHE_DIR = os.environ.get('STORAGE_CACHE_DIR', os.path.join(UPLOAD_FOLDER, 'storage_cache'))
+STORAGE_CACHE_MAX_BYTES = int(os.environ.get('STORAGE_CACHE_MAX_BYTES', 2 * 1024 * 1024 * 1024))
+
+# 流式读写时每次传输的字节数，超过该大小的对象分段上传和下载
+TRANSFER_CHUNK_SIZE = 8 * 1024 * 1024
+# reading中下载的文件在引用之前被淘汰时，重新下载的最多次数
+READ_ATTEMPTS = 3
+
+# 存储中文件的大小（字节）和修改时间（Unix时间戳）
+ObjectStat = namedtuple('ObjectStat', ['size', 'mtime'])
+
+class LocalStorage:
+    """
+    文件保存在本地目录中
+
+    存储键是相对于根目录的路径；内容寻址存储之前的任务记录中的绝对路径也可以作为键使用。
+    copy使用硬链接，多个键可能共享同一个文件，因此文件只通过替换（put_file、writing）写入，不原地修改。
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, key):
+        """存储键对应的文件路径"""
+        return os.path.join(self.root, key)
+
+    def filesystem_path(self, key):
+        """文件在本地文件系统中的路径，nginx和send_file可以直接发送"""
+        return self.path(key)
+
+    def local_path(self, key):
+        """
+        读取文件时使用的本地路径
+
+        Raises:
+            FileNotFoundError: 当文件不存在时
+        """
+        path = self.path(key)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"找不到文件: {key}")
+        return path
+
+    @contextmanager
+    def reading(self, key):
+        """
+        读取文件时使用的本地路径，with块中文件保持可用
+
+        文件只通过替换写入，正在读取的文件不会被改写。
+
+        Raises:
+            FileNotFoundError: 当文件不存在时
+        """
+        yield self.local_path(key)
+
+    def _prepare(self, key):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def temp_path(self):
+        """与存储位于同一文件系统的临时文件路径，写完后通过put_file放入存储"""
+        os.makedirs(self.root, exist_ok=True)
+        return os.path.join(self.root, f".{uuid.uuid4()}.part")
+
+    @contextmanager
+    def writing(self, key):
+        """
+        生成key的内容时使用的本地路径
+
+        先写入临时文件，成功后再替换到最终位置。已有的文件可能与结果缓存项是同一个硬链接，
+        直接覆盖会同时改写缓存项；替换只改变目录项，缓存项保持原来的内容。失败时不留下不完整的文件。
+        """
+        path = self.temp_path()
+        try:
+            yield path
+            self.put_file(key, path)
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def put_file(self, key, path):
+        """将本地文件放入存储，文件被移动到存储中"""
+        os.replace(path, self._prepare(key))
+
+    def open(self, key):
+        """以流的方式读取文件"""
+        return open(self.path(key), 'rb')
+
+    def exists(self, key):
+        return os.path.exists(self.path(key))
+
+    def stat(self, key):
+        """
+        Raises:
+            FileNotFoundError: 当文件不存在时
+        """
+        stat = os.stat(self.path(key))
+        return ObjectStat(stat.st_size, stat.st_mtime)
+
+    def copy(self, src_key, dest_key):
+        """复制文件，用硬链接共享文件内容，跨文件系统时退回复制"""
+        src = self.path(src_key)
+        dest = self._prepare(dest_key)
+        if os.path.exists(dest):
+            os.remove(dest)
+        try:
+            os.link(src, dest)
+        except OSError as e:
+            if isinstance(e, FileNotFoundError):
+                raise
+            shutil.copyfile(src, dest)
+
+    def delete(self, key):
+        """删除文件，文件不存在时忽略"""
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def delete_prefix(self, prefix):
+        """删除目录前缀（例如 cache/）下的所有文件"""
+        path = self.path(prefix)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+
+    def keys(self, suffix=''):
+        """根目录下（不含子目录）以suffix结尾的存储键"""
+        try:
+            entries = list(os.scandir(self.root))
+        except FileNotFoundError:
+            return []
+        return [entry.name for entry in entries
+                if entry.is_file(follow_symlinks=False) and entry.name.endswith(suffix)]
+
+    def download_url(self, key, filename):
+        """本地存储没有可以直接下载的外部地址"""
+        return None
+
+class S3Storage:
+    """
+    文件保存在S3兼容的对象存储中，读取时经过本地的读取缓存
+
+    缓存只用于内容不会改变的键（按摘要命名的上传文件、结果缓存项）和本机刚写入的文件，
+    其他机器重新生成的同名处理结果通过open流式读取，不会读到缓存中的旧版本。
+    """
+
+    def __init__(self, bucket, prefix='', endpoint_url=None, region=None, cache_dir=STORAGE_CACHE_DIR,
+                 cache_max_bytes=STORAGE_CACHE_MAX_BYTES):
+        if boto3 is None:
+            raise RuntimeError("STORAGE_BACKEND=s3 需要安装boto3")
+        self.bucket = bucket
+        self.prefix = prefix
+        self.cache_dir = cache_dir
+        self.cache_max_bytes = cache_max_bytes
+        self.client = boto3.client('s3', endpoint_url=endpoint_url, region_name=region)
+        self.transfer_config = TransferConfig(multipart_threshold=TRANSFER_CHUNK_SIZE,
+                                              multipart_chunksize=TRANSFER_CHUNK_SIZE)
+
+    def _object_key(self, key):
+        return f"{self.prefix}{key}"
+
+    def _cache_path(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    @staticmethod
+    def _not_found(error):
+        return error.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound')
+
+    def filesystem_path(self, key):
+        """对象存储中的文件没有本地路径"""
+        return None
+
+    def local_path(self, key):
+        """
+        读取文件时使用的本地路径，缓存中没有时下载（分段并行下载，不把整个文件读入内存）
+
+        返回的文件随时可能被其他线程或进程淘汰，读取文件内容时使用reading。
+
+        Raises:
+            FileNotFoundError: 当对象不存在时
+        """
+        path = self._cache_path(key)
+        try:
+            # 修改时间作为LRU的访问时间
+            os.utime(path)
+            return path
+        except FileNotFoundError:
+            pass
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.part"
+        try:
+            self.client.download_file(self.bucket, self._object_key(key), tmp_path, Config=self.transfer_config)
+            os.replace(tmp_path, path)
+        except ClientError as e:
+            if self._not_found(e):
+                raise FileNotFoundError(f"找不到文件: {key}")
+            raise
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        logger.debug("已下载到读取缓存: %s", key)
+        self._evict(keep=path)
+        return path
+
+    @contextmanager
+    def reading(self, key):
+        """
+        读取文件时使用的本地路径，with块中文件不会被读取缓存淘汰
+
+        为缓存文件创建一个硬链接作为引用：淘汰只删除缓存中的目录项，文件在with块结束、
+        硬链接删除后才释放。缓存文件在创建硬链接之前被淘汰时重新下载。
+
+        Raises:
+            FileNotFoundError: 当对象不存在时
+        """
+        link_path = f"{self._cache_path(key)}.{uuid.uuid4().hex}.part"
+        for attempt in range(READ_ATTEMPTS):
+            path = self.local_path(key)
+            try:
+                os.link(path, link_path)
+                break
+            except FileNotFoundError:
+                if attempt == READ_ATTEMPTS - 1:
+                    raise
+                logger.debug("读取缓存中的文件已被淘汰，重新下载: %s", key)
+        try:
+            yield link_path
+        finally:
+            try:
+                os.remove(link_path)
+            except FileNotFoundError:
+                pass
+
+    def temp_path(self):
+        """缓存目录中的临时文件路径，写完后通过put_file上传，并作为缓存保留"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        return os.path.join(self.cache_dir, f".{uuid.uuid4().hex}.part")
+
+    @contextmanager
+    def writing(self, key):
+        """生成key的内容时使用的本地路径，with块正常结束后上传"""
+        path = self.temp_path()
+        try:
+            yield path
+            self.put_file(key, path)
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def put_file(self, key, path):
+        """上传本地文件（分段上传），上传后文件移入读取缓存"""
+        self.client.upload_file(path, self.bucket, self._object_key(key), Config=self.transfer_config)
+        cache_path = self._cache_path(key)
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        try:
+            os.replace(path, cache_path)
+        except OSError:
+            # 与缓存目录不在同一个文件系统，文件留给调用方处理
+            return
+        self._evict(keep=cache_path)
+
+    def open(self, key):
+        """
+        以流的方式读取对象
+
+        Raises:
+            FileNotFoundError: 当对象不存在时
+        """
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=self._object_key(key))['Body']
+        except ClientError as e:
+            if self._not_found(e):
+                raise FileNotFoundError(f"找不到文件: {key}")
+            raise
+
+    def exists(self, key):
+        try:
+            self.stat(key)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def stat(self, key):
+        """
+        Raises:
+            FileNotFoundError: 当对象不存在时
+        """
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=self._object_key(key))
+        except ClientError as e:
+            if self._not_found(e):
+                raise FileNotFoundError(f"找不到文件: {key}")
+            raise
+        return ObjectStat(head['ContentLength'], head['LastModified'].timestamp())
+
+    def copy(self, src_key, dest_key):
+        """在对象存储中复制对象，数据不经过本机"""
+        try:
+            self.client.copy({'Bucket': self.bucket, 'Key': self._object_key(src_key)}, self.bucket,
+                             self._object_key(dest_key), Config=self.transfer_config)
+        except ClientError as e:
+            if self._not_found(e):
+                raise FileNotFoundError(f"找不到文件: {src_key}")
+            raise
+        # 目标键的缓存可能是旧内容
+        self._discard_cached(dest_key)
+
+    def delete(self, key):
+        """删除对象和本地缓存，对象不存在时忽略"""
+        self.client.delete_object(Bucket=self.bucket, Key=self._object_key(key))
+        self._discard_cached(key)
+
+    def delete_prefix(self, prefix):
+        """删除前缀下的所有对象"""
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self._object_key(prefix)):
+            objects = [{'Key': item['Key']} for item in page.get('Contents', [])]
+            if objects:
+                self.client.delete_objects(Bucket=self.bucket, Delete={'Objects': objects, 'Quiet': True})
+        cache_path = self._cache_path(prefix)
+        if os.path.isdir(cache_path):
+            shutil.rmtree(cache_path)
+
+    def keys(self, suffix=''):
+        """前缀下（不含子目录）以suffix结尾的存储键"""
+        keys = []
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix, Delimiter='/'):
+            for item in page.get('Contents', []):
+                key = item['Key'][len(self.prefix):]
+                if key.endswith(suffix):
+                    keys.append(key)
+        return keys
+
+    def download_url(self, key, filename):
+        """
+        预签名的下载地址，客户端直接从对象存储下载
+
+        Args:
+            filename (str): 下载时使用的文件名
+        """
+        from urllib.parse import quote
+        return self.client.generate_presigned_url('get_object', ExpiresIn=S3_PRESIGN_EXPIRES, Params={
+            'Bucket': self.bucket,
+            'Key': self._object_key(key),
+            'ResponseContentDisposition': f"attachment; filename*=UTF-8''{quote(filename)}"
+        })
+
+    def _discard_cached(self, key):
+        try:
+            os.remove(self._cache_path(key))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self, keep=None):
+        """缓存超过上限时按修改时间从旧到新删除文件，keep为刚放入缓存的文件"""
+        entries = []
+        total = 0
+        pending = [self.cache_dir]
+        while pending:
+            try:
+                items = list(os.scandir(pending.pop()))
+            except FileNotFoundError:
+                continue
+            for entry in items:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        pending.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False) and not entry.name.endswith('.part'):
+                        stat = entry.stat(follow_symlinks=False)
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+                        total += stat.st_size
+                except FileNotFoundError:
+                    continue
+        if total <= self.cache_max_bytes:
+            return
+        # 已打开的文件删除后仍可读取，正在处理的任务不受影响
+        for _, size, path in sorted(entries):
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            if total <= self.cache_max_bytes:
+                break
+
+def create_storage():
+    """按STORAGE_BACKEND创建存储后端"""
+    if STORAGE_BACKEND == 'local':
+        return LocalStorage(UPLOAD_FOLDER)
+    if STORAGE_BACKEND == 's3':
+        return S3Storage(S3_BUCKET, S3_PREFIX, S3_ENDPOINT_URL, S3_REGION)
+    raise ValueError(f"无效的存储后端: {STORAGE_BACKEND}，支持: local, s3")
+
+# 创建全局存储实例
+storage = create_storage()
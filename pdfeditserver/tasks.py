@@ -10,84 +10,238 @@ Celery任务模块
 import os
 import time
 import logging
-from celery.exceptions import MaxRetriesExceededError
-from .celery_app import celery_app, task_store  # 从celery_app导入Redis任务存储
-from .pdfedits import delete_pdf_pages
-import PyPDF2
+from contextlib import ExitStack
+from PyPDF2.errors import PyPdfError
+from .celery_app import celery_app, task_store, batch_store, TASK_RETENTION_SECONDS  # 从celery_app导入Redis任务存储
+from .celery_app import metrics, redis_client, TASK_MEMORY_BUDGET, LARGE_DOCUMENT_BYTES, PDF_OUTPUT_MODE, SPLIT_WORKERS
+from .connections import RedisBatch
+from .pdfedits import (EditPlan, MemoryBudgetError, apply_edit_plan, plan_summary,
+                       current_rss, estimate_memory, split_pdf, merge_pdfs)
+from .blobs import blob_store, release_task_files, task_output_key, task_split_key
+from .storage import storage
+from .result_cache import result_cache, plan_operation
+from .upload_sessions import upload_sessions, UPLOAD_SESSION_TTL
 
 # 配置日志记录
 logger = logging.getLogger(__name__)
 
+# 重试也不会成功的错误：文件不存在、请求无效、超出内存预算，以及PyPDF2的解析错误
+# （文件损坏时每次解析的结果都相同）
+PERMANENT_ERRORS = (FileNotFoundError, ValueError, PyPdfError)
+
+def choose_processing_mode(file_path, page_count):
+    """
+    根据文件大小和内存预算选择处理模式
+
+    Args:
+        file_path (str): PDF文件路径
+        page_count (int): 总页数，未知时为None
+
+    Returns:
+        tuple: (是否使用大文件模式, 进程匿名内存上限，无法测量时为None)
+
+    Raises:
+        MemoryBudgetError: 当大文件模式预计也会超出预算时
+    """
+    file_size = os.path.getsize(file_path)
+    page_count = page_count or 0
+    
+    large = file_size >= LARGE_DOCUMENT_BYTES or \
+        estimate_memory(file_size, page_count, large=False) > TASK_MEMORY_BUDGET
+    if large and estimate_memory(file_size, page_count, large=True) > TASK_MEMORY_BUDGET:
+        raise MemoryBudgetError(f"PDF页数过多（{page_count} 页），超出单个任务的内存预算")
+    
+    # 预算按任务开始时的内存计算，不受子进程之前处理的任务影响
+    baseline = current_rss()
+    memory_limit = None if baseline is None else baseline + TASK_MEMORY_BUDGET
+    return large, memory_limit
+
+def _remember_invalid(task_id, error):
+    """PDF解析失败时按摘要记录，相同内容的文件再次上传时直接拒绝"""
+    try:
+        digest = task_store.get_field(task_id, 'file_digest')
+        if digest is not None:
+            blob_store.set_invalid(digest, f"无法解析PDF文件: {str(error)}")
+    except Exception as e:
+        logger.error(f"记录无效文件时出错: {str(e)}")
+
+def _record_stages(operation, timings):
+    """记录PDF处理各阶段的耗时"""
+    for stage, seconds in timings.items():
+        metrics.observe('pdf_stage_duration_seconds', seconds, operation=operation, stage=stage)
+
+def _update_if_exists(task_id, value):
+    """更新任务状态，任务已被删除时忽略"""
+    try:
+        task_store.update(task_id, value, fetch=False)
+    except KeyError:
+        pass
+
+def execute_edit(task_id, file_key, total_pages, pages_to_delete, operations, file_digest=None):
+    """
+    执行编辑并记录结果
+
+    process_pdf_task和/process的快速路径（小文件直接在Web进程中处理）共用。
+
+    Args:
+        task_id (str): 任务ID
+        file_key (str): PDF文件的存储键
+        total_pages (int): 上传时记录的总页数，未知时为None
+        pages_to_delete (str|list): 要删除的页面，operations为空时使用
+        operations (list): 编辑计划的操作列表
+        file_digest (str, optional): 输入文件的内容摘要，提供时结果加入结果缓存
+
+    Returns:
+        dict: 写入任务记录的结果
+
+    Raises:
+        FileNotFoundError: 当文件不存在时
+        ValueError: 当编辑计划无效或超出内存预算时
+        Exception: 其他PDF处理错误
+    """
+    # 对象存储中的文件下载到本地读取缓存，处理期间不会被淘汰；文件不存在时抛出FileNotFoundError
+    with storage.reading(file_key) as file_path:
+        # 大文件或预计超出内存预算的任务使用大文件模式，大文件模式也超出预算时直接失败
+        large, memory_limit = choose_processing_mode(file_path, total_pages)
+        logger.info(f"任务 {task_id} 使用{'大文件' if large else '普通'}模式处理")
+        
+        # 编译并执行编辑计划，只删除页面的请求也作为单个操作的计划执行
+        plan = EditPlan(operations) if operations else EditPlan.from_delete(pages_to_delete)
+        timings = {}
+        output_key = task_output_key(task_id)
+        with storage.writing(output_key) as output_path:
+            _, total_pages, plan_pages = apply_edit_plan(file_path, plan, total_pages, output_path=output_path,
+                                                         large=large, memory_limit=memory_limit,
+                                                         output_mode=PDF_OUTPUT_MODE, timings=timings)
+    _record_stages('edit', timings)
+    summary = plan_summary(plan_pages, total_pages)
+    
+    logger.info(f"处理完成: 输出 {output_key}, 总页数 {total_pages}, 输出页数 {summary['pages_kept']}")
+    
+    try:
+        # 更新任务状态为完成
+        result = dict(summary, status='completed', output_key=output_key, output_format='pdf',
+                      processing_mode='large' if large else 'standard')
+        
+        # 任务状态和结果缓存在一次往返中写入；
+        # 加入结果缓存后，相同文件上的相同编辑可以直接复用输出文件
+        cached = None
+        with RedisBatch(redis_client) as batch:
+            updated = task_store.update(task_id, result, batch=batch)
+            if file_digest is not None:
+                try:
+                    cache_key = result_cache.make_key(file_digest, plan_operation(plan_pages))
+                    cached = result_cache.store(cache_key, output_key, summary, batch=batch)
+                except Exception as e:
+                    # 缓存失败不影响任务结果
+                    logger.error(f"保存结果缓存时出错: {str(e)}")
+        
+        # 验证更新
+        updated_task = updated.value
+        logger.debug("验证任务状态: %s", updated_task)
+        
+        if updated_task.get('status') != 'completed':
+            raise Exception(f"任务状态更新失败: {updated_task}")
+        
+        if cached is not None:
+            try:
+                cached.value
+            except Exception as e:
+                logger.error(f"淘汰结果缓存时出错: {str(e)}")
+        
+        return result
+        
+    except Exception as e:
+        error_msg = f"更新任务状态时出错: {str(e)}"
+        logger.error(error_msg)
+        raise
+
+def retry_or_fail(task, task_id, error, action):
+    """
+    处理可重试的错误：未超过最大重试次数时按指数退避重试，否则将任务标记为失败
+
+    超过最大重试次数时task.retry重新抛出原来的异常，不会抛出MaxRetriesExceededError，
+    因此先检查重试次数，保证最后一次失败时任务状态不会停留在retrying。
+
+    Args:
+        task (celery.Task): 绑定的Celery任务（bind=True时的self）
+        task_id (str): 任务ID
+        error (Exception): 捕获到的异常，在except块中调用
+        action (str): 操作名称，用于日志和错误信息，例如"处理"
+
+    Raises:
+        celery.exceptions.Retry: 安排重试时
+        Exception: 超过最大重试次数时重新抛出error
+    """
+    error_message = str(error)
+    if task.request.retries >= task.max_retries:
+        logger.exception(f"{action}PDF时出错，超过最大重试次数，任务失败: {task_id}")
+        final_error = {
+            'status': 'failed',
+            'error': f"{action}失败，已重试 {task.request.retries} 次: {error_message}"
+        }
+        _update_if_exists(task_id, final_error)
+        task.update_state(state='FAILURE', meta=final_error)
+        raise error
+    
+    logger.exception(f"{action}PDF时出错 (将重试): {error_message}")
+    _update_if_exists(task_id, {
+        'status': 'retrying',
+        'error': error_message,
+        'retry_count': task.request.retries
+    })
+    raise task.retry(exc=error, countdown=5 * (2 ** task.request.retries))
+
 @celery_app.task(bind=True, name='process_pdf', max_retries=3, default_retry_delay=5)
-def process_pdf_task(self, task_id, file_path, pages_to_delete, original_filename):
+def process_pdf_task(self, task_id, file_key, pages_to_delete, original_filename, operations=None):
     """
     处理PDF文件的Celery任务
     
     Args:
         task_id (str): 任务ID
-        file_path (str): PDF文件路径
-        pages_to_delete (list): 要删除的页面列表
+        file_key (str): PDF文件的存储键
+        pages_to_delete (str|list): 要删除的页面，页面号列表或页面范围表达式
         original_filename (str): 原始文件名
+        operations (list, optional): 编辑计划的操作列表，提供时忽略pages_to_delete
     """
     try:
-        # 检查并初始化任务存储
-        if task_id not in task_store:
-            task_store[task_id] = {
+        # 更新任务状态为处理中，任务不存在时初始化任务存储
+        try:
+            task = task_store.update(task_id, {'status': 'processing'})
+        except KeyError:
+            task = {
                 'status': 'processing',
-                'file_path': file_path,
+                'file_key': file_key,
                 'original_filename': original_filename,
                 'created_at': time.time()
             }
-        else:
-            # 更新任务状态为处理中
-            task_store[task_id]['status'] = 'processing'
+            task_store[task_id] = task
             
         self.update_state(state='PROCESSING')
         
         # 记录任务信息
-        logger.info(f"处理任务 {task_id}:")
-        logger.info(f"  文件路径: {file_path}")
-        logger.info(f"  要删除的页面: {pages_to_delete}")
-        logger.info(f"  原始文件名: {original_filename}")
+        logger.info("处理任务 %s: 文件 %s, 原始文件名 %s, 要删除的页面 %s, 编辑操作 %s",
+                    task_id, file_key, original_filename, pages_to_delete, operations)
         
-        # 检查文件是否存在
-        if not os.path.exists(file_path):
-            raise FileNotFoundError(f"找不到文件: {file_path}")
+        # 总页数在上传时已记录到任务的文档描述信息中，直接读取，不再解析PDF
+        total_pages = task.get('total_pages')
+        if total_pages is None and 'document' in task:
+            total_pages = task['document']['page_count']
         
-        # 首先获取PDF的总页数并立即更新task_store
-        total_pages = 0
-        try:
-            with open(file_path, 'rb') as pdf_file:
-                pdf_reader = PyPDF2.PdfReader(pdf_file)
-                total_pages = len(pdf_reader.pages)
-                
-                # 立即更新task_store中的total_pages信息
-                task_store.update(task_id, {
-                    'status': 'processing',
-                    'total_pages': total_pages
-                })
-                
-                # 打印调试信息
-                print(f"已获取PDF总页数: {total_pages}，已更新task_store[{task_id}]")
-                logger.info(f"已获取PDF总页数: {total_pages}，已更新task_store[{task_id}]")
-                
-                # 打印当前task_store内容，用于调试
-                print(f"当前task_store[{task_id}]内容: {task_store[task_id]}")
-        except Exception as e:
-            error_msg = f"获取PDF页数时出错: {str(e)}"
-            print(error_msg)
-            logger.error(error_msg)
-            # 继续执行，不要因为获取页数失败而中断整个任务
+        if total_pages is not None:
+            logger.info(f"任务 {task_id} 的PDF总页数: {total_pages}")
+        else:
+            # 兼容没有文档描述信息的旧任务，由delete_pdf_pages解析PDF获取页数
+            logger.info(f"任务 {task_id} 中没有文档描述信息，将在处理时获取页数")
             
         # 如果是空的pages_to_delete（即只是获取PDF信息），直接返回
-        if not pages_to_delete:
+        if not operations and not pages_to_delete:
             task_store.update(task_id, {
                 'status': 'completed',
                 'total_pages': total_pages,
                 'pages_kept': total_pages,
                 'pages_deleted': 0
             })
-            print(f"PDF信息获取完成，总页数: {total_pages}")
             logger.info(f"PDF信息获取完成，总页数: {total_pages}")
             return {
                 'status': 'completed',
@@ -96,50 +250,20 @@ def process_pdf_task(self, task_id, file_path, pages_to_delete, original_filenam
                 'pages_deleted': 0
             }
         
-        # 执行PDF页面删除
-        output_path, total_pages, pages_kept = delete_pdf_pages(file_path, pages_to_delete)
+        result = execute_edit(task_id, file_key, total_pages, pages_to_delete, operations,
+                              file_digest=task.get('file_digest'))
         
-        # 打印输出信息
-        print(f"  处理完成:")
-        print(f"  输出路径: {output_path}")
-        print(f"  总页数: {total_pages}")
-        print(f"  保留页数: {pages_kept}")
+        # 设置Celery任务状态
+        self.update_state(state='SUCCESS', meta=result)
+        return result
         
-        try:
-            # 更新任务状态为完成
-            result = {
-                'status': 'completed',
-                'output_path': output_path,
-                'total_pages': total_pages,
-                'pages_kept': pages_kept,
-                'pages_deleted': len(pages_to_delete)
-            }
-            
-            # 更新任务存储并验证更新
-            print(f"正在更新任务状态: {task_id}")
-            updated_task = task_store.update(task_id, result)
-            print(f"已更新任务状态，正在验证...")
-            print(f"验证任务状态: {updated_task}")
-            
-            if updated_task.get('status') != 'completed':
-                raise Exception(f"任务状态更新失败: {updated_task}")
-                
-            # 设置Celery任务状态
-            self.update_state(state='SUCCESS', meta=result)
-            print(f"Celery任务状态已更新为SUCCESS")
-            
-            return result
-            
-        except Exception as e:
-            error_msg = f"更新任务状态时出错: {str(e)}"
-            print(error_msg)
-            logger.error(error_msg)
-            raise
         
-    except (FileNotFoundError, ValueError) as e:
-        # 这些错误不需要重试，直接标记为失败
+    except PERMANENT_ERRORS as e:
+        # 这些错误不需要重试，直接标记为失败（包括超出内存预算的MemoryBudgetError和文件损坏）
         error_message = str(e)
-        print(f"处理PDF时出错 (不重试): {error_message}")
+        logger.error(f"处理PDF时出错 (不重试): {error_message}")
+        if isinstance(e, PyPdfError):
+            _remember_invalid(task_id, e)
         
         # 更新任务状态为失败
         error_result = {
@@ -148,8 +272,7 @@ def process_pdf_task(self, task_id, file_path, pages_to_delete, original_filenam
         }
         
         # 更新任务存储
-        if task_id in task_store:
-            task_store.update(task_id, error_result)
+        _update_if_exists(task_id, error_result)
         
         # 将任务标记为失败
         self.update_state(state='FAILURE', meta=error_result)
@@ -157,85 +280,221 @@ def process_pdf_task(self, task_id, file_path, pages_to_delete, original_filenam
         # 重新抛出异常
         raise
     except Exception as e:
-        # 记录错误信息
-        error_message = str(e)
-        print(f"处理PDF时出错 (将重试): {error_message}")
-        import traceback
-        traceback.print_exc()
-        
-        # 更新任务状态
-        retry_info = {
-            'status': 'retrying',
-            'error': error_message,
-            'retry_count': self.request.retries
+        retry_or_fail(self, task_id, e, '处理')
+
+@celery_app.task(bind=True, name='split_pdf', max_retries=3, default_retry_delay=5)
+def split_pdf_task(self, task_id, file_key, original_filename, ranges=None, every=None):
+    """
+    将PDF拆分为多个文件并打包为ZIP的Celery任务
+
+    Args:
+        task_id (str): 任务ID
+        file_key (str): PDF文件的存储键
+        original_filename (str): 原始文件名，用作ZIP中文件名的前缀
+        ranges (str|list, optional): 页面范围，每一项生成一个文件
+        every (int, optional): 每N页生成一个文件，与ranges二选一
+    """
+    try:
+        _update_if_exists(task_id, {'status': 'processing'})
+        self.update_state(state='PROCESSING')
+        logger.info(f"拆分任务 {task_id}: 文件 {file_key}, 范围 {ranges}, 每 {every} 页")
+        
+        split_key = task_split_key(task_id)
+        with storage.reading(file_key) as file_path, storage.writing(split_key) as output_path:
+            parts = split_pdf(file_path, output_path, ranges=ranges, every=every,
+                              base_name=os.path.splitext(original_filename)[0], workers=SPLIT_WORKERS)
+        
+        # 拆分结果与编辑结果分别保存，下载时按output_format选择
+        result = {
+            'status': 'completed',
+            'split_key': split_key,
+            'output_format': 'zip',
+            'parts': parts
         }
+        task_store.update(task_id, result)
+        self.update_state(state='SUCCESS', meta=result)
+        return result
         
-        # 更新任务存储
-        if task_id in task_store:
-            task_store.update(task_id, retry_info)
+    except PERMANENT_ERRORS as e:
+        # 文件不存在、损坏或拆分范围无效，重试也不会成功
+        error_result = {'status': 'failed', 'error': str(e)}
+        logger.error(f"拆分PDF时出错 (不重试): {str(e)}")
+        _update_if_exists(task_id, error_result)
+        self.update_state(state='FAILURE', meta=error_result)
+        raise
+    except Exception as e:
+        retry_or_fail(self, task_id, e, '拆分')
+
+@celery_app.task(bind=True, name='merge_pdf', max_retries=3, default_retry_delay=5)
+def merge_pdf_task(self, task_id, sources):
+    """
+    合并多个PDF的Celery任务
+
+    Args:
+        task_id (str): 合并任务的ID
+        sources (list): 按顺序合并的输入，每一项为 [文件的存储键, 编辑计划的操作列表或None]
+    """
+    try:
+        _update_if_exists(task_id, {'status': 'processing'})
+        self.update_state(state='PROCESSING')
+        logger.info(f"合并任务 {task_id}: {len(sources)} 个文件")
         
-        # 尝试重试任务
-        try:
-            # 重试任务，使用指数退避策略
-            retry_delay = 5 * (2 ** self.request.retries)
-            raise self.retry(exc=e, countdown=retry_delay)
-        except MaxRetriesExceededError:
-            # 超过最大重试次数
-            print(f"超过最大重试次数，任务失败: {task_id}")
-            
-            # 更新任务状态为失败
-            final_error = {
-                'status': 'failed',
-                'error': f"处理失败，已重试 {self.request.retries} 次: {error_message}"
-            }
-            
-            # 更新任务存储
-            if task_id in task_store:
-                task_store.update(task_id, final_error)
-            
-            # 将任务标记为失败
-            self.update_state(state='FAILURE', meta=final_error)
-            
-            # 重新抛出异常
-            raise
+        output_key = task_output_key(task_id)
+        timings = {}
+        with ExitStack() as stack:
+            inputs = [(stack.enter_context(storage.reading(file_key)), EditPlan(operations) if operations else None)
+                      for file_key, operations in sources]
+            with storage.writing(output_key) as output_path:
+                stats = merge_pdfs(inputs, output_path, timings=timings)
+        _record_stages('merge', timings)
+        
+        result = {
+            'status': 'completed',
+            'output_key': output_key,
+            'output_format': 'pdf',
+            'total_pages': stats['pages'],
+            'pages_kept': stats['pages'],
+            'pages_deleted': 0,
+            'resources_deduplicated': stats['deduplicated']
+        }
+        task_store.update(task_id, result)
+        self.update_state(state='SUCCESS', meta=result)
+        return result
+        
+    except PERMANENT_ERRORS as e:
+        # 输入文件不存在、损坏或页面选择无效，重试也不会成功
+        error_result = {'status': 'failed', 'error': str(e)}
+        logger.error(f"合并PDF时出错 (不重试): {str(e)}")
+        _update_if_exists(task_id, error_result)
+        self.update_state(state='FAILURE', meta=error_result)
+        raise
+    except Exception as e:
+        retry_or_fail(self, task_id, e, '合并')
+
+def summarize_batch(tasks):
+    """
+    统计批量任务中各子任务的状态
+
+    Args:
+        tasks (list): 子任务记录，已删除的任务为None
+
+    Returns:
+        dict: total、done、failed和pending数量
+    """
+    done = sum(1 for task in tasks if task is not None and task.get('status') == 'completed')
+    # 已被删除的子任务无法再完成，按失败计算
+    failed = sum(1 for task in tasks if task is None or task.get('status') == 'failed')
+    return {
+        'total': len(tasks),
+        'done': done,
+        'failed': failed,
+        'pending': len(tasks) - done - failed
+    }
+
+@celery_app.task(name='finalize_batch')
+def finalize_batch(batch_id):
+    """
+    批量任务的chord回调，所有子任务结束后记录汇总结果
+
+    子任务失败时chord以错误回调的方式调用本任务，因此不接收子任务的返回值，
+    而是从任务存储读取各子任务的最终状态。
+
+    Args:
+        batch_id (str): 批量任务ID
+    """
+    task_ids = batch_store.get_field(batch_id, 'task_ids')
+    if task_ids is None:
+        return None
+    
+    summary = summarize_batch(task_store.mget(task_ids))
+    summary.update({
+        'status': 'completed',
+        'completed_at': time.time()
+    })
+    try:
+        batch_store.update(batch_id, summary, fetch=False)
+    except KeyError:
+        return None
+    
+    logger.info(f"批量任务 {batch_id} 已完成: {summary}")
+    return summary
 
 @celery_app.task(bind=True, max_retries=2)
-def cleanup_old_tasks(self):
+def cleanup_old_tasks(self, max_age=None, batch_size=500):
     """
     清理旧任务的定时任务
+
+    每隔TASK_REAP_INTERVAL秒执行一次，通过created_at索引按范围查找过期任务，
+    每批一次往返读取任务数据，代价与过期任务数量成正比。
+
+    文件通过不过期的文件引用查找，任务记录已被Redis过期删除时也能删除文件。
+    文件全部删除后才删除任务记录和索引项；删除失败的任务留在索引中，下次清理时从剩余的文件继续。
+    旧版本没有索引的任务在第一次清理时补建索引（RedisTaskStore.migrate_index）。
+
+    Args:
+        max_age (int, optional): 任务保留时间（秒），默认为TASK_RETENTION_SECONDS
+        batch_size (int): 每批处理的任务数
     """
     try:
-        current_time = time.time()
+        if max_age is None:
+            max_age = TASK_RETENTION_SECONDS
+        cutoff = time.time() - max_age
+        # 旧版本的任务没有索引项，第一次清理时补建，之后只检查迁移标记
+        task_store.migrate_index(batch_size)
         expired_tasks = []
+        failed = 0
         
-        # 查找超过24小时的任务
-        for task_id, task in list(task_store.items()):
-            if current_time - task['created_at'] > 24 * 60 * 60:
-                # 删除相关文件
-                if 'file_path' in task and os.path.exists(task['file_path']):
-                    try:
-                        os.remove(task['file_path'])
-                    except Exception as e:
-                        print(f"删除文件 {task['file_path']} 时出错: {str(e)}")
+        while True:
+            # 本轮失败的任务仍在索引最前面，跳过它们
+            task_ids = task_store.expired(cutoff, limit=batch_size, offset=failed)
+            if not task_ids:
+                break
+            
+            released = []
+            for task_id, task, files in zip(task_ids, task_store.mget(task_ids), task_store.mget_files(task_ids)):
+                if files is None and task is not None:
+                    # 文件引用之前创建的任务，从记录中取得文件字段
+                    files = task
                 
-                if 'output_path' in task and os.path.exists(task['output_path']):
+                # 删除相关文件，共享的上传文件通过引用计数释放；每删除一个文件记录一次进度
+                if files is not None:
                     try:
-                        os.remove(task['output_path'])
+                        release_task_files(files, lambda remaining: task_store.set_files(task_id, remaining))
                     except Exception as e:
-                        print(f"删除文件 {task['output_path']} 时出错: {str(e)}")
+                        logger.error(f"删除任务 {task_id} 的文件时出错: {str(e)}")
+                        failed += 1
+                        continue
                 
-                # 从任务字典中删除
-                del task_store[task_id]
-                expired_tasks.append(task_id)
+                released.append(task_id)
+                if files is not None:
+                    expired_tasks.append(task_id)
+            
+            # 从任务存储和索引中删除
+            task_store.delete_many(released)
+            
+            if len(task_ids) < batch_size:
+                break
+        
+        # 批量任务记录不关联文件，子任务由上面的循环清理，这里只删除记录
+        while True:
+            batch_ids = batch_store.expired(cutoff, limit=batch_size)
+            if not batch_ids:
+                break
+            batch_store.delete_many(batch_ids)
+            if len(batch_ids) < batch_size:
+                break
+        
+        # 清理长时间未完成的分块上传会话及其临时文件
+        upload_sessions.reap(time.time() - UPLOAD_SESSION_TTL, batch_size)
         
         return {
             'message': f'已清理 {len(expired_tasks)} 个过期任务',
             'expired_tasks': expired_tasks
         }
     except Exception as e:
-        print(f"清理任务时出错: {str(e)}")
-        try:
-            raise self.retry(exc=e, countdown=60)
-        except MaxRetriesExceededError:
-            print("清理任务失败，超过最大重试次数")
-            raise 
\ No newline at end of file
+        logger.exception(f"清理任务时出错: {str(e)}")
+        # retry在超过最大重试次数时重新抛出原来的异常，先检查重试次数
+        if self.request.retries >= self.max_retries:
+            logger.error("清理任务失败，超过最大重试次数")
+            raise
+        raise self.retry(exc=e, countdown=60)
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+断点续传的分块上传
+
+大文件按以下流程上传，每个请求只携带一个分块，不受单个请求大小的限制：
+1. 创建上传会话，声明文件名和总字节数
+2. 按顺序PUT分块，每个分块声明其起始偏移量，数据直接追加到磁盘上的临时文件
+3. 中断后查询会话的当前偏移量，从该位置继续上传
+4. 全部上传后完成会话，文件放入内容寻址存储并创建任务
+
+临时文件的实际大小就是已确认的偏移量，进程崩溃后不会与Redis中的记录不一致。
+同一会话的写入、完成和删除通过Redis锁互斥，完成时不会有分块正在追加。
+
+临时文件保存在UPLOAD_PARTIAL_FOLDER中，而不是文件存储：对象存储不支持追加写入。
+多台Web服务器时该目录必须是所有Web服务器和执行清理任务的worker共享的目录（例如NFS），
+或者由负载均衡按会话ID把同一会话的请求固定到同一台服务器；请求到达没有临时文件的服务器时
+返回错误，而不是把偏移量当作0让客户端从头上传。
+"""
+
+import os
+import time
+import uuid
+import shutil
+from contextlib import contextmanager
+
+from .celery_app import redis_client, RedisTaskStore, UPLOAD_FOLDER
+from .connections import hold_lock
+from .blobs import blob_store
+
+# 上传会话的保留时间（秒），超过后未完成的会话和临时文件会被清理
+UPLOAD_SESSION_TTL = int(os.environ.get('UPLOAD_SESSION_TTL', 24 * 60 * 60))
+# 分块上传允许的最大文件大小（字节）
+UPLOAD_MAX_BYTES = int(os.environ.get('UPLOAD_MAX_BYTES', 1024 * 1024 * 1024))
+# 建议客户端使用的分块大小（字节），需小于MAX_CONTENT_LENGTH和nginx的client_max_body_size
+UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024))
+# 同一会话的锁的过期时间（秒），持有期间自动续期，只决定请求所在进程退出后锁多久失效
+UPLOAD_LOCK_TIMEOUT = 30
+# 分块上传临时文件的目录，多台Web服务器时需共享
+UPLOAD_PARTIAL_FOLDER = os.environ.get('UPLOAD_PARTIAL_FOLDER', os.path.join(UPLOAD_FOLDER, 'partial'))
+
+# 从请求中读取数据时每次读取的字节数
+READ_SIZE = 1024 * 1024
+
+class UploadOffsetError(ValueError):
+    """分块的起始偏移量与已上传的字节数不一致"""
+
+    def __init__(self, message, offset):
+        super().__init__(message)
+        self.offset = offset
+
+class UploadBusyError(Exception):
+    """同一会话正在被另一个请求写入"""
+
+class UploadPartMissingError(Exception):
+    """会话存在，但临时文件不在本机的UPLOAD_PARTIAL_FOLDER中，通常是请求被转发到了其他服务器"""
+
+class UploadSessionStore:
+    """保存分块上传会话，会话信息在Redis中，数据在磁盘上的临时文件中"""
+
+    def __init__(self, redis_client, root, ttl):
+        self.redis = redis_client
+        self.root = root
+        self.sessions = RedisTaskStore(redis_client, prefix='pdf_upload:', ttl=ttl)
+
+    def part_path(self, upload_id):
+        """会话的临时文件路径"""
+        return os.path.join(self.root, f"{upload_id}.part")
+
+    def create(self, filename, size):
+        """
+        创建上传会话
+
+        Args:
+            filename (str): 原始文件名
+            size (int): 文件总字节数
+
+        Returns:
+            str: 会话ID
+
+        Raises:
+            ValueError: 当文件大小无效时
+        """
+        if isinstance(size, bool) or not isinstance(size, int) or size <= 0:
+            raise ValueError('文件大小必须是正整数')
+        if size > UPLOAD_MAX_BYTES:
+            raise ValueError(f'文件过大，最大支持 {UPLOAD_MAX_BYTES} 字节')
+
+        os.makedirs(self.root, exist_ok=True)
+        upload_id = str(uuid.uuid4())
+        open(self.part_path(upload_id), 'wb').close()
+        self.sessions[upload_id] = {
+            'filename': filename,
+            'size': size,
+            'created_at': time.time()
+        }
+        return upload_id
+
+    def get(self, upload_id):
+        """
+        读取会话信息和当前偏移量
+
+        Returns:
+            dict: 会话信息，offset为已上传的字节数；会话不存在时返回None
+        """
+        session = self.sessions.get_fields(upload_id, ['filename', 'size', 'created_at'])
+        if session is None:
+            return None
+        session['offset'] = self.offset(upload_id)
+        return session
+
+    def offset(self, upload_id):
+        """
+        已写入磁盘的字节数
+
+        Raises:
+            UploadPartMissingError: 当临时文件不存在时
+        """
+        try:
+            return os.path.getsize(self.part_path(upload_id))
+        except FileNotFoundError:
+            raise UploadPartMissingError('上传的临时文件不在此服务器上') from None
+
+    @contextmanager
+    def _locked(self, upload_id):
+        """
+        持有会话的锁，同一会话同时只有一个请求写入、完成或删除
+
+        接收很慢的分块、完成接近UPLOAD_MAX_BYTES的文件时计算摘要和上传到对象存储都可能很久，
+        锁在持有期间自动续期，参见connections.hold_lock。
+
+        Raises:
+            UploadBusyError: 当锁被另一个请求持有时
+        """
+        lock_key = f"{self.sessions.prefix.rstrip(':')}_lock:{upload_id}"
+        with hold_lock(self.redis, lock_key, UPLOAD_LOCK_TIMEOUT) as lock:
+            if lock is None:
+                raise UploadBusyError('另一个请求正在处理此上传')
+            yield
+
+    def append(self, upload_id, session, stream, offset):
+        """
+        将一个分块追加到临时文件
+
+        Args:
+            upload_id (str): 会话ID
+            session (dict): get返回的会话信息
+            stream: 分块数据流，边读边写，不在内存中缓存整个分块
+            offset (int): 分块的起始偏移量
+
+        Returns:
+            int: 写入后的偏移量
+
+        Raises:
+            UploadOffsetError: 当偏移量与已上传的字节数不一致时
+            UploadBusyError: 当同一会话正在被另一个请求写入或完成时
+            UploadPartMissingError: 当临时文件不在本机时
+            ValueError: 当数据超过声明的文件大小时
+        """
+        with self._locked(upload_id):
+            part_path = self.part_path(upload_id)
+            current = self.offset(upload_id)
+            if offset != current:
+                raise UploadOffsetError(f'偏移量不一致，已上传 {current} 字节', current)
+
+            with open(part_path, 'ab') as part_file:
+                while True:
+                    chunk = stream.read(READ_SIZE)
+                    if not chunk:
+                        break
+                    if current + len(chunk) > session['size']:
+                        # 丢弃超出部分之前已写入的数据，保持临时文件与偏移量一致
+                        part_file.truncate(offset)
+                        raise ValueError(f"数据超过声明的文件大小 {session['size']} 字节")
+                    part_file.write(chunk)
+                    current += len(chunk)
+            return current
+
+    def finish(self, upload_id, session):
+        """
+        完成上传，将文件放入内容寻址存储
+
+        SHA-256的中间状态无法保存到Redis，分块可能由不同的gunicorn进程接收，
+        因此摘要在完成时顺序读取一次文件计算，此时文件通常仍在页缓存中。
+
+        Returns:
+            tuple: (摘要, 存储键, 字节数)
+
+        Raises:
+            KeyError: 当会话已被另一个请求完成或删除时
+            UploadOffsetError: 当文件尚未上传完整时
+            UploadBusyError: 当同一会话正在被另一个请求写入时
+            UploadPartMissingError: 当临时文件不在本机时
+        """
+        with self._locked(upload_id):
+            # 等待锁期间会话可能已被完成
+            if upload_id not in self.sessions:
+                raise KeyError(upload_id)
+            current = self.offset(upload_id)
+            if current != session['size']:
+                raise UploadOffsetError(f"文件尚未上传完整，已上传 {current}/{session['size']} 字节", current)
+            result = blob_store.save_file(self.part_path(upload_id))
+            del self.sessions[upload_id]
+        return result
+
+    def discard(self, upload_id):
+        """
+        删除会话及其临时文件
+
+        Raises:
+            UploadBusyError: 当同一会话正在被另一个请求写入或完成时
+        """
+        with self._locked(upload_id):
+            part_path = self.part_path(upload_id)
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            del self.sessions[upload_id]
+
+    def reap(self, before, batch_size=500):
+        """
+        删除创建时间早于before的未完成会话及其临时文件
+
+        Returns:
+            int: 删除的会话数
+        """
+        reaped = 0
+        while True:
+            upload_ids = self.sessions.expired(before, limit=batch_size)
+            if not upload_ids:
+                break
+            for upload_id in upload_ids:
+                part_path = self.part_path(upload_id)
+                if os.path.exists(part_path):
+                    os.remove(part_path)
+            self.sessions.delete_many(upload_ids)
+            reaped += len(upload_ids)
+            if len(upload_ids) < batch_size:
+                break
+        return reaped
+
+    def clear(self):
+        """删除所有会话和临时文件"""
+        self.sessions.clear()
+        if os.path.isdir(self.root):
+            shutil.rmtree(self.root)
+
+# 创建全局上传会话存储实例
+upload_sessions = UploadSessionStore(redis_client, UPLOAD_PARTIAL_FOLDER, UPLOAD_SESSION_TTL)
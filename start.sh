@@ -33,11 +33,16 @@ fi
 # 创建日志目录
 mkdir -p logs
 
-# 启动Celery Worker
+# 启动Celery Worker，每个队列一个worker（参见supervisord.conf）
 echo "启动Celery Worker..."
-celery -A pdfeditserver.celery_app worker --loglevel=info > logs/worker.log 2>&1 &
-WORKER_PID=$!
-echo "Celery Worker 已启动 (PID: $WORKER_PID)"
+celery -A pdfeditserver.celery_app worker -Q pdf.small -n small@%h --concurrency=4 --prefetch-multiplier=4 --loglevel=info > logs/worker_small.log 2>&1 &
+SMALL_WORKER_PID=$!
+celery -A pdfeditserver.celery_app worker -Q pdf.large -n large@%h --concurrency=2 --prefetch-multiplier=1 -O fair --loglevel=info > logs/worker_large.log 2>&1 &
+LARGE_WORKER_PID=$!
+celery -A pdfeditserver.celery_app worker -Q maintenance -n maintenance@%h --concurrency=1 --prefetch-multiplier=1 --loglevel=info > logs/worker_maintenance.log 2>&1 &
+MAINTENANCE_WORKER_PID=$!
+WORKER_PIDS="$SMALL_WORKER_PID $LARGE_WORKER_PID $MAINTENANCE_WORKER_PID"
+echo "Celery Worker 已启动 (PID: $WORKER_PIDS)"
 
 # 启动Celery Beat
 echo "启动Celery Beat..."
@@ -52,7 +57,7 @@ APP_PID=$!
 echo "Flask应用已启动 (PID: $APP_PID)"
 
 # 保存PID到文件
-echo "$WORKER_PID $BEAT_PID $APP_PID" > .pid
+echo "$BEAT_PID $APP_PID $WORKER_PIDS" > .pid
 
 echo "所有服务已启动!"
 echo "访问 http://localhost:9000 使用PDF编辑服务"
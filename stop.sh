@@ -8,8 +8,8 @@ if [ ! -f .pid ]; then
     exit 1
 fi
 
-# 读取PID
-read WORKER_PID BEAT_PID APP_PID < .pid
+# 读取PID，最后是各队列worker的PID
+read BEAT_PID APP_PID WORKER_PIDS < .pid
 
 # 停止Flask应用
 if ps -p $APP_PID > /dev/null; then
@@ -38,17 +38,19 @@ else
 fi
 
 # 停止Celery Worker
-if ps -p $WORKER_PID > /dev/null; then
-    echo "停止Celery Worker (PID: $WORKER_PID)..."
-    kill $WORKER_PID
-    sleep 2
+for WORKER_PID in $WORKER_PIDS; do
     if ps -p $WORKER_PID > /dev/null; then
-        echo "Celery Worker未能正常停止，强制终止..."
-        kill -9 $WORKER_PID
+        echo "停止Celery Worker (PID: $WORKER_PID)..."
+        kill $WORKER_PID
+        sleep 2
+        if ps -p $WORKER_PID > /dev/null; then
+            echo "Celery Worker未能正常停止，强制终止..."
+            kill -9 $WORKER_PID
+        fi
+    else
+        echo "Celery Worker (PID: $WORKER_PID) 未运行"
     fi
-else
-    echo "Celery Worker未运行"
-fi
+done
 
 # 删除PID文件
 rm -f .pid
@@ -0,0 +1,79 @@
+"""
+测试环境
+
+pdfeditserver在导入时按环境变量创建全局的Redis客户端、文件存储和Celery应用，
+因此在导入之前设置：Redis连接换成进程内的fakeredis，Celery任务在当前线程中直接执行（eager），
+上传目录使用临时目录。每个测试开始前清空Redis和上传目录。
+"""
+
+import os
+import importlib
+import shutil
+import tempfile
+
+import fakeredis
+import pytest
+import redis
+
+UPLOAD_ROOT = tempfile.mkdtemp(prefix='pdfeditserver-tests-')
+
+os.environ.update({
+    'UPLOAD_FOLDER': UPLOAD_ROOT,
+    'REDIS_URL': 'redis://localhost:6379/0',
+    'CELERY_BROKER_URL': 'memory://',
+    'CELERY_RESULT_BACKEND': 'cache+memory://',
+    'STORAGE_BACKEND': 'local',
+    'LOG_LEVEL': 'WARNING',
+})
+
+fake_server = fakeredis.FakeServer()
+# 较新的fakeredis将FakeConnection改名为FakeRedisConnection
+FakeConnection = getattr(fakeredis, 'FakeRedisConnection', fakeredis.FakeConnection)
+redis.BlockingConnectionPool.from_url = classmethod(
+    lambda cls, url, **kwargs: cls(connection_class=FakeConnection, server=fake_server, **kwargs))
+
+from pdfeditserver.celery_app import celery_app, redis_client  # noqa: E402
+
+celery_app.conf.task_always_eager = True
+
+from benchmarks.corpus import generate  # noqa: E402
+
+@pytest.fixture(autouse=True)
+def clean_state():
+    redis_client.flushall()
+    for entry in os.listdir(UPLOAD_ROOT):
+        path = os.path.join(UPLOAD_ROOT, entry)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+    yield
+
+@pytest.fixture
+def app_module():
+    # pdfeditserver.app 属性是Flask应用，模块需要从sys.modules中取得
+    return importlib.import_module('pdfeditserver.app')
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+@pytest.fixture
+def make_pdf(tmp_path):
+    """生成合成PDF，返回文件路径"""
+    def make(pages, kind='text', seed=0):
+        path = str(tmp_path / f"{kind}_{pages}_{seed}.pdf")
+        generate(path, kind, pages, seed)
+        return path
+    return make
+
+@pytest.fixture
+def upload(client):
+    """上传文件并返回任务ID"""
+    def upload_file(path, filename='input.pdf'):
+        with open(path, 'rb') as pdf_file:
+            response = client.post('/upload', data={'file': (pdf_file, filename)},
+                                   content_type='multipart/form-data')
+        assert response.status_code == 200, response.get_json()
+        return response.get_json()['task_id']
+    return upload_file
@@ -0,0 +1,31 @@
+import pytest
+
+from pdfeditserver.celery_app import batch_store, task_store
+
+@pytest.mark.parametrize('payload', [
+    [1],
+    {'items': []},
+    {'items': 'abc'},
+    {'items': [1]},
+    {'items': [None]},
+    {'items': [['task_id']]},
+])
+def test_batch_rejects_malformed_items(client, payload):
+    response = client.post('/batch', json=payload)
+    assert response.status_code == 400
+    assert response.get_json()['error'] == '无效的请求数据'
+
+def test_batch_rejects_malformed_item_after_valid_one(client, upload, make_pdf):
+    task_id = upload(make_pdf(2))
+    response = client.post('/batch', json={'items': [{'task_id': task_id}, 'oops']})
+    assert response.status_code == 400
+    assert list(task_store.keys()) == [task_id]
+    assert list(batch_store.keys()) == []
+
+def test_batch_from_uploaded_tasks(client, upload, make_pdf):
+    task_id = upload(make_pdf(3))
+    response = client.post('/batch', json={'items': [{'task_id': task_id, 'pages_to_delete': '1'},
+                                                     {'task_id': task_id, 'pages_to_delete': '2-3'}]})
+    assert response.status_code == 200, response.get_json()
+    batch = client.get(f"/batch/{response.get_json()['batch_id']}").get_json()
+    assert batch['total'] == 2
@@ -0,0 +1,76 @@
+import threading
+
+from pdfeditserver.blobs import blob_store
+from pdfeditserver.celery_app import redis_client, task_store
+from pdfeditserver.storage import storage
+
+def refs(digest):
+    return int(redis_client.hget(blob_store.refs_key, digest) or 0)
+
+def test_upload_during_release_keeps_file(upload, make_pdf, monkeypatch, tmp_path):
+    path = make_pdf(2)
+    digest = task_store[upload(path)]['file_digest']
+    key = blob_store.key(digest)
+
+    deleting = threading.Event()
+    proceed = threading.Event()
+    delete = storage.delete
+
+    def slow_delete(storage_key):
+        if storage_key == key:
+            deleting.set()
+            proceed.wait(5)
+        delete(storage_key)
+
+    monkeypatch.setattr(storage, 'delete', slow_delete)
+    # 最后一个引用被释放，引用计数已归零、文件尚未删除
+    releaser = threading.Thread(target=blob_store.release, args=(digest,))
+    releaser.start()
+    assert deleting.wait(5)
+
+    # 同时上传相同内容的文件
+    copy = tmp_path / 'copy.pdf'
+    copy.write_bytes(open(path, 'rb').read())
+    uploader = threading.Thread(target=blob_store.add_file, args=(str(copy), digest))
+    uploader.start()
+    uploader.join(0.3)
+    # 上传等待释放完成
+    assert uploader.is_alive()
+
+    proceed.set()
+    releaser.join()
+    uploader.join()
+    assert refs(digest) == 1
+    assert storage.exists(key)
+
+def test_acquire_after_last_release_fails(upload, make_pdf):
+    digest = task_store[upload(make_pdf(2))]['file_digest']
+    assert blob_store.acquire(digest)
+    assert refs(digest) == 2
+    blob_store.release(digest)
+    blob_store.release(digest)
+    assert not blob_store.acquire(digest)
+    assert refs(digest) == 0
+
+def test_merge_with_released_source_is_rolled_back(client, upload, make_pdf):
+    first = upload(make_pdf(2, seed=0))
+    second = upload(make_pdf(2, seed=1))
+    first_digest = task_store[first]['file_digest']
+    second_digest = task_store[second]['file_digest']
+    # 第二个任务的文件在读取任务记录之后被释放
+    blob_store.release(second_digest)
+
+    response = client.post('/merge', json={'items': [{'task_id': first}, {'task_id': second}]})
+    assert response.status_code == 404
+    assert refs(first_digest) == 1
+    assert sorted(task_store.keys()) == sorted([first, second])
+
+def test_batch_with_released_source_is_rolled_back(client, upload, make_pdf):
+    first = upload(make_pdf(2, seed=0))
+    second = upload(make_pdf(2, seed=1))
+    blob_store.release(task_store[second]['file_digest'])
+
+    response = client.post('/batch', json={'items': [{'task_id': first}, {'task_id': second}]})
+    assert response.status_code == 404
+    assert refs(task_store[first]['file_digest']) == 1
+    assert sorted(task_store.keys()) == sorted([first, second])
@@ -0,0 +1,101 @@
+import json
+import os
+import time
+
+import pytest
+
+from pdfeditserver.blobs import blob_store, release_task_files
+from pdfeditserver.celery_app import redis_client, task_store
+from pdfeditserver.storage import storage
+from pdfeditserver.tasks import cleanup_old_tasks
+
+def processed_task(client, upload, path):
+    task_id = upload(path)
+    response = client.post('/process', json={'task_id': task_id, 'pages_to_delete': '1'})
+    assert response.status_code == 200, response.get_json()
+    return task_id, task_store[task_id]
+
+def expire(task_id):
+    """将任务在索引中的创建时间提前，使其超过保留时间"""
+    redis_client.zadd(task_store.index_key, {task_id: 0})
+
+def cleanup():
+    return cleanup_old_tasks.apply(kwargs={'max_age': 60}).get()
+
+def refs(digest):
+    return int(redis_client.hget(blob_store.refs_key, digest) or 0)
+
+def test_cleanup_releases_files_after_record_ttl_expired(client, upload, make_pdf):
+    task_id, task = processed_task(client, upload, make_pdf(4))
+    expire(task_id)
+    # Redis已按TTL删除任务记录
+    redis_client.delete(task_store._key(task_id))
+
+    assert cleanup()['expired_tasks'] == [task_id]
+    assert not storage.exists(task['output_key'])
+    assert not storage.exists(blob_store.key(task['file_digest']))
+    assert task_store.expired(time.time()) == []
+    assert task_store.mget_files([task_id]) == [None]
+
+def test_cleanup_keeps_record_until_files_released(client, upload, make_pdf, monkeypatch):
+    path = make_pdf(4)
+    task_id, task = processed_task(client, upload, path)
+    other = upload(path)
+    assert refs(task['file_digest']) == 2
+    expire(task_id)
+
+    delete = storage.delete
+
+    def failing_delete(key):
+        if key == task['output_key']:
+            raise OSError("存储不可用")
+        delete(key)
+
+    monkeypatch.setattr(storage, 'delete', failing_delete)
+    assert cleanup()['expired_tasks'] == []
+    assert task_id in task_store
+    assert task_store.expired(time.time() - 60) == [task_id]
+
+    monkeypatch.setattr(storage, 'delete', delete)
+    assert cleanup()['expired_tasks'] == [task_id]
+    assert task_id not in task_store
+    assert not storage.exists(task['output_key'])
+    # 共享的上传文件只释放一次，另一个任务仍然可以使用
+    assert refs(task['file_digest']) == 1
+    assert storage.exists(task_store[other]['file_key'])
+
+def test_release_progress_skips_released_references(client, upload, make_pdf, monkeypatch):
+    digests = [task_store[upload(make_pdf(2, seed=seed))]['file_digest'] for seed in (0, 1)]
+    release = blob_store.release
+
+    def failing_release(digest):
+        if digest == digests[1]:
+            raise OSError("存储不可用")
+        return release(digest)
+
+    monkeypatch.setattr(blob_store, 'release', failing_release)
+    progress = []
+    with pytest.raises(OSError):
+        release_task_files({'output_key': 'merged.pdf', 'source_digests': digests}, progress.append)
+    assert progress[-1] == {'source_digests': [digests[1]]}
+    assert refs(digests[0]) == 0
+    assert refs(digests[1]) == 1
+
+def test_cleanup_reindexes_records_from_before_the_index(client, upload, make_pdf):
+    recent = upload(make_pdf(2))
+    path = make_pdf(2, seed=1)
+    # 旧版本以JSON字符串保存、没有索引项和过期时间的任务
+    redis_client.set(task_store._key('legacy'), json.dumps({
+        'status': 'completed', 'file_path': path, 'created_at': 0}))
+    assert task_store.expired(time.time()) == [recent]
+
+    assert cleanup()['expired_tasks'] == ['legacy']
+    assert 'legacy' not in task_store
+    assert not os.path.exists(path)
+    assert recent in task_store
+    assert redis_client.exists(task_store.migrated_key)
+
+    # 迁移只执行一次，之后写入的旧格式记录不再补建索引
+    redis_client.set(task_store._key('late'), json.dumps({'status': 'completed', 'created_at': 0}))
+    assert cleanup()['expired_tasks'] == []
+    assert 'late' in task_store
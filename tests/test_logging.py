@@ -0,0 +1,17 @@
+from pdfeditserver.logs import correlation_id
+
+def test_fast_path_logs_carry_request_id(client, upload, make_pdf, app_module, monkeypatch):
+    task_id = upload(make_pdf(3))
+    execute_edit = app_module.execute_edit
+    seen = []
+
+    def recording_execute_edit(*args, **kwargs):
+        seen.append(correlation_id.get())
+        return execute_edit(*args, **kwargs)
+
+    monkeypatch.setattr(app_module, 'execute_edit', recording_execute_edit)
+    response = client.post('/process', json={'task_id': task_id, 'pages_to_delete': '1'},
+                           headers={'X-Request-ID': 'req-fast-path'})
+    assert response.status_code == 200, response.get_json()
+    assert response.get_json()['pages_kept'] == 2
+    assert seen == ['req-fast-path']
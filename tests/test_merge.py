@@ -0,0 +1,40 @@
+import os
+
+from PyPDF2 import PdfReader, PdfWriter
+
+from pdfeditserver.pdfedits import merge_pdfs
+
+def naive_merge_size(paths, output_path):
+    writer = PdfWriter()
+    for path in paths:
+        for page in PdfReader(path).pages:
+            writer.add_page(page)
+    with open(output_path, 'wb') as output_file:
+        writer.write(output_file)
+    return os.path.getsize(output_path)
+
+def test_merge_deduplicates_indirect_resources(make_pdf, tmp_path):
+    # shared文档的所有页面引用同一个间接的资源字典
+    path = make_pdf(20, kind='shared')
+    page = PdfReader(path).pages[0]
+    assert type(dict.get(page, '/Resources')).__name__ == 'IndirectObject'
+
+    output_path = str(tmp_path / 'merged.pdf')
+    result = merge_pdfs([(path, None), (path, None)], output_path)
+
+    # 字体、图片和图形状态各一个，第二个文件的三个资源都复用第一个文件已写入的对象
+    assert result == {'pages': 40, 'resources': 6, 'deduplicated': 3}
+    assert os.path.getsize(output_path) < naive_merge_size([path, path], str(tmp_path / 'naive.pdf'))
+
+    merged = PdfReader(output_path)
+    first = merged.pages[0]['/Resources']['/XObject'].raw_get('/Im1')
+    last = merged.pages[39]['/Resources']['/XObject'].raw_get('/Im1')
+    assert first.idnum == last.idnum
+
+def test_merge_keeps_distinct_resources(make_pdf, tmp_path):
+    # 不同种子生成的图片内容不同，不能合并；字体和图形状态相同
+    output_path = str(tmp_path / 'merged.pdf')
+    result = merge_pdfs([(make_pdf(5, kind='shared', seed=0), None),
+                         (make_pdf(5, kind='shared', seed=1), None)], output_path)
+    assert result['deduplicated'] == 2
+    assert len(PdfReader(output_path).pages) == 10
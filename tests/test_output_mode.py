@@ -0,0 +1,118 @@
+import io
+import os
+import struct
+
+import pytest
+from PyPDF2 import PdfReader
+
+from pdfeditserver import pdfedits
+
+def page_images(reader, index):
+    xobjects = reader.pages[index]['/Resources']['/XObject']
+    return [xobjects[name].get_object().get_data() for name in xobjects]
+
+def test_deleted_page_content_not_in_default_output(client, upload, make_pdf):
+    # 删除10页中的1页，auto会选择增量更新
+    path = make_pdf(10, kind='images')
+    deleted = page_images(PdfReader(path), 0)
+    task_id = upload(path)
+
+    response = client.post('/process', json={'task_id': task_id, 'pages_to_delete': '1'})
+    assert response.status_code == 200, response.get_json()
+    output = client.get(f'/download/{task_id}').data
+
+    assert len(PdfReader(io.BytesIO(output)).pages) == 9
+    for data in deleted:
+        assert data not in output
+
+def build_pdf(path, widths, xref_type):
+    """生成每页宽度不同的PDF，交叉引用为xref表或交叉引用流"""
+    count = len(widths)
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>",
+               b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+                   b" ".join(b"%d 0 R" % (3 + index) for index in range(count)), count)]
+    objects += [b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d 200] /Resources << >> >>" % width
+                for width in widths]
+    output = io.BytesIO()
+    output.write(b"%PDF-1.5\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(output.tell())
+        output.write(b"%d 0 obj\n%s\nendobj\n" % (number, body))
+    xref = output.tell()
+    size = len(objects) + 1
+    if xref_type == 'table':
+        output.write(b"xref\n0 %d\n0000000000 65535 f \n" % size)
+        output.write(b"".join(b"%010d 00000 n \n" % offset for offset in offsets))
+        output.write(b"trailer\n<< /Size %d /Root 1 0 R >>\n" % size)
+    else:
+        rows = struct.pack('>BIH', 0, 0, 65535)
+        rows += b"".join(struct.pack('>BIH', 1, offset, 0) for offset in offsets + [xref])
+        output.write(b"%d 0 obj\n<< /Type /XRef /Size %d /W [1 4 2] /Root 1 0 R /Length %d >>\nstream\n"
+                     % (size, size + 1, len(rows)) + rows + b"\nendstream\nendobj\n")
+    output.write(b"startxref\n%d\n%%%%EOF\n" % xref)
+    with open(path, 'wb') as pdf_file:
+        pdf_file.write(output.getvalue())
+
+def layout(path):
+    reader = PdfReader(path, strict=True)
+    return [(int(page.mediabox.width), page.rotation) for page in reader.pages]
+
+@pytest.mark.parametrize('xref_type', ['table', 'stream'])
+def test_incremental_output_is_readable_by_strict_reader(tmp_path, caplog, xref_type):
+    input_path = str(tmp_path / 'input.pdf')
+    build_pdf(input_path, [100, 101, 102, 103, 104], xref_type)
+    assert pdfedits._last_xref(open(input_path, 'rb').read())[1] == xref_type
+
+    plan = pdfedits.EditPlan([
+        {'op': 'delete', 'pages': '2'},
+        {'op': 'rotate', 'pages': '1', 'angle': 90},
+        {'op': 'reorder', 'order': '4,3,2,1'},
+        {'op': 'duplicate', 'pages': '1', 'copies': 1},
+    ])
+    first = str(tmp_path / 'first.pdf')
+    pdfedits.apply_edit_plan(input_path, plan, output_path=first, output_mode='incremental')
+    assert os.path.getsize(first) > os.path.getsize(input_path)
+    assert layout(first) == [(104, 0), (104, 0), (103, 0), (102, 0), (100, 90)]
+
+    # 在增量更新的结果上再追加一次增量更新
+    plan = pdfedits.EditPlan([{'op': 'delete', 'pages': '1'}, {'op': 'rotate', 'pages': '1,4', 'angle': 90}])
+    second = str(tmp_path / 'second.pdf')
+    pdfedits.apply_edit_plan(first, plan, output_path=second, output_mode='incremental')
+    assert pdfedits._last_xref(open(second, 'rb').read())[1] == xref_type
+    assert layout(second) == [(104, 90), (103, 0), (102, 0), (100, 180)]
+    assert 'zero-indexed' not in caplog.text
+
+def page_summary(reader):
+    """每页的尺寸、旋转、内容流和图片数据，与对象编号无关"""
+    pages = []
+    for page in reader.pages:
+        xobjects = page['/Resources'].get('/XObject', {})
+        pages.append((
+            [float(value) for value in page.mediabox],
+            page.rotation,
+            page.get_contents().get_data() if page.get_contents() is not None else b'',
+            sorted(xobjects[name].get_object().get_data() for name in xobjects),
+        ))
+    return pages
+
+@pytest.mark.parametrize('kind', ['text', 'images'])
+def test_large_mode_matches_normal_mode(make_pdf, tmp_path, kind):
+    # StreamingPdfWriter改写了PdfWriter的内部属性，升级PyPDF2时由这里发现行为变化
+    input_path = make_pdf(6, kind=kind)
+    plan = pdfedits.EditPlan([
+        {'op': 'delete', 'pages': '2'},
+        {'op': 'duplicate', 'pages': '1,3', 'copies': 2},
+        {'op': 'rotate', 'pages': '1-2,5', 'angle': 270},
+        {'op': 'reorder', 'order': '9,8,7,6,5,4,3,2,1'},
+        {'op': 'insert_blank', 'after': 4, 'count': 1},
+    ])
+    outputs = {}
+    for large in (False, True):
+        output_path = str(tmp_path / f'large_{large}.pdf')
+        pdfedits.apply_edit_plan(input_path, plan, output_path=output_path, large=large)
+        outputs[large] = page_summary(PdfReader(output_path, strict=True))
+
+    assert len(outputs[True]) == 10
+    assert [page[1] for page in outputs[True]].count(270) == 3
+    assert outputs[True] == outputs[False]
@@ -0,0 +1,38 @@
+import tracemalloc
+
+import pytest
+
+from pdfeditserver.celery_app import redis_client, task_store
+from pdfeditserver.pdfedits import parse_page_spec
+
+def test_page_set_membership():
+    pages = parse_page_spec('2-4,7,9-', 12)
+    assert [page for page in range(0, 14) if page in pages] == [2, 3, 4, 7, 9, 10, 11, 12]
+    assert len(pages) == 8
+    assert pages.to_spec() == '2-4,7,9-12'
+    assert list(parse_page_spec('odd', 5)) == [1, 3, 5]
+
+def test_huge_range_without_page_count_is_compact():
+    tracemalloc.start()
+    try:
+        pages = parse_page_spec('1-2000000000')
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert peak < 1 << 20
+    assert len(pages) == 2000000000
+    assert 1999999999 in pages and 2000000001 not in pages
+    # 得知总页数后按实际页数校验
+    with pytest.raises(ValueError):
+        parse_page_spec(pages, 10)
+
+def test_process_without_page_count_rejects_out_of_range_pages(client, upload, make_pdf):
+    task_id = upload(make_pdf(3))
+    # 上传时读取页数失败的任务
+    redis_client.hdel(task_store._key(task_id), 'total_pages')
+
+    response = client.post('/process', json={'task_id': task_id, 'pages_to_delete': '1-2000000000'})
+    assert response.status_code == 200, response.get_json()
+    task = task_store[task_id]
+    assert task['status'] == 'failed'
+    assert '2000000000' in task['error']
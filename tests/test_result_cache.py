@@ -0,0 +1,41 @@
+import io
+
+from PyPDF2 import PdfReader
+
+def process(client, task_id, pages_to_delete):
+    response = client.post('/process', json={'task_id': task_id, 'pages_to_delete': pages_to_delete})
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+def download_pages(client, task_id):
+    response = client.get(f'/download/{task_id}')
+    assert response.status_code == 200
+    return len(PdfReader(io.BytesIO(response.data)).pages)
+
+def test_reprocessing_task_does_not_change_cached_result(client, upload, make_pdf, app_module):
+    path = make_pdf(10)
+    first = upload(path)
+
+    assert process(client, first, '1')['pages_kept'] == 9
+    assert download_pages(client, first) == 9
+    # 同一个任务再次处理，输出文件被替换
+    assert process(client, first, '1-8')['pages_kept'] == 2
+    assert download_pages(client, first) == 2
+
+    # 相同文件上的相同编辑命中缓存，得到的仍是第一次的结果
+    second = upload(path)
+    result = process(client, second, '1')
+    assert app_module.result_cache.stats()['hits'] == 1
+    assert result['pages_kept'] == 9
+    assert download_pages(client, second) == 9
+
+def test_cache_hit_matches_fresh_result(client, upload, make_pdf, app_module):
+    path = make_pdf(6)
+    first = upload(path)
+    second = upload(path)
+
+    assert process(client, first, 'odd')['pages_kept'] == 3
+    # 结果相同的不同计划共享缓存项
+    assert process(client, second, [1, 3, 5])['pages_kept'] == 3
+    assert app_module.result_cache.stats()['hits'] == 1
+    assert download_pages(client, second) == 3
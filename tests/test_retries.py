@@ -0,0 +1,43 @@
+import pytest
+
+from pdfeditserver import tasks
+from pdfeditserver.celery_app import task_store
+
+@pytest.fixture
+def flaky(monkeypatch):
+    """将指定的函数替换为总是出现临时错误的版本，返回调用次数"""
+    calls = []
+
+    def patch(name):
+        def fail(*args, **kwargs):
+            calls.append(name)
+            raise RuntimeError("连接被重置")
+        monkeypatch.setattr(tasks, name, fail)
+        return calls
+    return patch
+
+def assert_failed_after_retries(task_id, result, calls, max_retries):
+    assert isinstance(result.result, RuntimeError)
+    assert len(calls) == max_retries + 1
+    task = task_store[task_id]
+    assert task['status'] == 'failed'
+    assert f"已重试 {max_retries} 次" in task['error']
+
+def test_process_fails_after_max_retries(upload, make_pdf, flaky):
+    task_id = upload(make_pdf(3))
+    calls = flaky('execute_edit')
+    result = tasks.process_pdf_task.apply((task_id, task_store[task_id]['file_key'], '1', 'input.pdf'))
+    assert_failed_after_retries(task_id, result, calls, tasks.process_pdf_task.max_retries)
+
+def test_split_fails_after_max_retries(upload, make_pdf, flaky):
+    task_id = upload(make_pdf(3))
+    calls = flaky('split_pdf')
+    result = tasks.split_pdf_task.apply((task_id, task_store[task_id]['file_key'], 'input.pdf'), {'every': 1})
+    assert_failed_after_retries(task_id, result, calls, tasks.split_pdf_task.max_retries)
+
+def test_merge_fails_after_max_retries(upload, make_pdf, flaky):
+    task_id = upload(make_pdf(3))
+    calls = flaky('merge_pdfs')
+    file_key = task_store[task_id]['file_key']
+    result = tasks.merge_pdf_task.apply((task_id, [[file_key, None], [file_key, None]]))
+    assert_failed_after_retries(task_id, result, calls, tasks.merge_pdf_task.max_retries)
@@ -0,0 +1,66 @@
+import io
+import zipfile
+
+import pytest
+from PyPDF2 import PdfReader
+
+from pdfeditserver import pdfedits
+from pdfeditserver.pdfedits import parse_split_spec
+
+@pytest.fixture
+def max_parts(monkeypatch):
+    monkeypatch.setattr(pdfedits, 'SPLIT_MAX_PARTS', 3)
+
+def test_every_splits_into_consecutive_parts():
+    assert parse_split_spec(every=4, total_pages=10) == [(1, 4), (5, 8), (9, 10)]
+
+@pytest.mark.usefixtures('max_parts')
+def test_every_respects_part_limit():
+    assert len(parse_split_spec(every=4, total_pages=12)) == 3
+    with pytest.raises(ValueError, match='最多 3 个'):
+        parse_split_spec(every=1, total_pages=4)
+
+@pytest.mark.usefixtures('max_parts')
+def test_ranges_respect_part_limit():
+    assert len(parse_split_spec('1,2,3', total_pages=4)) == 3
+    with pytest.raises(ValueError, match='最多 3 个'):
+        parse_split_spec('1,2,3,4', total_pages=4)
+
+def test_split_endpoint(client, upload, make_pdf):
+    task_id = upload(make_pdf(5))
+    response = client.post('/split', json={'task_id': task_id, 'every': 2})
+    assert response.status_code == 200, response.get_json()
+
+    archive = zipfile.ZipFile(io.BytesIO(client.get(f'/download/{task_id}').data))
+    assert len(archive.namelist()) == 3
+
+@pytest.mark.usefixtures('max_parts')
+def test_split_endpoint_rejects_too_many_parts(client, upload, make_pdf):
+    task_id = upload(make_pdf(5))
+    response = client.post('/split', json={'task_id': task_id, 'every': 1})
+    assert response.status_code == 400
+    assert client.get(f'/status/{task_id}').get_json()['status'] == 'uploaded'
+
+def test_parallel_split_matches_sequential(make_pdf, tmp_path, monkeypatch):
+    contexts = []
+    split_context = pdfedits._split_context
+
+    def recording_context():
+        context = split_context()
+        contexts.append(context.get_start_method())
+        return context
+
+    monkeypatch.setattr(pdfedits, '_split_context', recording_context)
+    path = make_pdf(9)
+    archives = {}
+    for workers in (1, 2):
+        output_path = str(tmp_path / f'split_{workers}.zip')
+        assert pdfedits.split_pdf(path, output_path, every=2, workers=workers) == 5
+        with zipfile.ZipFile(output_path) as archive:
+            archives[workers] = {name: len(PdfReader(io.BytesIO(archive.read(name))).pages)
+                                 for name in archive.namelist()}
+
+    # 进程池不使用fork，只在workers大于1时创建
+    assert contexts and 'fork' not in contexts
+    assert archives[1] == archives[2]
+    assert sorted(archives[1].values()) == [1, 2, 2, 2, 2]
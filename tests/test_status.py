@@ -0,0 +1,57 @@
+import threading
+import time
+
+import pytest
+
+THREADED = {'wsgi.multithread': True}
+
+@pytest.fixture
+def slots(app_module, monkeypatch):
+    """只有一个等待名额"""
+    semaphore = threading.BoundedSemaphore(1)
+    monkeypatch.setattr(app_module, '_watcher_slots', semaphore)
+    monkeypatch.setattr(app_module, 'STATUS_STREAM_TIMEOUT', 0.5)
+    return semaphore
+
+def long_poll(client, task_id, **kwargs):
+    started = time.monotonic()
+    response = client.get(f'/status/{task_id}?wait=5&since=uploaded', **kwargs)
+    assert response.status_code == 200
+    assert response.get_json()['status'] == 'uploaded'
+    return time.monotonic() - started
+
+def test_long_poll_waits_when_slot_available(client, upload, make_pdf, slots):
+    task_id = upload(make_pdf(2))
+    assert long_poll(client, task_id, environ_overrides=THREADED) >= 0.4
+    # 名额已归还
+    assert slots.acquire(blocking=False)
+
+def test_long_poll_returns_immediately_when_watchers_full(client, upload, make_pdf, slots):
+    task_id = upload(make_pdf(2))
+    slots.acquire()
+    assert long_poll(client, task_id, environ_overrides=THREADED) < 0.4
+
+def test_single_threaded_worker_never_waits(client, upload, make_pdf, slots):
+    task_id = upload(make_pdf(2))
+    assert long_poll(client, task_id) < 0.4
+
+def test_event_stream_when_watchers_full(client, upload, make_pdf, app_module, slots):
+    task_id = upload(make_pdf(2))
+    slots.acquire()
+    response = client.get(f'/events/{task_id}', environ_overrides=THREADED)
+    body = response.get_data(as_text=True)
+    assert body.startswith(f'retry: {app_module.SSE_BUSY_RETRY_MS}\n')
+    assert body.count('data: ') == 1
+
+def test_event_stream_releases_slot_on_close(client, upload, make_pdf, slots):
+    task_id = upload(make_pdf(2))
+    response = client.get(f'/events/{task_id}', environ_overrides=THREADED, buffered=False)
+    # 生成器尚未开始时客户端断开
+    assert not slots.acquire(blocking=False)
+    response.close()
+    assert slots.acquire(blocking=False)
+
+def test_event_stream_for_missing_task_releases_slot(client, slots):
+    response = client.get('/events/missing', environ_overrides=THREADED)
+    assert response.status_code == 404
+    assert slots.acquire(blocking=False)
@@ -0,0 +1,78 @@
+import os
+
+import pytest
+
+pytest.importorskip('boto3')
+moto = pytest.importorskip('moto')
+
+from pdfeditserver.storage import S3Storage  # noqa: E402
+
+@pytest.fixture
+def s3(tmp_path, monkeypatch):
+    """moto模拟的S3，读取缓存只能容纳一个文件"""
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    with moto.mock_aws():
+        storage = S3Storage('pdfeditserver-test', prefix='files/', region='us-east-1',
+                            cache_dir=str(tmp_path / 'cache'), cache_max_bytes=1500)
+        storage.client.create_bucket(Bucket='pdfeditserver-test')
+        yield storage
+
+def put(storage, key, data):
+    path = storage.temp_path()
+    with open(path, 'wb') as output_file:
+        output_file.write(data)
+    storage.put_file(key, path)
+
+def test_round_trip(s3):
+    with s3.writing('a.pdf') as path:
+        with open(path, 'wb') as output_file:
+            output_file.write(b'a' * 1000)
+
+    assert s3.exists('a.pdf')
+    assert s3.stat('a.pdf').size == 1000
+    assert s3.open('a.pdf').read() == b'a' * 1000
+    s3.copy('a.pdf', 'cache/b.pdf')
+    assert s3.keys('.pdf') == ['a.pdf']
+
+    s3.delete('a.pdf')
+    assert not s3.exists('a.pdf')
+    with pytest.raises(FileNotFoundError):
+        s3.local_path('a.pdf')
+    # 读取缓存中没有，从对象存储下载
+    with open(s3.local_path('cache/b.pdf'), 'rb') as cached:
+        assert cached.read() == b'a' * 1000
+
+def test_reading_survives_eviction(s3):
+    put(s3, 'a.pdf', b'a' * 1000)
+    with s3.reading('a.pdf') as path:
+        # 另一个任务读取其他文件，超过缓存上限，a.pdf被淘汰
+        put(s3, 'b.pdf', b'b' * 1000)
+        assert not os.path.exists(s3._cache_path('a.pdf'))
+        with open(path, 'rb') as cached:
+            assert cached.read() == b'a' * 1000
+    assert not os.path.exists(path)
+
+def test_reading_downloads_again_when_evicted_before_use(s3, monkeypatch):
+    put(s3, 'a.pdf', b'a' * 1000)
+    local_path = s3.local_path
+    calls = []
+
+    def evicted_local_path(key):
+        path = local_path(key)
+        calls.append(path)
+        if len(calls) == 1:
+            # 返回之后、使用之前被其他进程淘汰
+            os.remove(path)
+        return path
+
+    monkeypatch.setattr(s3, 'local_path', evicted_local_path)
+    with s3.reading('a.pdf') as path:
+        with open(path, 'rb') as cached:
+            assert cached.read() == b'a' * 1000
+    assert len(calls) == 2
+
+def test_reading_missing_object(s3):
+    with pytest.raises(FileNotFoundError):
+        with s3.reading('missing.pdf'):
+            pass
@@ -0,0 +1,119 @@
+import os
+import time
+import threading
+from contextlib import ExitStack
+
+import pytest
+
+from pdfeditserver import upload_sessions as upload_sessions_module
+from pdfeditserver.celery_app import redis_client
+from pdfeditserver.connections import hold_lock
+from pdfeditserver.upload_sessions import upload_sessions
+
+@pytest.fixture
+def pdf_bytes(make_pdf):
+    with open(make_pdf(3), 'rb') as pdf_file:
+        return pdf_file.read()
+
+def create(client, size):
+    response = client.post('/upload/sessions', json={'filename': 'big.pdf', 'size': size})
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()['upload_id']
+
+def put(client, upload_id, data, offset):
+    return client.put(f'/upload/sessions/{upload_id}', data=data, headers={'Upload-Offset': str(offset)})
+
+class BlockingStream:
+    """第一次读取时阻塞，直到测试放行，模拟正在接收的分块"""
+
+    def __init__(self, data):
+        self.data = data
+        self.reading = threading.Event()
+        self.proceed = threading.Event()
+
+    def read(self, size):
+        self.reading.set()
+        self.proceed.wait(5)
+        data, self.data = self.data[:size], self.data[size:]
+        return data
+
+def test_chunked_upload_creates_task(client, pdf_bytes):
+    upload_id = create(client, len(pdf_bytes))
+    middle = len(pdf_bytes) // 2
+
+    assert put(client, upload_id, pdf_bytes[:middle], 0).get_json()['offset'] == middle
+    # 偏移量不一致时返回当前偏移量
+    conflict = put(client, upload_id, pdf_bytes[middle:], 0)
+    assert conflict.status_code == 409
+    assert conflict.headers['Upload-Offset'] == str(middle)
+    assert put(client, upload_id, pdf_bytes[middle:], middle).get_json()['offset'] == len(pdf_bytes)
+
+    response = client.post(f'/upload/sessions/{upload_id}/complete')
+    assert response.status_code == 200, response.get_json()
+    assert response.get_json()['total_pages'] == 3
+    # 会话只能完成一次
+    assert client.post(f'/upload/sessions/{upload_id}/complete').status_code == 404
+
+def test_complete_waits_for_chunk_in_progress(client, pdf_bytes):
+    upload_id = create(client, len(pdf_bytes))
+    stream = BlockingStream(pdf_bytes)
+    session = upload_sessions.get(upload_id)
+    writer = threading.Thread(target=upload_sessions.append, args=(upload_id, session, stream, 0))
+    writer.start()
+    try:
+        assert stream.reading.wait(5)
+        # 分块正在写入时不能完成或删除会话
+        assert client.post(f'/upload/sessions/{upload_id}/complete').status_code == 409
+        assert client.delete(f'/upload/sessions/{upload_id}').status_code == 409
+    finally:
+        stream.proceed.set()
+        writer.join()
+
+    response = client.post(f'/upload/sessions/{upload_id}/complete')
+    assert response.status_code == 200, response.get_json()
+    assert response.get_json()['total_pages'] == 3
+
+def test_request_on_host_without_part_file(client, pdf_bytes):
+    upload_id = create(client, len(pdf_bytes))
+    assert put(client, upload_id, pdf_bytes[:100], 0).status_code == 200
+    # 其他服务器上没有这个会话的临时文件
+    os.remove(upload_sessions.part_path(upload_id))
+
+    response = put(client, upload_id, pdf_bytes[100:], 100)
+    assert response.status_code == 409
+    assert 'offset' not in response.get_json()
+    assert client.get(f'/upload/sessions/{upload_id}').status_code == 409
+
+def test_lock_renewed_while_chunk_is_slow(client, pdf_bytes, monkeypatch):
+    monkeypatch.setattr(upload_sessions_module, 'UPLOAD_LOCK_TIMEOUT', 0.3)
+    upload_id = create(client, len(pdf_bytes))
+    stream = BlockingStream(pdf_bytes)
+    session = upload_sessions.get(upload_id)
+    writer = threading.Thread(target=upload_sessions.append, args=(upload_id, session, stream, 0))
+    writer.start()
+    try:
+        assert stream.reading.wait(5)
+        # 分块接收时间超过锁的过期时间，锁仍被持有
+        time.sleep(1)
+        response = client.post(f'/upload/sessions/{upload_id}/complete')
+        assert response.status_code == 409
+        assert 'offset' not in response.get_json()
+    finally:
+        stream.proceed.set()
+        writer.join()
+    assert client.post(f'/upload/sessions/{upload_id}/complete').status_code == 200
+
+def test_expired_lock_is_not_released_by_previous_holder():
+    with ExitStack() as stack:
+        first = stack.enter_context(hold_lock(redis_client, 'test_lock', 30))
+        assert first is not None
+        # 第一个持有者卡住，锁过期后被另一个请求取得
+        redis_client.delete('test_lock')
+        second = hold_lock(redis_client, 'test_lock', 30)
+        assert second.__enter__() is not None
+    # 第一个持有者结束时不删除第二个持有者的锁
+    assert redis_client.exists('test_lock')
+    with hold_lock(redis_client, 'test_lock', 30) as third:
+        assert third is None
+    second.__exit__(None, None, None)
+    assert not redis_client.exists('test_lock')
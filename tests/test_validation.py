@@ -0,0 +1,86 @@
+import hashlib
+
+import pytest
+
+from pdfeditserver import pdfedits
+from pdfeditserver.blobs import INVALID_PDF_TTL, blob_store
+from pdfeditserver.celery_app import redis_client
+
+# 文件头、文件尾和startxref都正常，但PyPDF2无法读取trailer
+CORRUPT_PDF = (b'%PDF-1.4\n1 0 obj\n<< /Type /Catalog /Pages 2 0 R >>\nendobj\n'
+               b'trailer\n<< /Root 1 0 R /Size 3 >>\nstartxref\n9\n%%EOF\n')
+
+def post_file(client, path):
+    with open(path, 'rb') as pdf_file:
+        return client.post('/upload', data={'file': (pdf_file, 'input.pdf')}, content_type='multipart/form-data')
+
+def digest_of(path):
+    with open(path, 'rb') as pdf_file:
+        return hashlib.sha256(pdf_file.read()).hexdigest()
+
+@pytest.fixture
+def corrupt_pdf(tmp_path):
+    path = tmp_path / 'corrupt.pdf'
+    path.write_bytes(CORRUPT_PDF)
+    return str(path)
+
+@pytest.mark.parametrize('data, message', [
+    (b'', '文件为空'),
+    (b'hello world', '%PDF-'),
+    (b'%PDF-1.4\n1 0 obj\n<< >>\nendobj\n', '%%EOF'),
+    (b'%PDF-1.4\n%%EOF\n', 'startxref'),
+    (b'%PDF-1.4\nstartxref\n999999\n%%EOF\n', '文件之外'),
+])
+def test_structure_validation(tmp_path, data, message):
+    path = tmp_path / 'input.pdf'
+    path.write_bytes(data)
+    with pytest.raises(pdfedits.InvalidPDFError, match=message):
+        pdfedits.validate_pdf_structure(str(path))
+
+def test_corrupt_upload_is_cached_as_invalid(client, corrupt_pdf, monkeypatch):
+    response = post_file(client, corrupt_pdf)
+    assert response.status_code == 400
+    assert response.get_json()['invalid'] is True
+
+    digest = digest_of(corrupt_pdf)
+    assert blob_store.get_invalid(digest) == response.get_json()['error']
+    assert 0 < redis_client.ttl(f"{blob_store.invalid_prefix}{digest}") <= INVALID_PDF_TTL
+
+    # 再次上传时直接按缓存拒绝，不再解析
+    def fail(*args, **kwargs):
+        raise AssertionError("不应再次解析")
+
+    monkeypatch.setattr(pdfedits, 'extract_pdf_metadata', fail)
+    response = post_file(client, corrupt_pdf)
+    assert response.status_code == 400
+    assert response.get_json()['invalid'] is True
+
+def test_unexpected_parser_error_is_not_cached(client, make_pdf, monkeypatch):
+    path = make_pdf(2)
+
+    def broken_reader(*args, **kwargs):
+        raise AttributeError("'NoneType' object has no attribute 'get_object'")
+
+    monkeypatch.setattr(pdfedits, 'PdfReader', broken_reader)
+    response = post_file(client, path)
+    assert response.status_code == 400
+    assert 'AttributeError' in response.get_json()['error']
+    assert blob_store.get_invalid(digest_of(path)) is None
+
+    # 修复后相同内容的文件可以正常上传
+    monkeypatch.undo()
+    response = post_file(client, path)
+    assert response.status_code == 200, response.get_json()
+    assert response.get_json()['total_pages'] == 2
+
+def test_errors_outside_parser_are_not_invalid(client, make_pdf, monkeypatch):
+    path = make_pdf(2)
+
+    def broken_set_document(*args, **kwargs):
+        raise TypeError("程序错误")
+
+    monkeypatch.setattr(blob_store, 'set_document', broken_set_document)
+    response = post_file(client, path)
+    assert response.status_code == 200
+    assert 'invalid' not in response.get_json()
+    assert blob_store.get_invalid(digest_of(path)) is None